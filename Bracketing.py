@@ -0,0 +1,107 @@
+import numpy as np
+
+
+def clippingFractions(array, subsample=8, shadowLevel=4, highlightLevel=251):
+    # Works on a strided view of the preview sized RGB(X) array, no copy of
+    # the full frame is made. A pixel is counted as a clipped highlight when
+    # any of its channels is saturated and as a clipped shadow when all of
+    # them are at the floor.
+    view = array[::subsample, ::subsample, :3]
+    peak = view.max(axis=2)
+    pixels = float(peak.size)
+    shadows = np.count_nonzero(peak <= shadowLevel) / pixels
+    highlights = np.count_nonzero(peak >= highlightLevel) / pixels
+    return shadows, highlights
+
+
+class BracketingEngine:
+    # Schedules the exposures of a bracket on the camera one frame apart
+    # instead of setting one and polling until the sensor catches up.
+    # Each exposure change is tagged with the sensor sequence number of the
+    # frame it was issued on and the buffers coming back are matched to it.
+    # The bracket order is reversed on every other frame so each bracket
+    # starts with the exposure the previous one left the sensor at.
+    def __init__(self, cam, latency=2, maxFrames=24):
+        self.cam = cam
+        self.latency = latency
+        self.maxFrames = maxFrames
+        self.reverse = False
+        self.active = False
+        self.counter = 0
+
+    def reset(self):
+        wasActive = self.active
+        self.reverse = False
+        self.active = False
+        return wasActive
+
+    def order(self, exposures):
+        if self.reverse:
+            return list(reversed(exposures))
+        return list(exposures)
+
+    def sequenceOf(self, metadata):
+        # Not every libcamera build reports SensorSequence, counting the
+        # frames we get is good enough as long as we don't miss any.
+        self.counter += 1
+        if "SensorSequence" in metadata:
+            return metadata["SensorSequence"]
+        return self.counter
+
+    def capture(self, exposures, first, alternate=True):
+        # With alternate=False the exposures are shot in the given order and
+        # the sensor is sent back to the first one once the bracket is done.
+        if alternate:
+            order = self.order(exposures)
+            self.reverse = not self.reverse
+        else:
+            order = list(exposures)
+        self.active = True
+        buffers, metadata = first
+        if not self.cam.exposureMatches(metadata, order[0][1]):
+            # first bracket of a run or the exposure changed from the GUI
+            self.cam.set_controls({"ExposureTime": order[0][1]})
+            buffers, metadata = self.cam.waitExposureChange(order[0][1])
+        taken = [(order[0][0], buffers, metadata)]
+        if len(order) == 1:
+            return taken
+
+        issuedAt = {}
+        seq = self.sequenceOf(metadata)
+        self.cam.set_controls({"ExposureTime": order[1][1]})
+        issuedAt[1] = seq
+        pending = 1
+        frames = 0
+        while pending < len(order) and frames < self.maxFrames:
+            request = self.cam.capture_request()
+            metadata = request.get_metadata()
+            seq = self.sequenceOf(metadata)
+            frames += 1
+            issued = len(issuedAt)
+            if issued < len(order) - 1:
+                issued += 1
+                self.cam.set_controls({"ExposureTime": order[issued][1]})
+                issuedAt[issued] = seq
+            tag, exposure = order[pending]
+            if seq > issuedAt[pending] and self.cam.exposureMatches(metadata, exposure):
+                self.latency = seq - issuedAt[pending]
+                taken.append((tag, [request.make_buffer("main")], metadata))
+                pending += 1
+            request.release()
+
+        # a dropped frame lost one of the scheduled exposures, get the rest
+        # the slow way
+        while pending < len(order):
+            tag, exposure = order[pending]
+            self.cam.set_controls({"ExposureTime": exposure})
+            buffers, metadata = self.cam.waitExposureChange(exposure)
+            taken.append((tag, buffers, metadata))
+            pending += 1
+        if not alternate:
+            self.cam.set_controls({"ExposureTime": order[0][1]})
+        print(f"bracket took {frames + 1} frames, latency {self.latency}")
+        # hand them back in the caller's order so the files are published in
+        # the same order as before, whatever order they were shot in
+        tags = [tag for tag, exposure in exposures]
+        taken.sort(key=lambda t: tags.index(t[0]))
+        return taken
@@ -5,12 +5,38 @@ from threading import Thread
 from time import sleep, time
 from datetime import datetime
 from json import load, dumps
-from os import mkdir, listdir
+from os import mkdir
 from FtpThread import FtpThread
 from LocalThread import LocalThread
+from MirrorThread import MirrorThread
 from ConfigFiles import ConfigFiles
 
 
+def createExport(win, suffix, signal):
+    # the export threads pick their niceness up when they start
+    limiter = win.picam2.queue.limiter
+    limiter.nice = win.settings["ExportNice"]
+    if win.settings["ExportRate"] == "fixed":
+        limiter.setRate(win.settings["ExportRateLimitMB"] * 1000000)
+    else:
+        limiter.setRate(0)
+    saveMode = win.hwSettings.get("saveMode", "ftp")
+    if saveMode in ("local", "mirror"):
+        exportClass = LocalThread if saveMode == "local" else MirrorThread
+        return exportClass(
+            win.projectName.text(),
+            suffix,
+            signal,
+            win.hwSettings["localFilePath"],
+            win.picam2.queue,
+            win.hwSettings.get("localFsyncFrames", 8),
+            win.hwSettings.get("localFsyncSeconds", 2.0),
+            win.hwSettings.get("localSpillover", []),
+            win.hwSettings.get("localReserveMB", 1024) * 1000000,
+        )
+    return FtpThread(win.projectName.text(), suffix, signal, win.picam2.queue)
+
+
 class FrameSequence:
     def __init__(self, win, start_frame, signal):
         self.win = win
@@ -25,6 +51,12 @@ class FrameSequence:
             pass
         self.cam = self.win.picam2
         self.cam.setFileIndex(start_frame)
+        # the film may have been moved by hand since the last run
+        self.cam.setMotionStop(None)
+        self.cam.setPipelined(self.win.settings["PipelinedCapture"])
+        self.timings = self.cam.timings
+        self.timings.begin(f"{self.win.projectName.text()}-timings.jsonl")
+        self.frames = 0
         self.win.light_selector.signal.emit("on")
         self.feeder.enable()
         self.pickup.enable()
@@ -34,6 +66,7 @@ class FrameSequence:
         m1 = MotorThread(self.filmdrive)
         m2 = MotorThread(self.feeder)
         m3 = MotorThread(self.pickup)
+        self.timings.start(self.cam.framecount)
         # self.cam.gcApplySettings()
         if m1.motor.fault or m2.motor.fault or m3.motor.fault:
             self.feeder.disable()
@@ -53,8 +86,11 @@ class FrameSequence:
             self.signal.emit("sensors, wire disconnected...")
             self.signal.emit("---------------------------------------------")
             raise Exception("Capture stopped by Motor Faults!")
+        self.timings.lap("faultCheck")
         sleep(0.1)
+        self.timings.lap("sleep")
         try:
+            self.cam.checkEncoders()
             self.cam.captureCycle()
         except Exception as e:
             self.feeder.disable()
@@ -64,12 +100,38 @@ class FrameSequence:
             self.signal.emit("syncMotors")
             self.signal.emit("turning lights off")
             raise Exception("Stop")
+        self.timings.lap("output")
         m2.start()
         m3.start()
         m3.join()
         m2.join()
+        self.timings.lap("reels")
         m1.start()
         m1.join()
+        self.timings.lap("filmdrive")
+        stops = [m.motor.stopTime for m in (m1, m2, m3) if m.motor.stopTime != None]
+        if len(stops) > 0:
+            self.cam.setMotionStop(max(stops))
+
+    def commitTimings(self):
+        self.timings.commit()
+        self.frames += 1
+        if self.frames % self.win.settings["TimingsFlushFrames"] == 0:
+            self.timings.flush()
+        if self.frames % self.win.settings["TimingsSummaryFrames"] == 0:
+            for line in self.timings.summary():
+                self.signal.emit(line)
+
+    def finish(self):
+        # let the encoder pool write out the frames still in flight
+        try:
+            self.cam.finishSequence()
+        except Exception as e:
+            self.signal.emit("Failure to save image: {}".format(e))
+        self.timings.flush(final=True)
+        if self.frames > 0:
+            for line in self.timings.summary():
+                self.signal.emit(line)
 
 
 class MotorThread(Thread):
@@ -87,17 +149,26 @@ class CaptureLoop(QThread):
         self.signal = signal
         self.win = win
         self.Loop = True
+        self.throttling = False
+        self.lastShape = None
+        self.framePeriod = None
+        self.frameBytes = None
         self.captureModes = ConfigFiles("captureModes.json")
 
     def run(self):
         # send msgs
         self.signal.emit("Capture loop start")
-        currentFilmFormatCfg = self.win.hwSettings["filmFormats"][
-            self.win.filmFormat.currentText()
-        ]
-        self.win.motors["feeder"].motor.setFormat(currentFilmFormatCfg["feeder"])
-        self.win.motors["filmdrive"].motor.setFormat(currentFilmFormatCfg["filmdrive"])
-        self.win.motors["pickup"].motor.setFormat(currentFilmFormatCfg["pickup"])
+        filmFormat = self.win.filmFormat.currentText()
+        currentFilmFormatCfg = self.win.hwSettings["filmFormats"][filmFormat]
+        self.win.motors["feeder"].motor.setFormat(
+            currentFilmFormatCfg["feeder"], filmFormat
+        )
+        self.win.motors["filmdrive"].motor.setFormat(
+            currentFilmFormatCfg["filmdrive"], filmFormat
+        )
+        self.win.motors["pickup"].motor.setFormat(
+            currentFilmFormatCfg["pickup"], filmFormat
+        )
 
         self.win.motors["feeder"].motor.enable()
         self.win.motors["filmdrive"].motor.enable()
@@ -115,25 +186,15 @@ class CaptureLoop(QThread):
             self.win.reelsDirection.currentText()
         )
 
-        if (
-            "saveMode" in self.win.hwSettings
-            and self.win.hwSettings["saveMode"] == "local"
-        ):
-            self.export = LocalThread(
-                self.win.projectName.text(),
-                self.captureModes[self.win.captureMode.currentText()]["suffix"],
-                self.signal,
-                self.win.hwSettings["localFilePath"],
-            )
-        else:
-            self.export = FtpThread(
-                self.win.projectName.text(),
-                self.captureModes[self.win.captureMode.currentText()]["suffix"],
-                self.signal,
-            )
+        self.export = createExport(
+            self.win,
+            self.captureModes[self.win.captureMode.currentText()]["suffix"],
+            self.signal,
+        )
         start = self.export.getStartPoint()
         self.export.start()
         self.sequence = FrameSequence(self.win, start, self.signal)
+        queue = self.win.picam2.queue
 
         while self.Loop:
             try:
@@ -141,32 +202,78 @@ class CaptureLoop(QThread):
             except Exception as e:
                 self.signal.emit(str(e))
                 self.stopLoop()
-            if len(listdir("/dev/shm/complete")) > 6:
-                self.signal.emit("too many files waiting")
-                self.signal.emit("waiting up to 5 mins")
-                timeout = time() + 300
-                while (
-                    self.Loop
-                    and timeout > time()
-                    and len(listdir("/dev/shm/complete")) > 6
-                ):
-                    sleep(0.1)
-                if timeout <= time():
-                    self.signal.emit("timeout xfer error")
-                    self.stopLoop()
+            self.throttle(queue)
+            self.sequence.timings.lap("queueWait")
+            self.shapeExport(queue)
+            self.sequence.commitTimings()
+        self.sequence.finish()
+        self.win.motors["feeder"].motor.saveLearned()
+        self.win.motors["filmdrive"].motor.saveLearned()
+        self.win.motors["pickup"].motor.saveLearned()
+        # nothing left to protect, drain as fast as possible
+        queue.limiter.setRate(0)
         self.signal.emit("waiting up to 2 minutes for transfer queue to be cleared")
-        timeout = time() + 120
-        while len(listdir("/dev/shm/complete")) > 0:
-            sleep(0.1)
-            if time() > timeout:
-                self.signal.emit("TIMEOUT waiting for end")
-                break
+        if not queue.waitBelow(0, 120):
+            self.signal.emit("TIMEOUT waiting for end")
 
         self.signal.emit("stopping Export")
         self.export.stopLoop()
         self.export.join()
         self.signal.emit("Capture stopped!")
 
+    def throttle(self, queue):
+        # The film advance slows down progressively as the frames waiting
+        # for the export fill up /dev/shm, and only stops once they would
+        # no longer fit.
+        settings = self.win.settings
+        reserve = settings["ShmReserveMB"] * 1000000
+        limit = settings["QueueLimitMB"] * 1000000
+        start = settings["ThrottleStart"]
+        fill = queue.fill(reserve, limit)
+        if fill >= 1.0:
+            self.signal.emit(
+                f"no room left for frames ({queue.pendingBytes() // 1000000}MB waiting)"
+            )
+            self.signal.emit("waiting up to 5 mins")
+            room = queue.waitFor(
+                lambda: queue.fill(reserve, limit) < 1.0, 300, lambda: self.Loop
+            )
+            if not room and self.Loop:
+                self.signal.emit("timeout xfer error")
+                self.stopLoop()
+        elif fill > start:
+            if not self.throttling:
+                self.signal.emit(
+                    f"export falling behind, slowing down ({fill:.0%} full)"
+                )
+            sleep(settings["ThrottleMaxDelay"] * (fill - start) / (1.0 - start))
+        self.throttling = fill > start
+
+    def shapeExport(self, queue):
+        # In adaptive mode the export gets the bandwidth it needs to keep up
+        # with what the capture produces and to work off what is waiting,
+        # and no more, so it doesn't steal the bus and CPU from the capture.
+        if self.win.settings["ExportRate"] != "adaptive":
+            return
+        now = time()
+        published = queue.publishedBytes
+        if self.lastShape != None:
+            period = now - self.lastShape[0]
+            produced = published - self.lastShape[1]
+            if self.framePeriod == None:
+                self.framePeriod = period
+                self.frameBytes = produced
+            else:
+                self.framePeriod += 0.2 * (period - self.framePeriod)
+                self.frameBytes += 0.2 * (produced - self.frameBytes)
+            queue.limiter.adapt(
+                self.framePeriod,
+                self.frameBytes,
+                queue.pendingBytes(),
+                self.win.settings["ExportRateHeadroom"],
+            )
+        self.lastShape = (now, published)
+
     def stopLoop(self):
         self.signal.emit("Stopping Loop")
         self.Loop = False
@@ -248,6 +355,7 @@ class singleShotEvent(QThread):
 
     def run(self):
         self.picam2.captureCycle()
+        self.picam2.finishSequence()
         self.signal.emit("captureDone")
 
 
@@ -269,22 +377,11 @@ class SnapshotWidget(QPushButton):
     def initialize(self):
         self.disableExportIfRunning()
         self.projectName = self.win.projectName.text()
-        if (
-            "saveMode" in self.win.hwSettings
-            and self.win.hwSettings["saveMode"] == "local"
-        ):
-            self.export = LocalThread(
-                self.win.projectName.text(),
-                self.captureModes[self.win.captureMode.currentText()]["suffix"],
-                self.signal,
-                self.win.hwSettings["localFilePath"],
-            )
-        else:
-            self.export = FtpThread(
-                self.win.projectName.text(),
-                self.captureModes[self.win.captureMode.currentText()]["suffix"],
-                self.signal,
-            )
+        self.export = createExport(
+            self.win,
+            self.captureModes[self.win.captureMode.currentText()]["suffix"],
+            self.signal,
+        )
         self.win.picam2.setFileIndex(self.export.getStartPoint())
         self.export.start()
 
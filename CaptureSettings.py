@@ -80,6 +80,7 @@ class CaptureModeWidget(QComboBox):
     def handle(self, text):
         self.win.out.append(f"Capture Mode changed to {text}")
         self.win.settings["CaptureMode"] = text
+        self.win.picam2.setCaptureMode(text)
 
     def currentMode():
         return self.modes[self.currentText()]
@@ -10,6 +10,7 @@ class ConfigFiles(dict):
             "GugusseSettings.json": self.getDefaultGugusseSettings,
             "hardwarecfg.json": self.getDefaultHardwareSettings,
             "captureModes.json": self.getDefaultCaptureModes,
+            "learnedSpeeds.json": self.getDefaultLearnedSpeeds,
         }
         try:
             with open(filename, "rt") as h:
@@ -18,15 +19,37 @@ class ConfigFiles(dict):
             data = self.config[filename]()
             with open(filename, "wt") as h:
                 json.dump(data, h, indent=4)
+        if filename == "captureModes.json":
+            self.addMissingModes(data, self.config[filename]())
         super(ConfigFiles, self).__init__(data)
 
+    def addMissingModes(self, data, defaults):
+        # a file written by an older version gets the modes and the mode
+        # settings added since, what is in the file is left as it is
+        for name, mode in defaults.items():
+            if name not in data:
+                data[name] = mode
+            elif isinstance(data[name], dict):
+                for key, value in mode.items():
+                    data[name].setdefault(key, value)
+
     def save(self):
         with open(f"_{self.filename}", "wt") as h:
             json.dump(dict(self), h, sort_keys=True, indent=4)
         shutil.move(f"_{self.filename}", self.filename)
 
     def getDefaultFtpSettings(self):
-        return {"passwd": "", "path": "", "server": "", "user": ""}
+        return {
+            "passwd": "",
+            "path": "",
+            "server": "",
+            "user": "",
+            "port": 21,
+            "concurrency": 2,
+            "timeout": 30,
+            "retryDelay": 1.0,
+            "maxRetryDelay": 60.0,
+        }
 
     def getDefaultGugusseSettings(self):
         return {
@@ -43,6 +66,20 @@ class ConfigFiles(dict):
             "hflip": False,
             "ReelsDirection": "cw",
             "CaptureMode": "DNG",
+            "PipelinedCapture": False,
+            "EncoderWorkers": 2,
+            "SettleMilliseconds": 0,
+            "PackedRaw": False,
+            "TimingsFlushFrames": 50,
+            "TimingsSummaryFrames": 500,
+            "ShmReserveMB": 256,
+            "QueueLimitMB": 0,
+            "ThrottleStart": 0.5,
+            "ThrottleMaxDelay": 1.0,
+            "ExportRate": "off",
+            "ExportRateLimitMB": 0,
+            "ExportRateHeadroom": 1.5,
+            "ExportNice": 10,
         }
 
     def getDefaultCaptureModes(self):
@@ -50,17 +87,40 @@ class ConfigFiles(dict):
             "DNG": {
                 "description": "12bits DNGs",
                 "suffix": "dng",
+                "writer": "stream",
+                "packDng": True,
             },
             "singleJpg": {
                 "description": "simple jpg",
                 "suffix": "jpg",
             },
             "bracketing": {
-                "description": "Bracketing (0,+1,-1) JPGs ",
+                "description": "Bracketing JPGs, evStep apart around the mid exposure",
                 "suffix": "jpg",
+                "exposures": 3,
+                "evStep": 1.0,
+            },
+            "adaptiveBracketing": {
+                "description": "Bracketing only when the mid exposure clips",
+                "suffix": "jpg",
+                "exposures": 3,
+                "evStep": 1.0,
+                "subsample": 8,
+                "shadowLevel": 4,
+                "highlightLevel": 251,
+                "clipFraction": 0.002,
+            },
+            "packedRaw": {
+                "description": "Raw frames appended to segment files",
+                "suffix": "gsr",
+                "framesPerSegment": 24,
             },
         }
 
+    def getDefaultLearnedSpeeds(self):
+        # written by the motors' speed controllers, see SpeedController.py
+        return {}
+
     def getDefaultHardwareSettings(self):
         return {
             "feeder": {
@@ -0,0 +1,82 @@
+import os
+import ctypes
+import ctypes.util
+import struct
+from select import select
+from threading import Thread
+from time import sleep
+
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+eventHeader = struct.Struct("iIII")
+
+
+def openInotify(directory):
+    # None when the kernel or the libc don't do inotify
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, directory.encode(), IN_MOVED_TO) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+class DirectoryWatcher(Thread):
+    # Calls found(name) for every file renamed into the directory, the way
+    # the capture side publishes its frames. Falls back to listing the
+    # directory every "interval" seconds when inotify isn't available.
+    # It is meant to live as long as the program, with inotify stopLoop()
+    # only takes effect on the next event.
+    def __init__(self, directory, found, interval=1.0, useInotify=True):
+        Thread.__init__(self, daemon=True)
+        self.directory = directory
+        self.found = found
+        self.interval = interval
+        self.Loop = True
+        self.fd = None
+        if useInotify:
+            self.fd = openInotify(directory)
+
+    def usesInotify(self):
+        return self.fd != None
+
+    def run(self):
+        if self.fd == None:
+            self.poll()
+            return
+        try:
+            while self.Loop:
+                # no timeout, an idle capture costs no wakeups at all
+                readable, w, x = select([self.fd], [], [])
+                if len(readable) == 0:
+                    continue
+                try:
+                    data = os.read(self.fd, 65536)
+                except BlockingIOError:
+                    continue
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = eventHeader.unpack_from(data, offset)
+                    offset += eventHeader.size
+                    name = data[offset : offset + length].rstrip(b"\0").decode()
+                    offset += length
+                    if mask & IN_MOVED_TO:
+                        self.found(name)
+        finally:
+            os.close(self.fd)
+
+    def poll(self):
+        while self.Loop:
+            for name in sorted(os.listdir(self.directory)):
+                if os.path.isfile(os.path.join(self.directory, name)):
+                    self.found(name)
+            sleep(self.interval)
+
+    def stopLoop(self):
+        self.Loop = False
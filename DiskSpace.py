@@ -0,0 +1,58 @@
+import os
+from time import time
+
+
+class DiskSpace:
+    # Keeps track of the room left on the local volumes, given in order of
+    # preference. The estimate comes down with every write, statvfs() is
+    # only called every "recheckSeconds" to correct the drift and before
+    # giving up on a volume. The frames go to the first volume that keeps
+    # more than "reserve" bytes free, one that can't be reached counts as
+    # full.
+    def __init__(self, directories, reserve, recheckSeconds=30.0):
+        self.directories = directories
+        self.reserve = reserve
+        self.recheckSeconds = recheckSeconds
+        self.current = 0
+        self.free = None
+        self.checked = 0
+
+    def measure(self, index):
+        try:
+            st = os.statvfs(self.directories[index])
+        except OSError:
+            return 0
+        return st.f_bavail * st.f_frsize
+
+    def refresh(self):
+        self.free = self.measure(self.current)
+        self.checked = time()
+
+    def pick(self, size):
+        # where the next "size" bytes go, None when every volume is full
+        if self.current >= len(self.directories):
+            return None
+        if self.free == None or time() - self.checked > self.recheckSeconds:
+            self.refresh()
+        elif self.free - size < self.reserve:
+            # the estimate may be off, ask before moving on
+            self.refresh()
+        while self.free - size < self.reserve:
+            if self.current + 1 >= len(self.directories):
+                return None
+            self.current += 1
+            self.refresh()
+        return self.directories[self.current]
+
+    def spent(self, size):
+        self.free -= size
+
+    def full(self):
+        # the volume said so itself (ENOSPC), whatever statvfs() claims
+        self.current += 1
+        self.free = None
+
+    def rewind(self):
+        # start over from the preferred volume, someone may have made room
+        self.current = 0
+        self.free = None
@@ -0,0 +1,236 @@
+import os
+import struct
+import numpy as np
+from RawPacking import convertBand
+
+# Minimal streaming DNG writer for the raw stream. The header and the IFD
+# are built in a small bytes object, the picture itself goes straight from
+# the camera buffer (a memoryview, one slice per row so the stride padding
+# is skipped) to the file descriptor with writev, nothing is copied in
+# Python on the way. With pack=True the 12 bits samples are packed the DNG
+# way instead, a band of rows at a time, for files a quarter smaller.
+# CSI-2 packed buffers (PackedRaw) are converted here too, band by band, so
+# the frame stays packed in memory until it is on its way to the file.
+
+BYTE = 1
+ASCII = 2
+SHORT = 3
+LONG = 4
+RATIONAL = 5
+SRATIONAL = 10
+
+typeFormats = {BYTE: "B", SHORT: "H", LONG: "I"}
+
+# XYZ (D65) to linear sRGB
+xyzToSrgb = [
+    [3.2404542, -1.5371385, -0.4985314],
+    [-0.9692660, 1.8760108, 0.0415560],
+    [0.0556434, -0.2040259, 1.0572252],
+]
+
+cfaColors = {"R": 0, "G": 1, "B": 2}
+
+IOV_MAX = 1024
+BAND_ROWS = 64
+
+
+def invert3x3(m):
+    a, b, c = m[0]
+    d, e, f = m[1]
+    g, h, i = m[2]
+    det = a * (e * i - f * h) - b * (d * i - f * g) + c * (d * h - e * g)
+    return [
+        [(e * i - f * h) / det, (c * h - b * i) / det, (b * f - c * e) / det],
+        [(f * g - d * i) / det, (a * i - c * g) / det, (c * d - a * f) / det],
+        [(d * h - e * g) / det, (b * g - a * h) / det, (a * e - b * d) / det],
+    ]
+
+
+def multiply3x3(a, b):
+    return [
+        [sum(a[r][k] * b[k][c] for k in range(3)) for c in range(3)] for r in range(3)
+    ]
+
+
+def colorMatrix(metadata):
+    # The ISP's CCM takes white balanced camera RGB to sRGB, DNG wants XYZ to
+    # camera native: diag(1/gains) * inverse(CCM) * XYZtoSRGB
+    redGain, blueGain = metadata["ColourGains"]
+    ccm = metadata["ColourCorrectionMatrix"]
+    ccm = [list(ccm[0:3]), list(ccm[3:6]), list(ccm[6:9])]
+    m = multiply3x3(invert3x3(ccm), xyzToSrgb)
+    gains = [redGain, 1.0, blueGain]
+    return [[m[r][c] / gains[r] for c in range(3)] for r in range(3)]
+
+
+def rawFormat(fmt):
+    # "SRGGB12_CSI2P" -> ([0, 1, 1, 2], 12, True)
+    name = str(fmt)
+    pattern = [cfaColors[c] for c in name[1:5]]
+    bits = int(name[5:].split("_")[0])
+    return pattern, bits, name.endswith("_CSI2P")
+
+
+def canWrite(rawConfig):
+    try:
+        pattern, bits, packed = rawFormat(rawConfig["format"])
+    except (KeyError, ValueError):
+        return False
+    return not packed or bits in (10, 12)
+
+
+class IfdBuilder:
+    def __init__(self):
+        self.entries = []
+
+    def add(self, tag, kind, values):
+        if kind == ASCII:
+            data = values.encode("ascii") + b"\0"
+            count = len(data)
+        elif kind in (RATIONAL, SRATIONAL):
+            fmt = "<ii" if kind == SRATIONAL else "<II"
+            data = b"".join(struct.pack(fmt, n, d) for n, d in values)
+            count = len(values)
+        else:
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            data = struct.pack(f"<{len(values)}{typeFormats[kind]}", *values)
+            count = len(values)
+        self.entries.append((tag, kind, count, data))
+
+    def build(self, ifdOffset):
+        # the IFD followed by the values that don't fit in their entry
+        self.entries.sort()
+        tableSize = 2 + 12 * len(self.entries) + 4
+        extraOffset = ifdOffset + tableSize
+        table = struct.pack("<H", len(self.entries))
+        extra = b""
+        for tag, kind, count, data in self.entries:
+            if len(data) <= 4:
+                table += struct.pack("<HHI", tag, kind, count) + data.ljust(4, b"\0")
+            else:
+                table += struct.pack(
+                    "<HHII", tag, kind, count, extraOffset + len(extra)
+                )
+                extra += data
+                if len(extra) % 2:
+                    extra += b"\0"
+        table += struct.pack("<I", 0)
+        return table + extra
+
+
+def rational(value, denominator=10000):
+    return (int(round(value * denominator)), denominator)
+
+
+def dngHeader(
+    width, height, bitsPerSample, rowBytes, pattern, whiteLevel, metadata, model
+):
+    stripBytes = rowBytes * height
+    blackLevels = metadata.get("SensorBlackLevels", [4096, 4096, 4096, 4096])
+    shift = 16 - (whiteLevel.bit_length())
+    ifd = IfdBuilder()
+    ifd.add(254, LONG, 0)
+    ifd.add(256, LONG, width)
+    ifd.add(257, LONG, height)
+    ifd.add(258, SHORT, bitsPerSample)
+    ifd.add(259, SHORT, 1)
+    ifd.add(262, SHORT, 32803)
+    ifd.add(271, ASCII, "RaspberryPi")
+    ifd.add(272, ASCII, model)
+    ifd.add(273, LONG, 0)  # patched below once the layout is known
+    ifd.add(274, SHORT, 1)
+    ifd.add(277, SHORT, 1)
+    ifd.add(278, LONG, height)
+    ifd.add(279, LONG, stripBytes)
+    ifd.add(284, SHORT, 1)
+    ifd.add(305, ASCII, "GugusseRoller")
+    ifd.add(33421, SHORT, [2, 2])
+    ifd.add(33422, BYTE, pattern)
+    if "ExposureTime" in metadata:
+        ifd.add(33434, RATIONAL, [(int(metadata["ExposureTime"]), 1000000)])
+    if "AnalogueGain" in metadata:
+        ifd.add(34855, SHORT, int(metadata["AnalogueGain"] * 100))
+    ifd.add(50706, BYTE, [1, 4, 0, 0])
+    ifd.add(50707, BYTE, [1, 1, 0, 0])
+    ifd.add(50708, ASCII, f"RaspberryPi {model}")
+    ifd.add(50713, SHORT, [2, 2])
+    ifd.add(50714, LONG, [int(b) >> shift for b in blackLevels])
+    ifd.add(50717, LONG, whiteLevel)
+    if "ColourGains" in metadata and "ColourCorrectionMatrix" in metadata:
+        matrix = colorMatrix(metadata)
+        ifd.add(50721, SRATIONAL, [rational(v) for row in matrix for v in row])
+        redGain, blueGain = metadata["ColourGains"]
+        ifd.add(
+            50728, RATIONAL, [rational(1.0 / redGain), (1, 1), rational(1.0 / blueGain)]
+        )
+    ifd.add(50778, SHORT, 21)
+
+    # two passes, the first one only to learn where the picture will land
+    body = ifd.build(8)
+    dataOffset = 8 + len(body)
+    dataOffset += (-dataOffset) % 4
+    ifd.entries = [e for e in ifd.entries if e[0] != 273]
+    ifd.add(273, LONG, dataOffset)
+    body = ifd.build(8)
+    header = b"II*\0" + struct.pack("<I", 8) + body
+    return header.ljust(dataOffset, b"\0")
+
+
+def writeAll(fd, views):
+    # writev() may stop short, carry on from wherever it did
+    for start in range(0, len(views), IOV_MAX):
+        batch = views[start : start + IOV_MAX]
+        written = os.writev(fd, batch)
+        expected = sum(len(v) for v in batch)
+        if written == expected:
+            continue
+        for v in batch:
+            if written >= len(v):
+                written -= len(v)
+                continue
+            v = v[written:]
+            written = 0
+            while len(v) > 0:
+                v = v[os.write(fd, v) :]
+
+
+def writeDng(fd, view, rawConfig, metadata, model, pack=False):
+    # view: memoryview (or anything exposing the buffer protocol) of the raw
+    # stream laid out as rawConfig describes it
+    width, height = rawConfig["size"]
+    stride = rawConfig["stride"]
+    pattern, bits, packed = rawFormat(rawConfig["format"])
+    whiteLevel = (1 << bits) - 1
+    flat = memoryview(view).cast("B")
+    if packed or (pack and bits == 12):
+        outBits = 12 if pack and bits == 12 else 16
+        rowBytes = width * outBits // 8
+        header = dngHeader(
+            width, height, outBits, rowBytes, pattern, whiteLevel, metadata, model
+        )
+        os.write(fd, header)
+        rows = np.frombuffer(flat, dtype=np.uint8, count=stride * height)
+        rows = rows.reshape((height, stride))
+        for top in range(0, height, BAND_ROWS):
+            band = convertBand(rows[top : top + BAND_ROWS], width, bits, packed, pack)
+            writeAll(fd, [memoryview(band).cast("B")])
+        return rowBytes * height
+    rowBytes = width * 2
+    header = dngHeader(
+        width, height, 16, rowBytes, pattern, whiteLevel, metadata, model
+    )
+    os.write(fd, header)
+    if stride == rowBytes:
+        writeAll(fd, [flat[: rowBytes * height]])
+    else:
+        writeAll(fd, [flat[r * stride : r * stride + rowBytes] for r in range(height)])
+    return rowBytes * height
+
+
+def saveDng(filename, view, rawConfig, metadata, model, pack=False):
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        return writeDng(fd, view, rawConfig, metadata, model, pack)
+    finally:
+        os.close(fd)
@@ -0,0 +1,101 @@
+from threading import Thread, Lock, Event
+from queue import Queue
+
+
+class EncoderWorker(Thread):
+    def __init__(self, pool):
+        Thread.__init__(self, daemon=True)
+        self.pool = pool
+
+    def run(self):
+        while True:
+            job = self.pool.jobs.get()
+            if job is None:
+                self.pool.jobs.task_done()
+                return
+            function, args = job
+            try:
+                function(*args)
+            except Exception as e:
+                self.pool.recordError(e)
+            finally:
+                self.pool.jobs.task_done()
+
+
+class JobGroup:
+    # Counts down the jobs of one frame, "then" runs in the worker that
+    # finishes last, unless one of the jobs failed.
+    def __init__(self, count, then=None, args=()):
+        self.remaining = count
+        self.then = then
+        self.args = args
+        self.failed = False
+        self.lock = Lock()
+        self.done = Event()
+
+    def run(self, function, *args):
+        try:
+            function(*args)
+        except Exception:
+            self.failed = True
+            raise
+        finally:
+            with self.lock:
+                self.remaining -= 1
+                last = self.remaining == 0
+            if last:
+                try:
+                    if self.then != None and not self.failed:
+                        self.then(*self.args)
+                finally:
+                    self.done.set()
+
+    def wait(self):
+        self.done.wait()
+
+
+class EncoderPool:
+    # Bounded pool of encoding threads. submit() blocks once "depth" jobs are
+    # waiting so the capture side can never get more than a few raw buffers
+    # ahead of the disk.
+    def __init__(self, workers=2, depth=None):
+        if depth == None:
+            depth = workers
+        self.jobs = Queue(maxsize=max(1, depth))
+        self.lock = Lock()
+        self.errors = []
+        self.workers = []
+        for i in range(max(1, workers)):
+            worker = EncoderWorker(self)
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, function, *args):
+        self.jobs.put((function, args))
+
+    def group(self, count, then=None, *args):
+        return JobGroup(count, then, args)
+
+    def recordError(self, e):
+        with self.lock:
+            self.errors.append(e)
+
+    def checkErrors(self):
+        with self.lock:
+            if len(self.errors) == 0:
+                return
+            e = self.errors[0]
+            self.errors = []
+        raise Exception(f"encoder failure: {e}")
+
+    def drain(self):
+        self.jobs.join()
+        self.checkErrors()
+
+    def stop(self):
+        self.jobs.join()
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
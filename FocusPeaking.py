@@ -9,7 +9,7 @@ from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QImage, QPixmap
 from picamera2 import Picamera2
 import cv2
-import RPi.GPIO as GPIO
+from GpioBackend import GPIO
 
 # GPIO setup
 GPIO.setwarnings(False)
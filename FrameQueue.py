@@ -0,0 +1,148 @@
+import os
+from collections import deque
+from threading import Condition
+from time import time
+from DirectoryWatcher import DirectoryWatcher
+from RateLimiter import RateLimiter
+
+COMPLETE = "/dev/shm/complete"
+
+
+class QueuedFrame:
+    def __init__(self, name, path, size, info=None):
+        self.name = name
+        self.path = path
+        self.size = size
+        self.data = None
+        # what the camera knew about the frame, for the manifest
+        self.info = info if info != None else {}
+
+
+class FrameQueue:
+    # Hands the finished files over from the camera to the export thread.
+    # The files still live in /dev/shm/complete, the queue only tells the
+    # exporter about them as soon as they land, in the order they landed, so
+    # nobody has to poll and sort that directory any more. A frame counts as
+    # pending until the exporter is done() with it. Files renamed into the
+    # directory by anything else are picked up by the watcher.
+    def __init__(self, directory=COMPLETE):
+        self.directory = directory
+        self.items = deque()
+        self.known = set()
+        # the info of the frames being published, until they are queued
+        self.expected = {}
+        self.taken = 0
+        self.bytes = 0
+        self.condition = Condition()
+        self.watcher = None
+        self.stopping = False
+        self.publishedBytes = 0
+        # shared by whatever exports the frames, the capture loop sets its rate
+        self.limiter = RateLimiter()
+
+    def rescan(self):
+        # whatever a previous run left behind goes first
+        os.makedirs(self.directory, exist_ok=True)
+        with self.condition:
+            self.stopping = False
+        for name in sorted(os.listdir(self.directory)):
+            path = os.path.join(self.directory, name)
+            if os.path.isfile(path):
+                self.put(name)
+
+    def watch(self):
+        if self.watcher == None:
+            self.watcher = DirectoryWatcher(self.directory, self.put)
+            self.watcher.start()
+
+    def put(self, name, info=None):
+        path = os.path.join(self.directory, name)
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            # already exported by the time the watcher heard of it
+            return
+        with self.condition:
+            if name in self.known:
+                return
+            info = self.expected.pop(name, info)
+            self.known.add(name)
+            self.bytes += size
+            self.publishedBytes += size
+            self.items.append(QueuedFrame(name, path, size, info))
+            self.condition.notify_all()
+
+    def publish(self, filename, name, info=None):
+        # the watcher may hear of the file before the put() below, the info
+        # is left for whichever of the two queues it first
+        with self.condition:
+            self.expected[name] = info
+        try:
+            os.rename(filename, os.path.join(self.directory, name))
+        except Exception:
+            with self.condition:
+                self.expected.pop(name, None)
+            raise
+        self.put(name)
+
+    def interrupt(self):
+        # get() returns None from now on whenever the queue is empty
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+    def get(self, timeout=None):
+        with self.condition:
+            self.condition.wait_for(
+                lambda: len(self.items) > 0 or self.stopping, timeout
+            )
+            if len(self.items) == 0:
+                return None
+            self.taken += 1
+            return self.items.popleft()
+
+    def done(self, item):
+        with self.condition:
+            self.taken -= 1
+            self.bytes -= item.size
+            self.known.discard(item.name)
+            self.condition.notify_all()
+
+    def pending(self):
+        with self.condition:
+            return len(self.items) + self.taken
+
+    def pendingBytes(self):
+        with self.condition:
+            return self.bytes
+
+    def fill(self, reserve, limit=0):
+        # How full the queue is, 1.0 meaning no more room. The room is what
+        # the pending frames already take plus what is free on the tmpfs
+        # beyond the reserve, capped to limit when there is one.
+        st = os.statvfs(self.directory)
+        free = st.f_bavail * st.f_frsize
+        queued = self.pendingBytes()
+        budget = queued + max(0, free - reserve)
+        if limit > 0:
+            budget = min(budget, limit)
+        if budget <= 0:
+            return 1.0
+        return queued / budget
+
+    def waitFor(self, predicate, timeout=None, keepWaiting=None):
+        # True once predicate() holds, False on timeout or as soon as
+        # keepWaiting() says to give up. Woken up by every done().
+        deadline = None if timeout == None else time() + timeout
+        while not predicate():
+            if keepWaiting != None and not keepWaiting():
+                return False
+            remaining = 0.1 if deadline == None else deadline - time()
+            if remaining <= 0:
+                return False
+            with self.condition:
+                self.condition.wait(min(0.1, remaining))
+        return True
+
+    def waitBelow(self, count, timeout=None, keepWaiting=None):
+        return self.waitFor(lambda: self.pending() <= count, timeout, keepWaiting)
@@ -0,0 +1,106 @@
+import json
+from threading import Lock, local
+from time import perf_counter, time
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[int(round(p * (len(ordered) - 1)))]
+
+
+class FrameTimings:
+    # Where a frame's time goes. Every thread has its own current record and
+    # lap() charges the time since its previous lap to a stage of it, so the
+    # encoder workers can add their stages to the frame they are working on.
+    # Records are kept in a fixed size ring and appended to a JSONL file a
+    # batch at a time, a few frames behind so the workers are done with them.
+    def __init__(self, size=1024, lag=8):
+        self.ring = [None] * size
+        self.count = 0
+        self.flushed = 0
+        self.lag = lag
+        self.filename = None
+        self.lock = Lock()
+        self.local = local()
+
+    def begin(self, filename):
+        with self.lock:
+            self.ring = [None] * len(self.ring)
+            self.count = 0
+            self.flushed = 0
+            self.filename = filename
+
+    def start(self, frame):
+        self.local.record = {"frame": frame, "time": round(time(), 3)}
+        self.local.mark = perf_counter()
+
+    def lap(self, stage):
+        record = getattr(self.local, "record", None)
+        if record == None:
+            return
+        now = perf_counter()
+        elapsed = (now - self.local.mark) * 1000.0
+        self.local.mark = now
+        with self.lock:
+            record[stage] = round(record.get(stage, 0.0) + elapsed, 3)
+
+    def note(self, stage):
+        # a stage that took no time this frame still shows up in its record
+        record = getattr(self.local, "record", None)
+        if record == None:
+            return
+        with self.lock:
+            record.setdefault(stage, 0.0)
+
+    def bind(self, function):
+        # runs function on another thread as part of the caller's frame
+        record = getattr(self.local, "record", None)
+
+        def bound(*args):
+            self.local.record = record
+            self.local.mark = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.local.record = None
+
+        return bound
+
+    def commit(self):
+        record = getattr(self.local, "record", None)
+        if record == None:
+            return
+        self.local.record = None
+        with self.lock:
+            self.ring[self.count % len(self.ring)] = record
+            self.count += 1
+
+    def flush(self, final=False):
+        with self.lock:
+            end = self.count if final else self.count - self.lag
+            first = max(self.flushed, self.count - len(self.ring))
+            records = [self.ring[i % len(self.ring)] for i in range(first, end)]
+            self.flushed = max(self.flushed, end)
+            lines = "".join(json.dumps(r) + "\n" for r in records)
+        if self.filename != None and len(lines) > 0:
+            with open(self.filename, "at") as h:
+                h.write(lines)
+
+    def summary(self):
+        # one line per stage, p50/p95/p99 in ms over what is in the ring, a
+        # frame that didn't go through a stage counts as 0 for it
+        with self.lock:
+            records = [r for r in self.ring if r != None]
+        stages = {}
+        for record in records:
+            for stage in record:
+                if stage not in ("frame", "time"):
+                    stages[stage] = True
+        lines = [f"timings over the last {len(records)} frames, p50/p95/p99 ms"]
+        for stage in stages:
+            values = [r.get(stage, 0.0) for r in records]
+            lines.append(
+                f"{stage}: {percentile(values, 0.5):.1f}"
+                f"/{percentile(values, 0.95):.1f}/{percentile(values, 0.99):.1f}"
+            )
+        return lines
@@ -1,25 +1,220 @@
-from ftplib import FTP
-from os import listdir, makedirs, remove, path
-from threading import Thread
-from json import load
+from ftplib import FTP, error_perm
+from os import remove
 from time import sleep
+from threading import Thread, Lock, Condition
+from queue import Queue
+from json import load
+from hashlib import blake2b
 from ConfigFiles import ConfigFiles
+from Manifest import Manifest, ftpKey
+from RateLimiter import lowerThreadPriority
+
+BLOCK = 256 * 1024
+
+# these mark a frame or a segment as complete on the other side, they must
+# not land before the files they vouch for
+markerSuffixes = (".json", ".gsx")
+
+
+def connect(cfg, subdir, message):
+    if cfg["server"] == None or cfg["server"] == "":
+        raise Exception("server not configured! Have you run MotorsAnFtpSetup.py?")
+    ftp = FTP(timeout=cfg.get("timeout", 30))
+    ftp.connect(cfg["server"], cfg.get("port", 21))
+    ftp.login(user=cfg["user"], passwd=cfg["passwd"])
+    if cfg["path"] != "" and cfg["path"] != ".":
+        ftp.cwd(cfg["path"])
+    try:
+        ftp.mkd(subdir)
+    except Exception as e:
+        msg = str(e)
+        if msg != "550 {}: File exists".format(subdir):
+            message.emit(str(e))
+    ftp.cwd(subdir)
+    return ftp
+
+
+class FtpSession(Thread):
+    # One logged in connection uploading whatever the FtpThread hands it.
+    # When the connection drops the session reconnects, backing off
+    # exponentially, and resumes the upload where the server says it got
+    # to. The frame stays queued meanwhile, it is only given up on once the
+    # export is being stopped.
+    def __init__(self, owner, cfg):
+        Thread.__init__(self, daemon=True)
+        self.owner = owner
+        self.cfg = cfg
+        self.ftp = None
+
+    def run(self):
+        lowerThreadPriority(self.owner.queue.limiter.nice)
+        while True:
+            job = self.owner.jobs.get()
+            if job == None:
+                break
+            seq, item = job
+            done = None
+            try:
+                result = self.upload(item)
+                if result != None:
+                    self.record(item, *result)
+                    self.owner.uploaded(item)
+                    done = item
+            except Exception as e:
+                self.owner.message.emit(f"after the upload of {item.name}: {e}")
+            finally:
+                # the dispatcher waits for every frame to be finished
+                self.owner.finished(seq, done)
+        self.close()
+
+    def record(self, item, checksum, verified):
+        # the frame is on the server whether or not this gets written
+        try:
+            self.owner.manifest.record(
+                name=item.name,
+                size=item.size,
+                blake2b=checksum,
+                verified=verified,
+                sink="ftp",
+                destination=self.owner.destination,
+                **item.info,
+            )
+        except Exception as e:
+            self.owner.message.emit(f"{item.name} left out of the manifest: {e}")
+
+    def upload(self, item):
+        delay = self.cfg.get("retryDelay", 1.0)
+        resume = False
+        while True:
+            try:
+                if self.ftp == None:
+                    self.ftp = connect(self.cfg, self.owner.subdir, self.owner.message)
+                return self.store(item, resume)
+            except Exception as e:
+                self.drop()
+                if not self.owner.Loop:
+                    self.owner.message.emit(f"upload of {item.name} failed: {e}")
+                    return None
+                self.owner.message.emit(
+                    f"ftp error on {item.name} ({e}), retrying in {delay:g}s"
+                )
+                sleep(delay)
+                delay = min(2 * delay, self.cfg.get("maxRetryDelay", 60.0))
+                resume = True
+
+    def store(self, item, resume):
+        # The checksum is taken from the blocks on their way to the server
+        # and the remote SIZE checked once the STOR is done, the file is only
+        # read once. Returns the checksum and whether the size was checked.
+        offset = 0
+        if resume:
+            # what made it there before the connection dropped
+            self.ftp.voidcmd("TYPE I")
+            try:
+                offset = self.ftp.size(item.name) or 0
+            except error_perm:
+                offset = 0
+            if offset > item.size:
+                offset = 0
+        hasher = blake2b(digest_size=16)
+        if item.data != None:
+            # already read in memory by the mirror export
+            self.transfer(item, item.data, offset, hasher)
+        else:
+            with open(item.path, "rb") as a:
+                self.transfer(item, a, offset, hasher)
+        return hasher.hexdigest(), self.verify(item)
+
+    def transfer(self, item, source, offset, hasher):
+        if offset > 0:
+            # only the part already there is read without being sent
+            source.seek(0)
+            remaining = offset
+            while remaining > 0:
+                block = source.read(min(BLOCK, remaining))
+                hasher.update(block)
+                remaining -= len(block)
+            if offset == item.size:
+                return
+        source.seek(offset)
+        limiter = self.owner.queue.limiter
+
+        def sent(block):
+            hasher.update(block)
+            limiter.take(len(block))
+
+        self.ftp.storbinary(
+            "STOR {}".format(item.name),
+            source,
+            BLOCK,
+            sent,
+            rest=offset if offset > 0 else None,
+        )
+
+    def verify(self, item):
+        try:
+            remote = self.ftp.size(item.name)
+        except error_perm:
+            # the server doesn't do SIZE
+            return False
+        if remote != item.size:
+            raise Exception(f"{item.name} is {remote} bytes on the server")
+        return True
+
+    def drop(self):
+        if self.ftp != None:
+            self.ftp.close()
+            self.ftp = None
+
+    def close(self):
+        if self.ftp != None:
+            try:
+                self.ftp.quit()
+            except Exception:
+                self.ftp.close()
+            self.ftp = None
 
 
 class FtpThread(Thread):
-    def __init__(self, subdir, fileExt, signal):
+    def __init__(self, subdir, fileExt, signal, queue):
         Thread.__init__(self)
+        self.queue = queue
         self.subdir = subdir
         self.fileExt = fileExt
         self.connected = False
         self.Loop = True
         self.message = signal
         self.fileIndex = 0
+        cfg = ConfigFiles("ftp.json")
+        self.destination = "ftp://{}@{}:{}/{}/{}".format(
+            cfg["user"], cfg["server"], cfg.get("port", 21), cfg["path"], subdir
+        )
+        self.manifest = Manifest(
+            f"{subdir}-ftp-{ftpKey(self.destination)}-manifest.jsonl"
+        )
+        self.lock = Lock()
+        self.idle = Condition(self.lock)
+        self.inFlight = 0
+        self.completed = {}
+        self.nextReport = 0
 
     def forceStartPoint(self, start):
         self.fileIndex = start
 
     def getStartPoint(self):
+        entry = self.manifest.lastEntry("ftp")
+        if entry != None and not self.connected:
+            self.openConnection()
+        if entry != None and self.stillThere(entry):
+            start = 1 + entry["frame"]
+            self.message.emit(f"File index from {self.manifest.filename}: {start}")
+            self.fileIndex = start
+            return start
+        if entry != None:
+            self.message.emit(
+                f"{entry['name']} from {self.manifest.filename} isn't on"
+                f" {self.destination}, listing the server"
+            )
         if not self.connected:
             self.openConnection()
         listdir = []
@@ -44,52 +239,116 @@ class FtpThread(Thread):
         self.message.emit("File index now at: {}".format(self.fileIndex))
         return self.fileIndex
 
+    def stillThere(self, entry):
+        if entry.get("destination") != self.destination:
+            return False
+        try:
+            self.ftp.voidcmd("TYPE I")
+            return self.ftp.size(entry["name"]) == entry["size"]
+        except error_perm:
+            return False
+
     def openConnection(self):
         cfg = ConfigFiles("ftp.json")
-        self.ftp = FTP(cfg["server"])
         self.message.emit(f"ftp settings:")
         self.message.emit(f"user={cfg['user']}, server={cfg['server']}")
         self.message.emit(f"path={cfg['path']}/{self.subdir}")
-        if cfg["server"] == None or cfg["server"] == "":
-            raise Exception("server not configured! Have you run MotorsAnFtpSetup.py?")
-        self.ftp.login(user=cfg["user"], passwd=cfg["passwd"])
-        if cfg["path"] != "" and cfg["path"] != ".":
-            self.ftp.cwd(cfg["path"])
-        try:
-            self.ftp.mkd(self.subdir)
-        except Exception as e:
-            msg = str(e)
-            if msg != "550 {}: File exists".format(self.subdir):
-                self.message.emit(str(e))
-        self.ftp.cwd(self.subdir)
+        self.ftp = connect(cfg, self.subdir, self.message)
         self.connected = True
 
+    def finished(self, seq, item):
+        # Uploads complete in any order, they are reported in queue order.
+        # A failed one (item None) stays in /dev/shm/complete.
+        with self.lock:
+            self.completed[seq] = item
+            while self.nextReport in self.completed:
+                done = self.completed.pop(self.nextReport)
+                if done != None:
+                    self.report(done)
+                self.nextReport += 1
+            self.inFlight -= 1
+            self.idle.notify_all()
+
+    def report(self, item):
+        self.message.emit(f"xfer,{item.name}")
+
+    def uploaded(self, item):
+        remove(item.path)
+        self.queue.done(item)
+
+    def dispatch(self, seq, item):
+        with self.lock:
+            if item.name.endswith(markerSuffixes):
+                self.idle.wait_for(lambda: self.inFlight == 0)
+            self.inFlight += 1
+        self.jobs.put((seq, item))
+
+    def startSessions(self):
+        cfg = ConfigFiles("ftp.json")
+        concurrency = max(1, cfg.get("concurrency", 2))
+        self.jobs = Queue(maxsize=concurrency)
+        self.completed = {}
+        self.nextReport = 0
+        self.seq = 0
+        self.sessions = [FtpSession(self, cfg) for i in range(concurrency)]
+        for session in self.sessions:
+            session.start()
+
+    def send(self, item):
+        self.dispatch(self.seq, item)
+        self.seq += 1
+
+    def stopSessions(self):
+        for session in self.sessions:
+            self.jobs.put(None)
+        for session in self.sessions:
+            session.join()
+
     def run(self):
         self.Loop = True
         localLoop = True
         if self.connected:
             self.ftp.close()
             self.connected = False
+        # the frames are queued whether the server answers or not
         try:
-            self.openConnection()
-            makedirs("/dev/shm/complete", exist_ok=True)
+            self.queue.rescan()
+            self.queue.watch()
         except Exception as e:
-            msg = str(e)
             self.message.emit(str(e))
+        self.checkConnection()
+        self.startSessions()
         while localLoop:
-            if self.Loop == False:
-                localLoop = False
-            sleep(1)
-            file_list = sorted(listdir("/dev/shm/complete/"))
-            for item in file_list:
-                if path.isfile("/dev/shm/complete/{}".format(item)):
-                    self.message.emit(f"xfer,{item}")
-                    a = open("/dev/shm/complete/{}".format(item), "rb")
-                    self.ftp.storbinary("STOR {}".format(item), a)
-                    a.close()
-                    remove("/dev/shm/complete/{}".format(item))
+            item = self.queue.get()
+            if item == None:
+                # nothing left and asked to stop
+                localLoop = self.Loop
+                continue
+            self.send(item)
+        self.stopSessions()
         self.message.emit("End of ftp thread")
 
+    def checkConnection(self):
+        # Tries the server before starting the sessions, with the same
+        # backoff as they use, until it answers or the export is stopped.
+        cfg = ConfigFiles("ftp.json")
+        delay = cfg.get("retryDelay", 1.0)
+        while self.Loop:
+            try:
+                self.openConnection()
+                # the uploads get their own sessions
+                self.ftp.quit()
+                self.connected = False
+                return
+            except Exception as e:
+                self.message.emit(f"ftp error ({e}), retrying in {delay:g}s")
+                if self.connected:
+                    self.ftp.close()
+                    self.connected = False
+            self.queue.waitFor(lambda: False, delay, lambda: self.Loop)
+            delay = min(2 * delay, cfg.get("maxRetryDelay", 60.0))
+
     def stopLoop(self):
         self.message.emit("The FTP thread received the command to finish and stop")
         self.Loop = False
+        self.queue.interrupt()
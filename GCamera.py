@@ -1,14 +1,46 @@
 import json
-from picamera2 import Picamera2
+from picamera2 import Picamera2, MappedArray
 from picamera2.previews.qt import QGlPicamera2
-from time import sleep, time
+from time import sleep, time, monotonic_ns
 import os
-from threading import Thread
+from threading import Thread, BoundedSemaphore
 import CameraSettings
 from libcamera import Transform
 from ConfigFiles import ConfigFiles
+import DngWriter
+from EncoderPool import EncoderPool
+from RawSegment import RawSegmentWriter
+from Bracketing import BracketingEngine, clippingFractions
+from FrameTimings import FrameTimings
+from FrameQueue import FrameQueue
 
-defaultValues = {"fps": 10}
+manifestKeys = (
+    "SensorTimestamp",
+    "ExposureTime",
+    "AnalogueGain",
+    "DigitalGain",
+    "ColourGains",
+    "ColourTemperature",
+    "Lux",
+)
+
+defaultValues = {
+    "fps": 10,
+    "PipelinedCapture": False,
+    "EncoderWorkers": 2,
+    "SettleMilliseconds": 0,
+    "PackedRaw": False,
+    "TimingsFlushFrames": 50,
+    "TimingsSummaryFrames": 500,
+    "ShmReserveMB": 256,
+    "QueueLimitMB": 0,
+    "ThrottleStart": 0.5,
+    "ThrottleMaxDelay": 1.0,
+    "ExportRate": "off",
+    "ExportRateLimitMB": 0,
+    "ExportRateHeadroom": 1.5,
+    "ExportNice": 10,
+}
 
 
 def setMissingToDefault(settings):
@@ -17,6 +49,17 @@ def setMissingToDefault(settings):
             settings[key] = defaultValues[key]
 
 
+def checkCaptureModes(modes):
+    # the brackets go as many stops down as up from the mid exposure
+    for name, mode in modes.items():
+        count = mode.get("exposures", 3)
+        if count < 1 or count % 2 == 0:
+            print(
+                f"captureModes.json: {name} asks for {count} exposures, only odd"
+                f" counts work, {max(1, count - 1)} will be taken"
+            )
+
+
 class GCamera(Picamera2):
     def __init__(self, win):
         Picamera2.__init__(self)
@@ -25,6 +68,14 @@ class GCamera(Picamera2):
         self.fps = self.win.settings["fps"]
         self.framecount = 0
         self.captureModes = ConfigFiles("captureModes.json")
+        checkCaptureModes(self.captureModes)
+        self.pipelined = False
+        self.encoders = None
+        self.motionStop = None
+        self.bracketing = BracketingEngine(self)
+        self.segments = None
+        self.timings = FrameTimings()
+        self.queue = FrameQueue()
 
         vflip = False
         hflip = False
@@ -32,21 +83,55 @@ class GCamera(Picamera2):
             hflip = win.settings["hflip"]
         if "vflip" in win.settings:
             vflip = win.settings["vflip"]
-        transform = Transform(vflip=vflip, hflip=hflip)
+        self.transform = Transform(vflip=vflip, hflip=hflip)
+
+        self.raw = self.rawStream(win.settings.get("CaptureMode"))
+        self.config = self.createConfig(self.raw)
+        print(self.config)
+        self.configure(self.config)
+        self.rawConfig = self.camera_configuration()["raw"]
+        # Requests handed to the encoders hold one of the camera's buffers
+        # until written. Two are left to the camera so it keeps streaming and
+        # the skipped frames can still be captured while the others are held.
+        bufferCount = self.camera_configuration().get("buffer_count", 4)
+        self.heldRequests = BoundedSemaphore(max(1, bufferCount - 2))
+
+    def rawStream(self, captureMode):
+        raw = {"size": self.sensor_resolution}
+        packedRaw = self.win.settings["PackedRaw"] or captureMode == "packedRaw"
+        if packedRaw and str(self.sensor_format).endswith("_CSI2P"):
+            # keep the sensor's own CSI-2 packing, the DNG writer unpacks it
+            raw["format"] = str(self.sensor_format)
+        return raw
 
-        self.config = self.create_preview_configuration(
+    def createConfig(self, raw):
+        return self.create_preview_configuration(
             main={"size": self.sensor_resolution},
             controls={
                 "FrameRate": self.fps,
                 "FrameDurationLimits": (1000, 1000000 // self.fps),
                 "NoiseReductionMode": 0,
             },
-            raw={"size": self.sensor_resolution},
-            transform=transform,
+            raw=raw,
+            transform=self.transform,
         )
 
-        print(self.config)
+    def setCaptureMode(self, captureMode):
+        # Switching to or from packedRaw changes the raw stream's format, the
+        # camera is stopped and configured again with the controls it had.
+        # Only done between captures, the mode can't be changed during one.
+        raw = self.rawStream(captureMode)
+        if raw == self.raw:
+            return
+        controls = self.controls.make_dict()
+        self.stop()
+        self.raw = raw
+        self.config = self.createConfig(raw)
         self.configure(self.config)
+        self.rawConfig = self.camera_configuration()["raw"]
+        self.set_controls(controls)
+        self.start()
+        print(f"raw stream now {self.rawConfig['format']}")
 
     def getConfig(self):
         return self.config
@@ -66,74 +151,304 @@ class GCamera(Picamera2):
             sleep(sleep_time)
             count -= 1
 
+    def setMotionStop(self, stopTime):
+        # monotonic_ns() of the moment the film came to rest, the same clock
+        # libcamera uses for SensorTimestamp
+        self.motionStop = stopTime
+
+    def captureSettledRequest(self, which, maxSkip=10):
+        # the caller owns the returned request and has to release() it
+        if self.motionStop == None:
+            self.skipBuffers(3, which)
+            self.timings.lap("skip")
+            request = self.capture_request()
+            self.timings.lap("capture")
+            return request, request.get_metadata()
+        settled = self.motionStop + self.win.settings["SettleMilliseconds"] * 1000000
+        self.motionStop = None
+        skipped = 0
+        while True:
+            request = self.capture_request()
+            metadata = request.get_metadata()
+            # the sensor timestamp may be the start of readout, so take one whole
+            # frame duration off it to be sure the exposure began after the stop
+            exposureStart = (
+                metadata["SensorTimestamp"] - metadata["FrameDuration"] * 1000
+            )
+            if exposureStart >= settled or skipped >= maxSkip:
+                break
+            request.release()
+            self.timings.lap("skip")
+            skipped += 1
+        self.timings.note("skip")
+        self.timings.lap("capture")
+        saved = (3 - skipped) * metadata["FrameDuration"] / 1000.0
+        print(f"settled after skipping {skipped} buffers, saved {saved:.0f}ms")
+        return request, metadata
+
+    def captureHeldRequest(self, which):
+        # a settled request for streamDng() or appendRaw(), which give the
+        # buffer back, waits while too many are held already
+        self.heldRequests.acquire()
+        self.timings.lap("bufferWait")
+        try:
+            return self.captureSettledRequest(which)
+        except Exception:
+            self.heldRequests.release()
+            raise
+
+    def releaseHeld(self, request):
+        request.release()
+        self.heldRequests.release()
+
+    def captureSettled(self, which, maxSkip=10):
+        request, metadata = self.captureSettledRequest(which, maxSkip)
+        buffers = [request.make_buffer(which)]
+        request.release()
+        return buffers, metadata
+
+    def exposureMatches(self, metadata, expected):
+        metaExp = metadata["ExposureTime"]
+        return (float(abs(metaExp - expected)) / float(expected)) < 0.1
+
     def waitExposureChange(self, expected, maxSkip=24):
         skipCount = 0
         while skipCount < maxSkip:
             buffers, metadata = self.capture_buffers(["main"])
             skipCount += 1
-            metaExp = metadata["ExposureTime"]
-            if (float(abs(metaExp - expected)) / float(expected)) < 0.1:
+            if self.exposureMatches(metadata, expected):
                 break
             sleep(1.0 / self.fps)
         print(f"took {skipCount} buffers")
         return buffers, metadata
 
+    def startEncoders(self):
+        if self.encoders == None:
+            self.encoders = EncoderPool(self.win.settings["EncoderWorkers"])
+
+    def setPipelined(self, state):
+        # In pipelined mode captureCycle() only grabs the buffers, the encoding
+        # and the write to /dev/shm are left to the encoder pool so the motors
+        # can advance to the next frame in the meantime.
+        if state:
+            self.startEncoders()
+        self.pipelined = state
+
+    def checkEncoders(self):
+        if self.encoders != None:
+            self.encoders.checkErrors()
+
+    def drainEncoders(self):
+        if self.encoders != None:
+            self.encoders.drain()
+
+    def finishSequence(self):
+        # whatever moves the film next, the next frame can't rely on this stop
+        self.motionStop = None
+        try:
+            self.drainEncoders()
+        finally:
+            try:
+                # whatever made it in goes out with its index, even after
+                # an encoder error, and the next sequence starts a new writer
+                self.closeSegments()
+            finally:
+                self.setPipelined(False)
+                if self.bracketing.reset():
+                    self.set_controls(
+                        {"ExposureTime": int(self.win.settings["ExposureMicroseconds"])}
+                    )
+
+    def closeSegments(self):
+        segments = self.segments
+        self.segments = None
+        if segments != None:
+            segments.close()
+
+    def output(self, function, *args):
+        if self.pipelined:
+            self.encoders.submit(self.timings.bind(function), *args)
+        else:
+            function(*args)
+
+    def saveJpg(self, buffer, metadata, name):
+        fn = f"/dev/shm/{name}"
+        orig = self.helpers.make_image(buffer, self.config["main"]).convert("RGB")
+        self.timings.lap("convert")
+        self.helpers.save(orig, metadata, fn)
+        self.timings.lap("save")
+        self.queue.publish(fn, name, self.frameInfo(metadata))
+        self.timings.lap("rename")
+
+    def saveDng(self, buffer, metadata, name):
+        fn = f"/dev/shm/{name}"
+        self.helpers.save_dng(buffer, metadata, self.config["raw"], fn)
+        self.timings.lap("save")
+        self.queue.publish(fn, name, self.frameInfo(metadata))
+        self.timings.lap("rename")
+
+    def streamDng(self, request, metadata, name):
+        # Writes straight from the camera's raw buffer, the request is only
+        # given back to the camera once the bytes are in the file.
+        fn = f"/dev/shm/{name}"
+        pack = self.captureModes["DNG"].get("packDng", True)
+        try:
+            with MappedArray(request, "raw") as m:
+                DngWriter.saveDng(
+                    fn,
+                    m.array,
+                    self.rawConfig,
+                    metadata,
+                    self.camera_properties["Model"],
+                    pack,
+                )
+        finally:
+            self.releaseHeld(request)
+        self.timings.lap("save")
+        self.queue.publish(fn, name, self.frameInfo(metadata))
+        self.timings.lap("rename")
+
+    def frameInfo(self, metadata):
+        # capture time and camera settings of a frame, for the manifest
+        info = {k: metadata[k] for k in manifestKeys if k in metadata}
+        if "SensorTimestamp" in metadata:
+            age = (monotonic_ns() - metadata["SensorTimestamp"]) / 1e9
+            info["captured"] = round(time() - age, 3)
+        return info
+
+    def appendRaw(self, request, segment, slot):
+        try:
+            with MappedArray(request, "raw") as m:
+                self.segments.write(segment, slot, m.array)
+        finally:
+            self.releaseHeld(request)
+        self.timings.lap("save")
+
+    def saveSidecar(self, name, info):
+        # the sidecar goes out last, its presence tells the workstation scripts
+        # that every exposure of the frame is there
+        fn = f"/dev/shm/{name}.json"
+        with open(fn, "wt") as h:
+            json.dump(info, h)
+        self.queue.publish(fn, f"{name}.json")
+
+    def outputBracket(self, name, taken, info):
+        # Every exposure is encoded on its own worker, even when not pipelined,
+        # a 5 exposures bracket then costs about one encode per worker.
+        self.startEncoders()
+        info["exposures"] = {
+            tag: metadata["ExposureTime"] for tag, b, metadata in taken
+        }
+        group = self.encoders.group(len(taken), self.saveSidecar, name, info)
+        for tag, buffers, metadata in taken:
+            self.encoders.submit(
+                self.timings.bind(group.run),
+                self.saveJpg,
+                buffers[0],
+                metadata,
+                f"{name}_{tag}.jpg",
+            )
+        if not self.pipelined:
+            group.wait()
+            self.encoders.checkErrors()
+
+    def bracketExposures(self, mode, shutterMid):
+        # m first, then the lows and the highs, one evStep apart. Nothing can
+        # be longer than a frame so the longest ones get clipped to it.
+        count = mode.get("exposures", 3)
+        evStep = mode.get("evStep", 1.0)
+        longest = 1000000 // self.fps
+        exposures = [("m", int(shutterMid))]
+        for side, sign in (("l", -1), ("h", 1)):
+            previous = int(shutterMid)
+            for stop in range(1, (count - 1) // 2 + 1):
+                exposure = min(longest, int(shutterMid * 2 ** (sign * stop * evStep)))
+                if exposure == previous:
+                    print(f"{side}{stop} clipped to the frame duration, dropped")
+                    break
+                tag = side if stop == 1 else f"{side}{stop}"
+                exposures.append((tag, exposure))
+                previous = exposure
+        return exposures
+
     def captureCycle(self):
         captureMode = self.win.captureMode.currentText()
         if captureMode == "singleJpg":
-            self.skipBuffers(3, "main")
-            fn = "/dev/shm/{:05d}.jpg".format(self.framecount)
-            fnComplete = "/dev/shm/complete/{:05d}.jpg".format(self.framecount)
-
-            buffers, metadata = self.capture_buffers(["main"])
-            orig = self.helpers.make_image(buffers[0], self.config["main"]).convert(
-                "RGB"
+            buffers, metadata = self.captureSettled("main")
+            self.output(
+                self.saveJpg, buffers[0], metadata, f"{self.framecount:05d}.jpg"
             )
-            self.helpers.save(orig, metadata, fn)
-            os.rename(fn, fnComplete)
 
         elif captureMode == "bracketing":
-            self.skipBuffers(3, "main")
-            shutterMid = self.win.settings["ExposureMicroseconds"]
-            shutterLow = shutterMid // 2
-            shutterHigh = shutterMid * 2
-
-            fn = "/dev/shm/{:05d}_m.jpg".format(self.framecount)
-            fnComplete = "/dev/shm/complete/{:05d}_m.jpg".format(self.framecount)
-            buffers, metadata = self.waitExposureChange(shutterMid)
-            self.set_controls({"ExposureTime": shutterLow})
-            orig = self.helpers.make_image(buffers[0], self.config["main"]).convert(
-                "RGB"
+            exposures = self.bracketExposures(
+                self.captureModes[captureMode],
+                self.win.settings["ExposureMicroseconds"],
+            )
+            first = self.captureSettled("main")
+            taken = self.bracketing.capture(exposures, first)
+            self.timings.lap("bracket")
+            self.outputBracket(f"{self.framecount:05d}", taken, {})
+
+        elif captureMode == "adaptiveBracketing":
+            mode = self.captureModes[captureMode]
+            shutterMid = int(self.win.settings["ExposureMicroseconds"])
+            buffers, metadata = self.captureSettled("main")
+            if not self.exposureMatches(metadata, shutterMid):
+                self.set_controls({"ExposureTime": shutterMid})
+                buffers, metadata = self.waitExposureChange(shutterMid)
+            clipping = clippingFractions(
+                self.helpers.make_array(buffers[0], self.config["main"]),
+                mode.get("subsample", 8),
+                mode.get("shadowLevel", 4),
+                mode.get("highlightLevel", 251),
             )
-            self.helpers.save(orig, metadata, fn)
-            os.rename(fn, fnComplete)
-
-            fn = "/dev/shm/{:05d}_l.jpg".format(self.framecount)
-            fnComplete = "/dev/shm/complete/{:05d}_l.jpg".format(self.framecount)
-            buffers, metadata = self.waitExposureChange(shutterLow)
-            self.set_controls({"ExposureTime": shutterHigh})
-            orig = self.helpers.make_image(buffers[0], self.config["main"]).convert(
-                "RGB"
+            exposures = []
+            for tag, exposure in self.bracketExposures(mode, shutterMid):
+                if tag[0] == "l" and clipping[1] <= mode.get("clipFraction", 0.002):
+                    continue
+                if tag[0] == "h" and clipping[0] <= mode.get("clipFraction", 0.002):
+                    continue
+                exposures.append((tag, exposure))
+            taken = self.bracketing.capture(
+                exposures, (buffers, metadata), alternate=False
             )
-            self.helpers.save(orig, metadata, fn)
-            os.rename(fn, fnComplete)
-
-            fn = "/dev/shm/{:05d}_h.jpg".format(self.framecount)
-            fnComplete = "/dev/shm/complete/{:05d}_h.jpg".format(self.framecount)
-            buffers, metadata = self.waitExposureChange(shutterHigh)
-            self.set_controls({"ExposureTime": int(shutterMid)})
-            orig = self.helpers.make_image(buffers[0], self.config["main"]).convert(
-                "RGB"
+            self.timings.lap("bracket")
+            self.outputBracket(
+                f"{self.framecount:05d}",
+                taken,
+                {"shadows": clipping[0], "highlights": clipping[1]},
             )
-            self.helpers.save(orig, metadata, fn)
-            os.rename(fn, fnComplete)
 
         elif captureMode == "DNG":
-            self.skipBuffers(3, "raw")
-            fn = f"/dev/shm/{self.framecount:05d}.dng"
-            fnComplete = f"/dev/shm/complete/{self.framecount:05d}.dng"
-            buffers, metadata = self.capture_buffers(["raw"])
-            self.helpers.save_dng(buffers[0], metadata, self.config["raw"], fn)
-            os.rename(fn, fnComplete)
+            mode = self.captureModes[captureMode]
+            if mode.get("writer", "pidng") == "stream" and DngWriter.canWrite(
+                self.rawConfig
+            ):
+                request, metadata = self.captureHeldRequest("raw")
+                self.output(
+                    self.streamDng, request, metadata, f"{self.framecount:05d}.dng"
+                )
+            else:
+                buffers, metadata = self.captureSettled("raw")
+                self.output(
+                    self.saveDng, buffers[0], metadata, f"{self.framecount:05d}.dng"
+                )
+
+        elif captureMode == "packedRaw":
+            mode = self.captureModes[captureMode]
+            if self.segments == None:
+                self.segments = RawSegmentWriter(
+                    self.queue,
+                    self.rawConfig,
+                    self.camera_properties["Model"],
+                    mode.get("framesPerSegment", 24),
+                )
+            request, metadata = self.captureHeldRequest("raw")
+            try:
+                segment, slot = self.segments.reserve(self.framecount, metadata)
+            except Exception:
+                self.releaseHeld(request)
+                raise
+            self.output(self.appendRaw, request, segment, slot)
 
         self.framecount += 1
@@ -0,0 +1,18 @@
+import os
+
+# The GPIO module all the others use: RPi.GPIO on the Pi, or with
+# GUGUSSE_GPIO=sim simulated pins and film going through the machine
+# (SimulatedGpio.py), so the motion code runs on any Linux box. The film
+# format of the simulation is taken from GUGUSSE_SIM_FORMAT.
+if os.environ.get("GUGUSSE_GPIO", "") == "sim":
+    from ConfigFiles import ConfigFiles
+    from SimulatedGpio import GPIO, FilmTransport
+
+    GPIO.attach(
+        FilmTransport.fromHardware(
+            ConfigFiles("hardwarecfg.json"),
+            os.environ.get("GUGUSSE_SIM_FORMAT", "16mm"),
+        )
+    )
+else:
+    import RPi.GPIO as GPIO
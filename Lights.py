@@ -1,6 +1,6 @@
 #!/usr/bin/python
 
-import RPi.GPIO as GPIO
+from GpioBackend import GPIO
 from time import sleep
 from json import load
 from sys import argv, exit
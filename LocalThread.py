@@ -1,14 +1,86 @@
-from os import listdir, mkdir, remove, path
-from shutil import move
+import os
+import errno
+from os import mkdir, path
 from threading import Thread
 from json import load
-from time import sleep
 from glob import glob
+from time import time, sleep
+from Manifest import Manifest
+from DiskSpace import DiskSpace
+from RateLimiter import lowerThreadPriority
+
+CHUNK = 8 * 1024 * 1024
+
+
+def copyFile(source, destination, limiter):
+    # Copies in the kernel, with copy_file_range() or, when the two
+    # filesystems won't let it through, sendfile(). Returns the destination
+    # still open so the caller can fsync it along with the rest of a batch.
+    fdIn = os.open(source, os.O_RDONLY)
+    try:
+        fdOut = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            size = os.fstat(fdIn).st_size
+            copied = 0
+            try:
+                while copied < size:
+                    n = os.copy_file_range(
+                        fdIn, fdOut, limiter.chunk(CHUNK), copied, copied
+                    )
+                    if n == 0:
+                        break
+                    copied += n
+                    limiter.take(n)
+            except OSError:
+                if copied > 0:
+                    raise
+                while copied < size:
+                    n = os.sendfile(fdOut, fdIn, copied, limiter.chunk(CHUNK))
+                    if n == 0:
+                        break
+                    copied += n
+                    limiter.take(n)
+            if copied < size:
+                raise Exception(f"{source} shrank while being copied")
+        except Exception:
+            os.close(fdOut)
+            raise
+    finally:
+        os.close(fdIn)
+    return fdOut
+
+
+def writeData(destination, view, limiter):
+    # same as copyFile() for a frame already in memory
+    fdOut = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while len(view) > 0:
+            n = os.write(fdOut, view[: limiter.chunk(CHUNK)])
+            view = view[n:]
+            limiter.take(n)
+    except Exception:
+        os.close(fdOut)
+        raise
+    return fdOut
 
 
 class LocalThread(Thread):
-    def __init__(self, subdir, fileExt, signal, basePath):
+    def __init__(
+        self,
+        subdir,
+        fileExt,
+        signal,
+        basePath,
+        queue,
+        fsyncFrames=8,
+        fsyncSeconds=2.0,
+        spillover=(),
+        reserve=1024 * 1000000,
+    ):
         Thread.__init__(self)
+        self.fsyncFrames = fsyncFrames
+        self.fsyncSeconds = fsyncSeconds
+        self.queue = queue
         self.subdir = subdir
         self.fileExt = fileExt
         self.Loop = True
@@ -20,21 +92,53 @@ class LocalThread(Thread):
             mkdir(self.fullpath)
         except:
             pass
+        # kept with the frames, gone with them if the project is wiped
+        self.manifest = Manifest(f"{self.fullpath}/{subdir}-manifest.jsonl")
+        # once basePath runs low the frames carry on in the spillover paths
+        self.directories = [self.fullpath]
+        for base in spillover:
+            directory = "{}/{}".format(base, subdir)
+            try:
+                if not path.isdir(directory):
+                    mkdir(directory)
+            except OSError as e:
+                # an unmounted disk or no permission, capture goes on without
+                self.message.emit(f"spillover path {base} left out: {e}")
+                continue
+            self.directories.append(directory)
+        self.space = DiskSpace(self.directories, reserve)
+        self.directory = self.fullpath
+        self.devices = {}
 
     def forceStartPoint(self, start):
         self.fileIndex = start
 
     def getStartPoint(self):
+        # the manifest knows, the directories are only listed for projects
+        # started before there was one or when it doesn't match them
+        entry = self.manifest.lastEntry("local")
+        if entry != None and self.stillThere(entry):
+            start = 1 + entry["frame"]
+            self.message.emit(f"File index from {self.manifest.filename}: {start}")
+            self.fileIndex = start
+            return start
+        if entry != None:
+            self.message.emit(
+                f"{entry['name']} from {self.manifest.filename} isn't where"
+                " it was recorded, listing the directories"
+            )
         if self.fileExt[0] == ".":
             search = "{}/*{}".format(self.fullpath, self.fileExt)
         else:
             search = "{}/*.{}".format(self.fullpath, self.fileExt)
-        files = glob(search)
+        files = []
+        for directory in self.directories:
+            files += glob(search.replace(self.fullpath, directory, 1))
         if len(files) == 0:
             print("No previous file found, starting with index at 0")
             self.fileIndex = 0
             return 0
-        files.sort()
+        files.sort(key=path.basename)
         lastFile = files[len(files) - 1]
         print("last file={}".format(lastFile))
         base = path.basename(lastFile)
@@ -43,21 +147,133 @@ class LocalThread(Thread):
         self.message.emit("File index now at: {}".format(self.fileIndex))
         return self.fileIndex
 
+    def stillThere(self, entry):
+        where = entry.get("path", "")
+        if path.dirname(where) not in self.directories:
+            return False
+        try:
+            return os.stat(where).st_size == entry["size"]
+        except OSError:
+            return False
+
     def run(self):
         self.Loop = True
+        lowerThreadPriority(self.queue.limiter.nice)
         try:
-            mkdir("/dev/shm/complete")
+            self.queue.rescan()
+            self.queue.watch()
         except Exception as e:
-            msg = str(e)
-            if msg != "[Errno 17] File exists: '/dev/shm/complete'":
-                self.message.emit(str(e))
-        while self.Loop:
-            sleep(1)
-            for item in listdir("/dev/shm/complete/"):
-                if path.isfile("/dev/shm/complete/{}".format(item)):
-                    destination = "{}/{}".format(self.fullpath, item)
-                    self.message.emit(f"xfer,{destination}")
-                    move("/dev/shm/complete/{}".format(item), destination)
+            self.message.emit(str(e))
+        batch = []
+        batchStart = time()
+        while True:
+            timeout = None
+            if len(batch) > 0:
+                timeout = max(0, batchStart + self.fsyncSeconds - time())
+            item = self.queue.get(timeout)
+            if item != None:
+                if len(batch) == 0:
+                    batchStart = time()
+                    busy = 0.0
+                started = time()
+                batch.append(self.export(item))
+                busy += time() - started
+                if len(batch) < self.fsyncFrames:
+                    continue
+            if len(batch) > 0:
+                self.commit(batch, busy)
+                batch = []
+            elif not self.Loop:
+                break
+
+    def export(self, item):
+        while True:
+            directory = self.place(item)
+            destination = "{}/{}".format(directory, item.name)
+            try:
+                fd = self.store(item, destination)
+            except OSError as e:
+                if e.errno != errno.ENOSPC:
+                    raise
+                try:
+                    os.remove(destination + ".part")
+                except FileNotFoundError:
+                    pass
+                self.message.emit(f"{directory} is full")
+                self.space.full()
+                continue
+            self.space.spent(item.size)
+            return item, destination, fd
+
+    def place(self, item):
+        directory = self.space.pick(item.size)
+        while directory == None:
+            # the capture loop slows down and waits as /dev/shm fills up,
+            # there is time for somebody to make room or mount a disk
+            if not self.Loop:
+                raise Exception("no room left on any of the local paths")
+            self.message.emit("all local paths are full, waiting for room")
+            sleep(10)
+            self.space.rewind()
+            directory = self.space.pick(item.size)
+        if directory != self.directory:
+            self.message.emit(
+                f"now saving to {directory}, {self.space.free // 1000000}MB free"
+            )
+            self.directory = directory
+        return directory
+
+    def sameFilesystem(self, directory):
+        if directory not in self.devices:
+            self.devices[directory] = (
+                os.stat(self.queue.directory).st_dev == os.stat(directory).st_dev
+            )
+        return self.devices[directory]
+
+    def store(self, item, destination):
+        # returns the still open copy, None when the file could just be moved
+        if self.sameFilesystem(path.dirname(destination)):
+            os.rename(item.path, destination)
+            return None
+        return copyFile(item.path, destination + ".part", self.queue.limiter)
+
+    def commit(self, batch, busy):
+        # One group commit for the whole batch: the copies are flushed, put
+        # in place and the directory flushed before any source is removed.
+        copied = time()
+        for item, destination, fd in batch:
+            if fd != None:
+                if os.fstat(fd).st_size != item.size:
+                    raise Exception(f"{destination} came out truncated")
+                os.fsync(fd)
+                os.close(fd)
+                os.rename(destination + ".part", destination)
+        for directory in set(path.dirname(d) for i, d, f in batch):
+            dirFd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(dirFd)
+            finally:
+                os.close(dirFd)
+        synced = time()
+        size = 0
+        for item, destination, fd in batch:
+            size += item.size
+            self.committed(item, destination, fd != None)
+        elapsed = max(busy + synced - copied, 1e-6)
+        self.message.emit(
+            f"local batch: {len(batch)} files, {size / 1e6:.1f}MB"
+            f" at {size / 1e6 / elapsed:.1f}MB/s, fsync {(synced - copied) * 1000:.0f}ms"
+        )
+
+    def committed(self, item, destination, copied):
+        self.manifest.record(
+            name=item.name, size=item.size, sink="local", path=destination, **item.info
+        )
+        if copied:
+            os.remove(item.path)
+        self.queue.done(item)
+        self.message.emit(f"xfer,{destination}")
 
     def stopLoop(self):
         self.Loop = False
+        self.queue.interrupt()
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+# Checks a project's manifest against where the frames went, only when
+# asked, capture itself never lists the destination.
+#
+#   python3 Manifest.py <project>-manifest.jsonl [hash]
+#
+# The local exports keep the manifest in the project directory, the FTP
+# export in <project>-ftp-<key>-manifest.jsonl in the working directory.
+#
+# "hash" also reads every local file back to compare its blake2b.
+import os
+import sys
+import json
+from threading import Lock
+from time import time
+from hashlib import blake2b
+
+TAIL = 64 * 1024
+
+
+def frameNumber(name):
+    # 00123.dng, 00123_h.jpg, 00123.json... all belong to frame 123
+    try:
+        return int(name.split(".")[0].split("_")[0], 10)
+    except ValueError:
+        return None
+
+
+def ftpKey(destination):
+    # tells the manifests of a project on different servers or paths apart
+    return blake2b(destination.encode("utf8"), digest_size=4).hexdigest()
+
+
+class Manifest:
+    # Append-only JSONL log of every file that reached its destination, one
+    # per project and destination. It lives as long as the project, so
+    # resuming never has to list the destination, the exporters only check
+    # that the last file it recorded is still there.
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = Lock()
+
+    def record(self, **fields):
+        frame = frameNumber(fields.get("name", ""))
+        if frame != None:
+            fields["frame"] = frame
+        fields["time"] = round(time(), 3)
+        line = json.dumps(fields) + "\n"
+        with self.lock:
+            with open(self.filename, "ab+") as h:
+                # a line cut short by a crash is ended first, the new record
+                # must not be glued to it
+                end = h.seek(0, os.SEEK_END)
+                if end > 0:
+                    h.seek(end - 1)
+                    if h.read(1) != b"\n":
+                        line = "\n" + line
+                h.write(line.encode("utf8"))
+
+    def highWater(self, sink):
+        # the next frame number for sink, None when nothing was recorded
+        entry = self.lastEntry(sink)
+        if entry == None:
+            return None
+        return 1 + entry["frame"]
+
+    def lastEntry(self, sink):
+        # The record of the highest frame for sink. Only the end of the log
+        # is read: the uploads finish a little out of order, never by more
+        # than a block's worth of records.
+        try:
+            h = open(self.filename, "rb")
+        except FileNotFoundError:
+            return None
+        with h:
+            end = h.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - TAIL)
+                h.seek(start)
+                block = h.read(end - start)
+                lines = block.split(b"\n")
+                if start > 0 and len(lines) > 1:
+                    # the first line is cut, it is read with the next block
+                    end = start + len(lines[0])
+                    lines = lines[1:]
+                else:
+                    end = start
+                last = None
+                for line in lines:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of a crashed run may be truncated
+                        continue
+                    if entry.get("sink") != sink or entry.get("frame") == None:
+                        continue
+                    if last == None or entry["frame"] >= last["frame"]:
+                        last = entry
+                if last != None:
+                    return last
+        return None
+
+    def entries(self):
+        # the last record of every file per sink, later ones win
+        latest = {}
+        with open(self.filename, "rt") as h:
+            for line in h:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                latest[(entry.get("sink"), entry["name"])] = entry
+        return latest
+
+
+def fileHash(filename):
+    hasher = blake2b()
+    with open(filename, "rb") as h:
+        while True:
+            block = h.read(1024 * 1024)
+            if len(block) == 0:
+                break
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def reconcile(filename, checkHash=False):
+    problems = 0
+    latest = Manifest(filename).entries()
+    local = [e for (sink, n), e in latest.items() if sink == "local"]
+    remote = [e for (sink, n), e in latest.items() if sink == "ftp"]
+    for entry in local:
+        where = entry.get("path")
+        if where == None:
+            print(f"{entry['name']}: no path recorded, skipped")
+            continue
+        try:
+            size = os.stat(where).st_size
+        except FileNotFoundError:
+            print(f"{where}: missing")
+            problems += 1
+            continue
+        if size != entry["size"]:
+            print(f"{where}: {size} bytes, {entry['size']} recorded")
+            problems += 1
+        elif checkHash and "blake2b" in entry and fileHash(where) != entry["blake2b"]:
+            print(f"{where}: checksum mismatch")
+            problems += 1
+    if len(remote) > 0:
+        from ConfigFiles import ConfigFiles
+        from FtpThread import connect
+
+        class Printer:
+            def emit(self, msg):
+                print(msg)
+
+        subdir = os.path.basename(filename)[: -len("-manifest.jsonl")]
+        subdir = subdir.rsplit("-ftp-", 1)[0]
+        ftp = connect(ConfigFiles("ftp.json"), subdir, Printer())
+        ftp.voidcmd("TYPE I")
+        for entry in remote:
+            try:
+                size = ftp.size(entry["name"])
+            except Exception as e:
+                print(f"ftp {entry['name']}: {e}")
+                problems += 1
+                continue
+            if size != entry["size"]:
+                print(f"ftp {entry['name']}: {size} bytes, {entry['size']} recorded")
+                problems += 1
+        ftp.quit()
+    print(
+        f"{len(local)} local and {len(remote)} ftp files checked, {problems} problems"
+    )
+    return problems
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or not os.path.isfile(sys.argv[1]):
+        print(f"{sys.argv[0]} <project>-manifest.jsonl [hash]")
+        sys.exit(0)
+    sys.exit(1 if reconcile(sys.argv[1], "hash" in sys.argv[2:]) > 0 else 0)
@@ -0,0 +1,115 @@
+import os
+import mmap
+from io import BytesIO
+from threading import Lock
+from LocalThread import LocalThread, writeData
+from FtpThread import FtpThread
+from RateLimiter import RateLimiter
+
+
+class MirrorUploads(FtpThread):
+    # the FTP half of a MirrorThread, never started as a thread of its own
+    def __init__(self, mirror, subdir, fileExt, signal, queue):
+        FtpThread.__init__(self, subdir, fileExt, signal, queue)
+        self.mirror = mirror
+
+    def uploaded(self, item):
+        self.mirror.confirm(item)
+
+    def report(self, item):
+        pass
+
+
+class MirrorThread(LocalThread):
+    # Every frame is mapped in memory once and written from there both to
+    # the local archive, with the batching and fsyncs of LocalThread, and to
+    # the FTP server by the sessions of an FtpThread. It only leaves
+    # /dev/shm once both copies are confirmed.
+    def __init__(
+        self,
+        subdir,
+        fileExt,
+        signal,
+        basePath,
+        queue,
+        fsyncFrames=8,
+        fsyncSeconds=2.0,
+        spillover=(),
+        reserve=1024 * 1000000,
+    ):
+        LocalThread.__init__(
+            self,
+            subdir,
+            fileExt,
+            signal,
+            basePath,
+            queue,
+            fsyncFrames,
+            fsyncSeconds,
+            spillover,
+            reserve,
+        )
+        self.remote = MirrorUploads(self, subdir, fileExt, signal, queue)
+        self.remote.manifest = self.manifest
+        # the export rate is sized for one copy of every frame, the upload
+        # is charged for it and the local copy of the same bytes isn't
+        self.unlimited = RateLimiter()
+        self.confirmations = {}
+        self.confirmLock = Lock()
+
+    def getStartPoint(self):
+        # the sink that is furthest along decides, nothing gets overwritten
+        local = LocalThread.getStartPoint(self)
+        remote = self.remote.getStartPoint()
+        self.fileIndex = max(local, remote)
+        self.message.emit("File index now at: {}".format(self.fileIndex))
+        return self.fileIndex
+
+    def run(self):
+        if self.remote.connected:
+            # the uploads get their own sessions
+            self.remote.ftp.close()
+            self.remote.connected = False
+        self.remote.startSessions()
+        LocalThread.run(self)
+        self.remote.Loop = False
+        self.remote.stopSessions()
+        self.message.emit("End of mirror thread")
+
+    def export(self, item):
+        with open(item.path, "rb") as h:
+            if item.size > 0:
+                item.data = mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                item.data = BytesIO()
+        exported = LocalThread.export(self, item)
+        self.remote.send(item)
+        return exported
+
+    def store(self, item, destination):
+        view = memoryview(item.data) if item.size > 0 else memoryview(b"")
+        try:
+            return writeData(destination + ".part", view, self.unlimited)
+        finally:
+            view.release()
+
+    def committed(self, item, destination, copied):
+        self.manifest.record(
+            name=item.name, size=item.size, sink="local", path=destination, **item.info
+        )
+        self.confirm(item, destination)
+
+    def confirm(self, item, destination=None):
+        # called once by each sink, the local one gives the destination
+        with self.confirmLock:
+            if item.name not in self.confirmations:
+                self.confirmations[item.name] = destination
+                return
+            first = self.confirmations.pop(item.name)
+        if destination == None:
+            destination = first
+        item.data.close()
+        item.data = None
+        os.remove(item.path)
+        self.queue.done(item)
+        self.message.emit(f"xfer,{destination}")
@@ -65,6 +65,13 @@ def modeChangeHandler(event):
         pathBox.configure(state="disabled", fg="grey")
         testButton.configure(state="disabled", fg="grey")
         filePathButton.configure(state="normal", fg="black")
+    elif val == "mirror":
+        serverBox.configure(state="normal", fg="black")
+        userBox.configure(state="normal", fg="black")
+        passwdBox.configure(state="normal", fg="black")
+        pathBox.configure(state="normal", fg="black")
+        testButton.configure(state="normal", fg="black")
+        filePathButton.configure(state="normal", fg="black")
 
 
 def getTheFileDialog():
@@ -81,7 +88,7 @@ def getTheFileDialog():
 miniFrame = Frame(root, highlightbackground="black", highlightthickness=1)
 miniFrame.pack(side="top", fill="x")
 saveModeSelect = OptionMenu(
-    miniFrame, saveMode, "ftp", "local", command=modeChangeHandler
+    miniFrame, saveMode, "ftp", "local", "mirror", command=modeChangeHandler
 )
 saveModeSelect.pack(side="right")
 Label(miniFrame, text="Export Mode:", anchor="e").pack(side="right")
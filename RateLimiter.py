@@ -0,0 +1,67 @@
+import os
+from threading import Lock, get_native_id
+from time import monotonic, sleep
+
+
+def lowerThreadPriority(increment):
+    # Linux nice values are per thread, this only lowers the calling one
+    if increment <= 0:
+        return
+    try:
+        tid = get_native_id()
+        current = os.getpriority(os.PRIO_PROCESS, tid)
+        os.setpriority(os.PRIO_PROCESS, tid, min(19, current + increment))
+    except (OSError, AttributeError):
+        pass
+
+
+class RateLimiter:
+    # Token bucket shared by the export threads, a rate of 0 lets everything
+    # through. take() may leave the bucket in debt, the next taker waits it
+    # out, so big blocks still average out to the rate.
+    def __init__(self, rate=0, burstSeconds=0.25):
+        self.rate = rate
+        self.burstSeconds = burstSeconds
+        self.tokens = 0.0
+        self.last = monotonic()
+        self.nice = 0
+        self.lock = Lock()
+
+    def setRate(self, rate):
+        with self.lock:
+            self.refill()
+            self.rate = rate
+
+    def refill(self):
+        now = monotonic()
+        if self.rate > 0:
+            burst = self.rate * self.burstSeconds
+            self.tokens = min(burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def chunk(self, size):
+        # How much to move before the next take(), everything when there is
+        # no limit, a twentieth of a second's worth otherwise so the
+        # waits stay short instead of a long stall after every big block.
+        rate = self.rate
+        if rate <= 0:
+            return size
+        return max(64 * 1024, min(size, int(rate / 20)))
+
+    def take(self, count):
+        with self.lock:
+            if self.rate <= 0:
+                return
+            self.refill()
+            self.tokens -= count
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            sleep(wait)
+
+    def adapt(self, framePeriod, frameBytes, pendingBytes, headroom=1.5, floor=1e6):
+        # enough to send a frame's worth plus whatever is waiting within one
+        # frame period, with some headroom, never less than floor
+        if framePeriod <= 0:
+            return
+        rate = headroom * (frameBytes + pendingBytes) / framePeriod
+        self.setRate(max(floor, rate))
@@ -0,0 +1,56 @@
+import numpy as np
+
+# Conversions between the raw layouts we meet on the way from the sensor to
+# the DNG. All of them work on a band of rows at a time so the temporary
+# arrays stay small whatever the frame size.
+
+
+def packDng12(rows):
+    # 12 bits values in 16 bits little endian words (rows of uint16) to the
+    # DNG/TIFF 12 bits packing: two pixels in three bytes, MSB first.
+    p0 = rows[:, 0::2]
+    p1 = rows[:, 1::2]
+    out = np.empty((rows.shape[0], p0.shape[1] * 3), dtype=np.uint8)
+    out[:, 0::3] = p0 >> 4
+    out[:, 1::3] = ((p0 & 0x0F) << 4) | (p1 >> 8)
+    out[:, 2::3] = p1 & 0xFF
+    return out
+
+
+def csi2pToDng12(band):
+    # MIPI CSI-2 12 bits packing (8 MSBs of each pixel, then a byte with the
+    # two nibbles of LSBs) to the DNG one, a pure byte shuffle.
+    b0 = band[:, 0::3]
+    b1 = band[:, 1::3]
+    b2 = band[:, 2::3]
+    out = np.empty(band.shape, dtype=np.uint8)
+    out[:, 0::3] = b0
+    out[:, 1::3] = ((b2 & 0x0F) << 4) | (b1 >> 4)
+    out[:, 2::3] = ((b1 & 0x0F) << 4) | (b2 >> 4)
+    return out
+
+
+def unpackCsi2p(band, bits):
+    # MIPI CSI-2 10 or 12 bits packing to 16 bits words
+    data = band.astype(np.uint16)
+    if bits == 12:
+        out = np.empty((band.shape[0], band.shape[1] * 2 // 3), dtype=np.uint16)
+        out[:, 0::2] = (data[:, 0::3] << 4) | (data[:, 2::3] & 0x0F)
+        out[:, 1::2] = (data[:, 1::3] << 4) | (data[:, 2::3] >> 4)
+    elif bits == 10:
+        out = np.empty((band.shape[0], band.shape[1] * 4 // 5), dtype=np.uint16)
+        for i in range(4):
+            out[:, i::4] = (data[:, i::5] << 2) | ((data[:, 4::5] >> (2 * i)) & 0x03)
+    else:
+        raise Exception(f"no CSI-2 unpacking for {bits} bits")
+    return out
+
+
+def convertBand(band, width, bits, packed, packTo12):
+    # band: rows of the raw buffer as uint8, stride padding included
+    if packed:
+        band = band[:, : width * bits // 8]
+        if bits == 12 and packTo12:
+            return csi2pToDng12(band)
+        return unpackCsi2p(band, bits)
+    return packDng12(band[:, : width * 2].view(np.uint16))
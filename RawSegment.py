@@ -0,0 +1,208 @@
+import os
+import mmap
+import struct
+from threading import Lock
+import numpy as np
+from DngWriter import rawFormat
+
+# Raw segments: the raw frames of a run of frames appended one after the
+# other, rows trimmed of their stride padding, in a single file preallocated
+# in /dev/shm. The segment is published as <last frame>.gsr followed by its
+# index, <last frame>.gsx, once it is full or the capture stops.
+#
+# index: one header, then one record per frame, all little endian
+#   header: magic, version, width, height, row bytes, raw format, model,
+#           black levels (16 bits scale), record count
+#   record: frame number, offset in the segment, length, exposure (us),
+#           analogue gain, red gain, blue gain, sensor timestamp (ns),
+#           colour correction matrix
+
+MAGIC = b"GSX1"
+VERSION = 1
+headerFormat = struct.Struct("<4sIIII16s32s4HI")
+recordFormat = struct.Struct("<IQIIfffQ9f")
+
+
+def rowBytesOf(rawConfig):
+    width, height = rawConfig["size"]
+    pattern, bits, packed = rawFormat(rawConfig["format"])
+    if packed:
+        return width * bits // 8
+    return width * 2
+
+
+def readIndex(filename):
+    with open(filename, "rb") as h:
+        data = h.read()
+    (
+        magic,
+        version,
+        width,
+        height,
+        rowBytes,
+        fmt,
+        model,
+        b0,
+        b1,
+        b2,
+        b3,
+        count,
+    ) = headerFormat.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise Exception(f"{filename} is not a raw segment index")
+    header = {
+        "version": version,
+        "size": (width, height),
+        "stride": rowBytes,
+        "format": fmt.rstrip(b"\0").decode("ascii"),
+        "model": model.rstrip(b"\0").decode("ascii"),
+        "blackLevels": [b0, b1, b2, b3],
+    }
+    records = []
+    for i in range(count):
+        values = recordFormat.unpack_from(
+            data, headerFormat.size + i * recordFormat.size
+        )
+        records.append(
+            {
+                "frame": values[0],
+                "offset": values[1],
+                "length": values[2],
+                "ExposureTime": values[3],
+                "AnalogueGain": values[4],
+                "ColourGains": (values[5], values[6]),
+                "SensorTimestamp": values[7],
+                "ColourCorrectionMatrix": values[8:17],
+            }
+        )
+    return header, records
+
+
+class RawSegment:
+    def __init__(self, rawConfig, model, frames, firstFrame):
+        self.width, self.height = rawConfig["size"]
+        self.format = str(rawConfig["format"])
+        self.model = model
+        self.rowBytes = rowBytesOf(rawConfig)
+        self.frameBytes = self.rowBytes * self.height
+        self.frames = frames
+        self.records = []
+        self.filled = 0
+        self.blackLevels = [4096, 4096, 4096, 4096]
+        self.path = f"/dev/shm/segment_{firstFrame:05d}.gsr"
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        # tmpfs hands out the pages now rather than in the middle of a frame
+        os.posix_fallocate(self.fd, 0, self.frameBytes * frames)
+        self.map = mmap.mmap(self.fd, self.frameBytes * frames)
+
+    def full(self):
+        return len(self.records) == self.frames
+
+    def reserve(self, frame, metadata):
+        slot = len(self.records)
+        gains = metadata.get("ColourGains", (1.0, 1.0))
+        ccm = metadata.get("ColourCorrectionMatrix", (1, 0, 0, 0, 1, 0, 0, 0, 1))
+        if "SensorBlackLevels" in metadata:
+            self.blackLevels = [int(b) for b in metadata["SensorBlackLevels"]]
+        self.records.append(
+            recordFormat.pack(
+                frame,
+                slot * self.frameBytes,
+                self.frameBytes,
+                int(metadata.get("ExposureTime", 0)),
+                metadata.get("AnalogueGain", 1.0),
+                gains[0],
+                gains[1],
+                metadata.get("SensorTimestamp", 0),
+                *ccm,
+            )
+        )
+        return slot
+
+    def write(self, slot, array):
+        # array: the raw stream as a (height, stride) uint8 array
+        dest = np.ndarray(
+            (self.height, self.rowBytes),
+            dtype=np.uint8,
+            buffer=self.map,
+            offset=slot * self.frameBytes,
+        )
+        dest[:] = array[:, : self.rowBytes]
+
+    def index(self):
+        header = headerFormat.pack(
+            MAGIC,
+            VERSION,
+            self.width,
+            self.height,
+            self.rowBytes,
+            self.format.encode("ascii"),
+            self.model.encode("ascii"),
+            *self.blackLevels,
+            len(self.records),
+        )
+        return header + b"".join(self.records)
+
+    def publish(self, queue):
+        self.map.close()
+        os.ftruncate(self.fd, self.frameBytes * len(self.records))
+        os.close(self.fd)
+        name = f"{recordFormat.unpack(self.records[-1])[0]:05d}"
+        queue.publish(self.path, f"{name}.gsr")
+        # the index goes out last, its presence says the segment is complete
+        fn = f"/dev/shm/{name}.gsx"
+        with open(fn, "wb") as h:
+            h.write(self.index())
+        queue.publish(fn, f"{name}.gsx")
+
+    def discard(self):
+        self.map.close()
+        os.close(self.fd)
+        os.remove(self.path)
+
+
+class RawSegmentWriter:
+    # The slots are handed out in capture order from the capture thread, the
+    # copies into them may then run on any encoder worker. A segment is
+    # published by whoever fills its last slot.
+    def __init__(self, queue, rawConfig, model, framesPerSegment=24):
+        self.queue = queue
+        self.rawConfig = rawConfig
+        self.model = model
+        self.framesPerSegment = max(1, framesPerSegment)
+        self.current = None
+        self.lock = Lock()
+
+    def reserve(self, frame, metadata):
+        with self.lock:
+            if self.current == None:
+                self.current = RawSegment(
+                    self.rawConfig, self.model, self.framesPerSegment, frame
+                )
+            segment = self.current
+            slot = segment.reserve(frame, metadata)
+            if segment.full():
+                self.current = None
+        return segment, slot
+
+    def write(self, segment, slot, array):
+        segment.write(slot, array)
+        with self.lock:
+            segment.filled += 1
+            done = segment.full() and segment.filled == len(segment.records)
+        if done:
+            segment.publish(self.queue)
+
+    def close(self):
+        # only once every write has been done, a partial segment is published
+        # as is
+        with self.lock:
+            segment = self.current
+            self.current = None
+        if segment == None:
+            return
+        if segment.filled == 0:
+            segment.discard()
+        else:
+            segment.records = segment.records[: segment.filled]
+            segment.publish(self.queue)
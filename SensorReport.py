@@ -1,5 +1,5 @@
 from threading import Thread
-import RPi.GPIO as GPIO
+from GpioBackend import GPIO
 from time import sleep
 from os import nice
 from PyQt5.QtWidgets import QHBoxLayout, QLabel, QPushButton
@@ -0,0 +1,213 @@
+import random
+from threading import Lock
+from time import monotonic
+
+# Stands in for RPi.GPIO off the Pi, see GpioBackend.py. The pins only keep
+# their levels, unless a FilmTransport is attached: it then counts the steps
+# sent to the motors and answers for their sensors.
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+
+class FilmDrive:
+    # The perforation sensor sees a hole every holeSteps steps, less the
+    # film's shrinkage, each hole off by a random jitter (standard
+    # deviation, in steps). The sensor stays on for holeWidth steps.
+    def __init__(self, cfg, holeSteps, holeWidth, jitter, shrinkage, rng):
+        self.cfg = cfg
+        self.pitch = holeSteps * (1.0 - shrinkage)
+        self.holeWidth = holeWidth
+        self.jitter = jitter
+        self.rng = rng
+        self.position = 0
+        self.hole = self.pitch
+
+    def step(self):
+        self.position += 1
+        while self.position >= self.hole + self.holeWidth:
+            self.hole += self.pitch + self.rng.gauss(0.0, self.jitter)
+
+    def sensing(self):
+        return self.hole <= self.position < self.hole + self.holeWidth
+
+
+class Reel:
+    # The arm's sensor triggers once the reel has taken up (pickup) or
+    # given out (feeder) the film the film drive moved, "ratio" being film
+    # drive steps worth of film per reel step. The ratio changes by growth
+    # every step as the film winds or unwinds.
+    def __init__(self, cfg, ratio, growth, tension):
+        self.cfg = cfg
+        self.ratio = ratio
+        self.growth = growth
+        self.tension = tension
+
+    def step(self):
+        self.tension -= self.ratio
+        self.ratio += self.growth
+
+    def sensing(self):
+        return self.tension <= 0
+
+
+class FilmTransport:
+    # The motors' step pins move the film, their stop pins read what the
+    # film does. The direction pins are ignored, the film only goes
+    # forward. Once broken the film stops pulling on anything and the
+    # perforation sensor sees light all the time, every motor then comes
+    # up short.
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.filmDrive = None
+        self.reels = []
+        self.byStepPin = {}
+        self.bySensorPin = {}
+        self.broken = False
+        self.breakAfter = None
+        self.lock = Lock()
+
+    @classmethod
+    def fromHardware(cls, hw, filmFormat, jitter=2.0, seed=None):
+        # holes a little past where the film drive starts looking for them,
+        # reels that need about 80% of their target time at full speed
+        fmt = hw["filmFormats"][filmFormat]
+        transport = cls(seed)
+        holeSteps = int(fmt["filmdrive"]["ignoreInitial"] * 1.05) + 20
+        transport.addFilmDrive(hw["filmdrive"], holeSteps, jitter=jitter)
+        for name in ("feeder", "pickup"):
+            steps = 0.8 * fmt[name]["speed"] * fmt[name]["targetTime"]
+            transport.addReel(hw[name], holeSteps / max(1.0, steps), holeSteps)
+        return transport
+
+    def addFilmDrive(self, cfg, holeSteps, holeWidth=40, jitter=0.0, shrinkage=0.0):
+        self.filmDrive = FilmDrive(
+            cfg, holeSteps, holeWidth, jitter, shrinkage, self.rng
+        )
+        self.byStepPin[cfg["pinStep"]] = self.filmDrive
+        self.bySensorPin[cfg["stopPin"]] = self.filmDrive
+
+    def addReel(self, cfg, ratio, tension=0.0, growth=0.0):
+        reel = Reel(cfg, ratio, growth, tension)
+        self.reels.append(reel)
+        self.byStepPin[cfg["pinStep"]] = reel
+        self.bySensorPin[cfg["stopPin"]] = reel
+
+    def breakFilm(self, afterSteps=0):
+        # after that many more film drive steps
+        with self.lock:
+            self.breakAfter = afterSteps
+
+    def step(self, part):
+        with self.lock:
+            if self.broken:
+                return
+            part.step()
+            if part is self.filmDrive:
+                for reel in self.reels:
+                    reel.tension += 1
+                if self.breakAfter != None:
+                    self.breakAfter -= 1
+                    self.broken = self.breakAfter <= 0
+
+    def sense(self, part):
+        with self.lock:
+            active = self.broken or part.sensing()
+        state = part.cfg["stopState"]
+        return state if active else 1 - state
+
+
+class SimulatedGpio:
+    BCM = BCM
+    BOARD = BOARD
+    OUT = OUT
+    IN = IN
+    LOW = LOW
+    HIGH = HIGH
+    PUD_OFF = PUD_OFF
+    PUD_DOWN = PUD_DOWN
+    PUD_UP = PUD_UP
+    RISING = RISING
+    FALLING = FALLING
+    BOTH = BOTH
+
+    def __init__(self):
+        self.levels = {}
+        self.transport = None
+        self.events = {}
+        self.edgeLock = Lock()
+
+    def attach(self, transport):
+        self.transport = transport
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def cleanup(self):
+        self.levels = {}
+        self.events = {}
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        # the callbacks come from the thread that steps the motor, not from
+        # a thread of their own like with RPi.GPIO
+        bounce = (bouncetime or 0) / 1000.0
+        self.events[pin] = [edge, callback, bounce, self.input(pin), -bounce]
+
+    def remove_event_detect(self, pin):
+        self.events.pop(pin, None)
+
+    def checkEdges(self):
+        with self.edgeLock:
+            for pin, event in list(self.events.items()):
+                self.checkEdge(pin, event)
+
+    def checkEdge(self, pin, event):
+        edge, callback, bounce, last, fired = event
+        level = self.input(pin)
+        if level == last:
+            return
+        event[3] = level
+        wanted = edge == BOTH or (edge == RISING) == (level == HIGH)
+        now = monotonic()
+        if wanted and callback != None and now - fired >= bounce:
+            event[4] = now
+            callback(pin)
+
+    def setup(self, pin, direction, initial=LOW, pull_up_down=PUD_OFF):
+        if direction == OUT:
+            self.levels[pin] = int(initial)
+        else:
+            self.levels[pin] = HIGH if pull_up_down == PUD_UP else LOW
+
+    def output(self, pin, value):
+        value = int(value)
+        if self.transport != None and self.levels.get(pin) != value:
+            part = self.transport.byStepPin.get(pin)
+            # a disabled driver (enable pin high) doesn't step
+            if part != None and self.levels.get(part.cfg["pinEnable"]) == LOW:
+                self.transport.step(part)
+                self.levels[pin] = value
+                self.checkEdges()
+                return
+        self.levels[pin] = value
+
+    def input(self, pin):
+        if self.transport != None and pin in self.transport.bySensorPin:
+            return self.transport.sense(self.transport.bySensorPin[pin])
+        return self.levels.get(pin, LOW)
+
+
+GPIO = SimulatedGpio()
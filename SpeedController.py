@@ -0,0 +1,119 @@
+from threading import Lock
+from time import time
+from ConfigFiles import ConfigFiles
+
+# Closed loop speed control for the motors, selected per film format and
+# motor with "controller": "pi" in hardwarecfg.json, the averaging in
+# TrinamicSilentMotor.calculateNewSpeed otherwise. The speed a controller
+# settles on and its move time statistics are kept in learnedSpeeds.json per
+# film format and motor, the next session starts from there instead of from
+# the configured speed.
+
+
+class LearnedSpeeds:
+    # shared by the motors, the reels save from their own threads
+    def __init__(self, filename="learnedSpeeds.json"):
+        self.filename = filename
+        self.lock = Lock()
+        self.data = None
+
+    def load(self):
+        if self.data == None:
+            self.data = ConfigFiles(self.filename)
+        return self.data
+
+    def get(self, filmFormat, name):
+        with self.lock:
+            return self.load().get(filmFormat, {}).get(name)
+
+    def put(self, filmFormat, name, state):
+        with self.lock:
+            data = self.load()
+            data.setdefault(filmFormat, {})[name] = state
+            data.save()
+
+
+learnedSpeeds = LearnedSpeeds()
+
+
+class PiController:
+    # The error is how much longer than the target time the move took,
+    # relative to the target time, a positive error asks for more speed.
+    # The output is the speed the controller started from times
+    # (1 + kp * error + integral). The integral is clamped (anti-windup), by
+    # default to what reaches the speed limits, and isn't accumulated while
+    # the output is held by those limits or by the rate limit, a move
+    # changes the speed by maxChange at most.
+    def __init__(self, cfg, speed, targetTime, lowest, highest):
+        self.kp = cfg.get("kp", 0.1)
+        self.ki = cfg.get("ki", 0.25)
+        self.maxIntegral = cfg.get("maxIntegral")
+        self.maxChange = cfg.get("maxChange", 0.1)
+        self.deadband = cfg.get("deadband", 0.01)
+        self.saveEvery = cfg.get("saveEvery", 250)
+        self.targetTime = targetTime
+        self.lowest = lowest
+        self.highest = highest
+        self.base = speed
+        self.speed = speed
+        self.integral = 0.0
+        self.moves = 0
+        self.mean = None
+        self.variance = 0.0
+        self.unsaved = 0
+
+    def integralLimit(self):
+        if self.maxIntegral != None:
+            return self.maxIntegral
+        return max(1.0, self.highest / self.base - 1.0)
+
+    def restore(self, learned):
+        # the move time goes with the inverse of the speed, a changed
+        # target time scales the learned speed
+        speed = learned["speed"] * learned["targetTime"] / self.targetTime
+        self.base = min(max(speed, self.lowest), self.highest)
+        self.speed = self.base
+        self.moves = learned.get("moves", 0)
+        self.mean = learned.get("mean")
+        self.variance = learned.get("stdev", 0.0) ** 2
+
+    def state(self):
+        return {
+            "speed": round(self.speed, 1),
+            "targetTime": self.targetTime,
+            "moves": self.moves,
+            "mean": self.mean,
+            "stdev": round(self.variance**0.5, 6),
+            "saved": int(time()),
+        }
+
+    def measure(self, duration):
+        # slow moving averages of the move time, for the record
+        self.moves += 1
+        self.unsaved += 1
+        if self.mean == None:
+            self.mean = round(duration, 6)
+            return
+        diff = duration - self.mean
+        self.mean = round(self.mean + 0.02 * diff, 6)
+        self.variance = 0.98 * (self.variance + 0.02 * diff * diff)
+
+    def update(self, duration):
+        self.measure(duration)
+        error = (duration - self.targetTime) / self.targetTime
+        if abs(error) < self.deadband:
+            error = 0.0
+        limit = self.integralLimit()
+        integral = min(max(self.integral + self.ki * error, -limit), limit)
+        wanted = self.base * (1.0 + self.kp * error + integral)
+        change = self.speed * self.maxChange
+        speed = min(max(wanted, self.speed - change), self.speed + change)
+        speed = min(max(speed, self.lowest), self.highest)
+        held = speed != wanted
+        if not held or (wanted > speed) != (error > 0):
+            self.integral = integral
+        self.speed = speed
+        return speed
+
+    def due(self):
+        return self.unsaved >= self.saveEvery
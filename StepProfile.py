@@ -0,0 +1,46 @@
+from array import array
+
+# The trapezoid speed profiles of the motors, worked out once per format or
+# speed change as the interval to wait after every step, so the move loops
+# only have to index them. Past the end of a table the motor keeps going
+# at its slow speed (speed2) until the sensor triggers.
+
+
+def filmDriveProfile(speed, speed2, ignoreInitial):
+    # ramps up over the first eighth of ignoreInitial steps and down over
+    # the last one, interval[ticks] as in the former nextDelayForFilmDrive()
+    eighthPoint = ignoreInitial / 8.0
+    sevenEighthPoint = 7.0 * ignoreInitial / 8.0
+    intervals = array("d", [1.0 / speed2])
+    for ticks in range(1, int(ignoreInitial) + 1):
+        if ticks <= eighthPoint:
+            pointSpeed = speed2 + (speed - speed2) * (ticks / eighthPoint)
+        elif ticks <= sevenEighthPoint:
+            pointSpeed = speed
+        else:
+            pointSpeed = speed - (speed - speed2) * (
+                (ticks - sevenEighthPoint) / eighthPoint
+            )
+        intervals.append(1.0 / pointSpeed)
+    return intervals
+
+
+def turnTableProfile(speed, speed2, targetTime):
+    # The same shape spread over targetTime seconds instead of a number of
+    # steps, the steps are placed by walking the profile through time.
+    eighthTime = targetTime / 8.0
+    sevenEighthTime = 7.0 * targetTime / 8.0
+    intervals = array("d", [1.0 / speed2])
+    delta = 0.0
+    while delta <= targetTime:
+        if delta < eighthTime:
+            pointSpeed = speed2 + (speed - speed2) * (delta / eighthTime)
+        elif delta < sevenEighthTime:
+            pointSpeed = speed
+        else:
+            pointSpeed = speed - (speed - speed2) * (
+                (delta - sevenEighthTime) / eighthTime
+            )
+        intervals.append(1.0 / pointSpeed)
+        delta += 1.0 / pointSpeed
+    return intervals
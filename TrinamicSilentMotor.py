@@ -7,12 +7,14 @@
 # 3 pins motor driver for the Gugusse Roller
 #
 ################################################################################
-from time import sleep, time
+from time import sleep, time, monotonic_ns
 from datetime import datetime
-import RPi.GPIO as GPIO
+from GpioBackend import GPIO
 
 GPIO.setmode(GPIO.BCM)
 from json import dumps, dump
+from StepProfile import filmDriveProfile, turnTableProfile
+from SpeedController import PiController, learnedSpeeds
 from PyQt5.QtWidgets import QPushButton
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QIcon
@@ -46,10 +48,12 @@ class TrinamicSilentMotor:
         self.name = cfg["name"]
         if self.isFilmDrive:
             self.move = self.moveForFilmDrive
-            self.nextDelay = self.nextDelayForFilmDrive
         else:
             self.move = self.moveForTurnTables
-            self.nextDelay = self.nextDelayForTurnTables
+        self.profile = None
+        self.profileSpeed = None
+        self.controller = None
+        self.filmFormat = None
         self.SensorStopPin = cfg["stopPin"]
         self.pinEnable = cfg["pinEnable"]
         self.pinDirection = cfg["pinDirection"]
@@ -57,6 +61,7 @@ class TrinamicSilentMotor:
         self.SensorStopState = cfg["stopState"]
         self.inverted = cfg["invert"]
         self.lasttick = time()
+        self.stopTime = None
         self.toggle = 0
         self.shortsInARow = 0
         GPIO.setup(self.pinStep, GPIO.OUT, initial=0)
@@ -69,6 +74,49 @@ class TrinamicSilentMotor:
             GPIO.setup(self.SensorStopPin, GPIO.IN)
         GPIO.setup(self.pinDirection, GPIO.OUT, initial=0)
         self.log = {}
+        self.armed = False
+        self.triggered = False
+        self.edgeTime = None
+        self.sensorHit = self.pollSensor
+        if "flags" in cfg and "edgeDetect" in cfg["flags"]:
+            self.watchSensor(cfg.get("debounceMs", 1))
+
+    def watchSensor(self, debounceMs):
+        # The sensor interrupts instead of being read at every step, the
+        # move loops only look at the flag the callback raises.
+        edge = GPIO.RISING if self.SensorStopState else GPIO.FALLING
+        try:
+            GPIO.add_event_detect(
+                self.SensorStopPin,
+                edge,
+                callback=self.sensorEdge,
+                bouncetime=max(1, int(debounceMs)),
+            )
+        except RuntimeError as e:
+            print(f"{self.name}: no edge detection ({e}), polling the sensor")
+            return
+        self.sensorHit = self.flagSensor
+
+    def sensorEdge(self, channel):
+        # runs in the GPIO library's thread
+        if self.armed and not self.triggered:
+            self.edgeTime = monotonic_ns()
+            self.triggered = True
+
+    def pollSensor(self):
+        if GPIO.input(self.SensorStopPin) != self.SensorStopState:
+            return False
+        self.edgeTime = monotonic_ns()
+        return True
+
+    def flagSensor(self):
+        return self.triggered
+
+    def armSensor(self):
+        # edges count from now on, the sensor may well be on already
+        self.triggered = False
+        self.armed = True
+        self.triggered = self.triggered or self.pollSensor()
 
     def message(self, txt):
         if self.signal != None:
@@ -81,9 +129,8 @@ class TrinamicSilentMotor:
         self.fault = False
         self.shortsInARow = 0
 
-    def setFormat(self, cfg):
+    def setFormat(self, cfg, filmFormat=None):
         self.speed = cfg["speed"]
-        self.signal.emit(f"spdchg,{self.name},{self.speed}")
         self.speed2 = cfg["speed2"]
         self.faultTreshold = cfg["faultTreshold"]
         self.ignoreInitial = cfg["ignoreInitial"]
@@ -98,12 +145,54 @@ class TrinamicSilentMotor:
             self.halfpoint = self.ignoreInitial / 2
         else:
             self.halfTime = self.targetTime / 2
+        self.filmFormat = filmFormat
+        self.controller = None
+        if cfg.get("controller", "heuristic") == "pi":
+            self.startController(cfg)
+        self.signal.emit(f"spdchg,{self.name},{self.speed}")
+        self.profileSpeed = None
+        self.buildProfile()
+
+    def startController(self, cfg):
+        self.controller = PiController(
+            cfg, self.speed, self.targetTime, self.speed2, self.maxSpeed
+        )
+        learned = None
+        if self.filmFormat != None:
+            learned = learnedSpeeds.get(self.filmFormat, self.name)
+        if learned != None:
+            self.controller.restore(learned)
+            self.speed = int(self.controller.speed)
+            print(f"{self.name}: starting from the learned speed {self.speed}")
+
+    def saveLearned(self):
+        if self.controller == None or self.filmFormat == None:
+            return
+        if self.controller.unsaved == 0:
+            return
+        learnedSpeeds.put(self.filmFormat, self.name, self.controller.state())
+        self.controller.unsaved = 0
+
+    def buildProfile(self):
+        # only redone when the format or the speed changed
+        if self.profileSpeed == self.speed:
+            return
+        if self.isFilmDrive:
+            self.profile = filmDriveProfile(self.speed, self.speed2, self.ignoreInitial)
+        else:
+            self.profile = turnTableProfile(self.speed, self.speed2, self.targetTime)
+        self.profileLength = len(self.profile)
+        self.cruise = 1.0 / self.speed2
+        # how late a step may be and still be caught up on the next ones
+        self.slack = min(self.profile)
+        self.profileSpeed = self.speed
 
     def enable(self):
         GPIO.output(self.pinEnable, 0)
 
     def disable(self):
         GPIO.output(self.pinEnable, 1)
+        self.saveLearned()
         if self.trace and self.log != {}:
             fn = f"{datetime.now().isoformat()}-{self.name}.json"
             self.log["name"] = self.name
@@ -111,50 +200,27 @@ class TrinamicSilentMotor:
                 dump(self.log, h, indent=4)
             self.log = {}
 
-    def nextDelayForTurnTables(self):
-        now = time()
-        delta = now - self.moveStart
-
-        if delta > self.targetTime:
-            return now + (1.0 / self.speed2)
-        if delta < self.eighthTime:
-            pointSpeed = self.speed2 + (self.speed - self.speed2) * (
-                delta / self.eighthTime
-            )
-        elif delta < self.sevenEighthTime:
-            pointSpeed = self.speed
-        else:
-            pointSpeed = self.speed - (self.speed - self.speed2) * (
-                (delta - self.sevenEighthTime) / self.eighthTime
-            )
-
-        return now + (1.0 / pointSpeed)
-
-    def nextDelayForFilmDrive(self):
-        now = time()
-
-        if self.ticks > self.ignoreInitial:
-            return now + (1.0 / self.speed2)
-        if self.ticks <= self.eighthPoint:
-            pointSpeed = self.speed2 + (self.speed - self.speed2) * (
-                self.ticks / self.eighthPoint
-            )
-        elif self.ticks <= self.sevenEighthPoint:
-            pointSpeed = self.speed
-        else:
-            pointSpeed = self.speed - (self.speed - self.speed2) * (
-                (self.ticks - self.sevenEighthPoint) / self.eighthPoint
-            )
-
-        return now + (1.0 / pointSpeed)
-
-    def tick(self):
+    def tick(self, scheduled):
+        # steps and returns when the next step is due, counted from when
+        # this one was due so the loop overhead doesn't stretch the periods
         self.ticks += 1
         if self.ticks > self.faultTreshold:
             return None
         self.toggle = not self.toggle
         GPIO.output(self.pinStep, self.toggle)
-        return self.nextDelay()
+        if self.ticks < self.profileLength:
+            return scheduled + self.profile[self.ticks]
+        return scheduled + self.cruise
+
+    def waitStep(self, waitUntil):
+        now = time()
+        delay = waitUntil - now
+        if delay > 0.0:
+            sleep(delay)
+        elif delay < -self.slack:
+            # too late to catch up without a jolt, start over from now
+            return self.tick(now)
+        return self.tick(waitUntil)
 
     def getPowerState(self):
         return 1 - GPIO.input(self.pinEnable)
@@ -170,7 +236,30 @@ class TrinamicSilentMotor:
         else:
             GPIO.output(self.pinDirection, 1)
 
+    def controlSpeed(self):
+        # one correction per move, from the time this move took, short
+        # moves (sensor already on, film broken or at its end) don't count
+        if len(self.histo) == 0 or self.shortsInARow > 0:
+            self.histo = []
+            return self.speed
+        duration = self.histo[-1]
+        if not self.isFilmDrive and duration > self.targetTime:
+            # past the end of the profile the reel crawls at speed2, at full
+            # speed those steps would have been speed / speed2 times faster
+            duration = self.targetTime + (duration - self.targetTime) * (
+                self.speed2 / self.speed
+            )
+        newspeed = int(self.controller.update(duration))
+        self.histo = []
+        if self.controller.due():
+            self.saveLearned()
+        if newspeed != self.speed:
+            self.signal.emit(f"spdchg,{self.name},{newspeed}")
+        return newspeed
+
     def calculateNewSpeed(self):
+        if self.controller != None:
+            return self.controlSpeed()
         if self.skipAdjust > 0:
             self.skipAdjust -= 1
             return self.speed
@@ -208,13 +297,16 @@ class TrinamicSilentMotor:
             ticks -= 1
 
     def moveForTurnTables(self):
+        self.buildProfile()
         self.ticks = 0
         self.moveStart = time()
-        waitUntil = self.tick()
+        self.moveStartNs = monotonic_ns()
+        self.armSensor()
+        waitUntil = self.tick(self.moveStart)
         while waitUntil != None:
-            reading = GPIO.input(self.SensorStopPin)
-            if reading == self.SensorStopState:
-                delta = time() - self.moveStart
+            if self.sensorHit():
+                # from when the sensor actually triggered
+                delta = (self.edgeTime - self.moveStartNs) / 1e9
                 if self.ticks < self.ignoreInitial:
                     self.shortsInARow += 1
                 else:
@@ -230,12 +322,9 @@ class TrinamicSilentMotor:
                 else:
                     self.skipHisto -= 1
                 self.speed = self.calculateNewSpeed()
+                self.stopTime = monotonic_ns()
                 return
-            delay = waitUntil - time()
-            if delay > 0.0:
-                sleep(delay)
-
-            waitUntil = self.tick()
+            waitUntil = self.waitStep(waitUntil)
         self.fault = True
         self.message("{} long FAULT".format(self.name))
         raise Exception(
@@ -245,10 +334,12 @@ class TrinamicSilentMotor:
         )
 
     def moveForFilmDrive(self):
+        self.buildProfile()
         self.ticks = 0
+        self.armed = False
         GPIO.output(self.learnPin, 1)
         self.moveStart = time()
-        waitUntil = self.tick()
+        waitUntil = self.tick(self.moveStart)
         pointToStopLearning = self.ignoreInitial - 5
         while waitUntil != None:
             if self.ticks == pointToStopLearning:
@@ -259,9 +350,9 @@ class TrinamicSilentMotor:
                     self.histo.append(delta)
                 else:
                     self.skipHisto -= 1
-            if self.ticks >= self.ignoreInitial and self.SensorStopState == GPIO.input(
-                self.SensorStopPin
-            ):
+            if self.ticks >= self.ignoreInitial and not self.armed:
+                self.armSensor()
+            if self.ticks >= self.ignoreInitial and self.sensorHit():
                 if self.trace:
                     if f"{self.ticks}" in self.log:
                         self.log[f"{self.ticks}"] += 1
@@ -278,11 +369,9 @@ class TrinamicSilentMotor:
                         "\033[1;31mFAULT\033[0m: only the lowest amount of steps for 10 cycles in a row"
                     )
                 self.speed = self.calculateNewSpeed()
+                self.stopTime = monotonic_ns()
                 return
-            delay = waitUntil - time()
-            if delay > 0.0:
-                sleep(delay)
-            waitUntil = self.tick()
+            waitUntil = self.waitStep(waitUntil)
 
         self.fault = True
         self.message("{} long FAULT".format(self.name))
@@ -294,10 +383,11 @@ class TrinamicSilentMotor:
 
 
 class PinToggler(QThread):
-    def __init__(self, pin):
+    def __init__(self, pin, motor=None):
         QThread.__init__(self)
         self.loop = True
         self.pin = pin
+        self.motor = motor
         self.toggle = GPIO.input(pin)
 
     def run(self):
@@ -309,6 +399,9 @@ class PinToggler(QThread):
             if t > lowl:
                 t = t / (1 + (t / 2))
             sleep(t)
+        if self.motor != None:
+            # a jog is a move too, the camera waits for the film to settle
+            self.motor.stopTime = monotonic_ns()
 
     def killLoop(self):
         self.loop = False
@@ -334,7 +427,7 @@ class MotorManualWidget(QPushButton):
         if self.toggler:
             self.signal.emit("Weird bug where the previous task is still there")
             return
-        self.toggler = PinToggler(self.pin)
+        self.toggler = PinToggler(self.pin, self.motor)
         dirval = self.cfg["invert"]
         if self.direction == "ccw":
             dirval = not dirval
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+# Runs the real capture stack, CaptureLoop, FrameSequence, GCamera, the
+# encoders and the export, headless for a number of frames per capture
+# mode. Only the camera is synthetic (fakeCamera.py) and the GPIO simulated
+# (GUGUSSE_GPIO=sim). The frames go to a local directory or, with "ftp",
+# to a pyftpdlib server on localhost. Reports frames/hour, the per-stage
+# timings, the peak RSS and how much of /dev/shm the frames took at most.
+#
+#   python3 benchmarks/captureThroughput.py [frames] [modes] [local|ftp]
+#       [pipelined] [film format] [WIDTHxHEIGHT] [latency]
+#
+#   modes: comma separated, DNG,singleJpg,bracketing by default
+#   latency: frames before an exposure change takes effect, 2 by default
+#
+# Each mode runs in a process of its own so the RSS peaks don't add up.
+# The ftp sink needs pyftpdlib (pip3 install pyftpdlib).
+import os
+import sys
+import json
+import shutil
+import fnmatch
+import logging
+import tempfile
+import subprocess
+from threading import Thread
+from time import time, sleep
+
+benchmarks = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(benchmarks, ".."))
+sys.path.insert(0, benchmarks)
+
+
+class Messages:
+    # stands in for the Qt signals, keeps the timing summaries
+    def __init__(self):
+        self.lines = []
+        self.summary = []
+
+    def emit(self, msg):
+        msg = str(msg)
+        self.lines.append(msg)
+        if msg.startswith("timings over"):
+            self.summary = [msg]
+        elif len(self.summary) > 0 and msg.split(":")[0].isidentifier():
+            self.summary.append(msg)
+        elif "FAULT" in msg or "Failure" in msg or "failed" in msg:
+            print(msg)
+
+
+class Field:
+    # the few widgets the capture loop reads
+    def __init__(self, value):
+        self.value = value
+        self.signal = Messages()
+
+    def text(self):
+        return self.value
+
+    def currentText(self):
+        return self.value
+
+
+class MotorWidget:
+    def __init__(self, motor):
+        self.motor = motor
+
+
+class Win:
+    pass
+
+
+def kilobytes(field):
+    with open("/proc/self/status") as h:
+        for line in h:
+            if line.startswith(field):
+                return int(line.split()[1])
+    return 0
+
+
+def shmUsed():
+    st = os.statvfs("/dev/shm")
+    return (st.f_blocks - st.f_bfree) * st.f_frsize
+
+
+def startFtp(root):
+    from pyftpdlib.authorizers import DummyAuthorizer
+    from pyftpdlib.handlers import FTPHandler
+    from pyftpdlib.servers import ThreadedFTPServer
+
+    class GlobHandler(FTPHandler):
+        # pyftpdlib doesn't glob "NLST *.dng" like the usual servers
+        def ftp_NLST(self, path):
+            pattern = os.path.basename(path)
+            if not any(c in pattern for c in "*?["):
+                return FTPHandler.ftp_NLST(self, path)
+            names = fnmatch.filter(self.fs.listdir(os.path.dirname(path)), pattern)
+            if len(names) == 0:
+                self.respond("450 No files found")
+                return
+            data = "\r\n".join(sorted(names)) + "\r\n"
+            self.push_dtp_data(data.encode("utf8"), cmd="NLST")
+
+    logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+    authorizer = DummyAuthorizer()
+    authorizer.add_user("gugusse", "roller", root, perm="elradfmwMT")
+    GlobHandler.authorizer = authorizer
+    server = ThreadedFTPServer(("127.0.0.1", 0), GlobHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def runMode(frames, mode, sink, pipelined, filmFormat, size, latency):
+    work = tempfile.mkdtemp()
+    target = tempfile.mkdtemp()
+    os.chdir(work)
+    os.environ["GUGUSSE_GPIO"] = "sim"
+    os.environ["GUGUSSE_SIM_FORMAT"] = filmFormat
+    import fakeCamera
+
+    fakeCamera.install(size[0], size[1], latency)
+
+    from ConfigFiles import ConfigFiles
+    from GCamera import GCamera
+    from CaptureLoop import CaptureLoop
+    from TrinamicSilentMotor import TrinamicSilentMotor
+
+    server = None
+    hw = ConfigFiles("hardwarecfg.json")
+    if sink == "ftp":
+        server = startFtp(target)
+        with open("ftp.json", "wt") as h:
+            json.dump(
+                {
+                    "server": "127.0.0.1",
+                    "port": server.address[1],
+                    "user": "gugusse",
+                    "passwd": "roller",
+                    "path": "",
+                },
+                h,
+            )
+    else:
+        hw["saveMode"] = "local"
+        hw["localFilePath"] = target
+    win = Win()
+    win.settings = ConfigFiles("GugusseSettings.json")
+    win.settings["PipelinedCapture"] = pipelined
+    win.hwSettings = hw
+    win.projectName = Field("bench")
+    win.filmFormat = Field(filmFormat)
+    win.captureMode = Field(mode)
+    win.reelsDirection = Field("cw")
+    win.light_selector = Field("on")
+    win.motors = {}
+    quiet = Messages()
+    for name in ("feeder", "filmdrive", "pickup"):
+        win.motors[name] = MotorWidget(TrinamicSilentMotor(hw[name], signal=quiet))
+    win.picam2 = GCamera(win)
+
+    messages = Messages()
+    loop = CaptureLoop(win, messages)
+    stats = {"shm": 0, "captured": None}
+    baseline = shmUsed()
+
+    def monitor():
+        while True:
+            stats["shm"] = max(stats["shm"], shmUsed() - baseline)
+            sequence = getattr(loop, "sequence", None)
+            if stats["captured"] == None and sequence != None:
+                if sequence.frames >= frames or not loop.Loop:
+                    stats["captured"] = time()
+                    stats["frames"] = sequence.frames
+                    loop.stopLoop()
+            if stats.get("done"):
+                return
+            sleep(0.02)
+
+    watcher = Thread(target=monitor, daemon=True)
+    start = time()
+    watcher.start()
+    loop.run()
+    end = time()
+    stats["done"] = True
+    watcher.join()
+    captured = stats.get("frames", loop.sequence.frames)
+    capturing = (stats["captured"] or end) - start
+    if server != None:
+        server.close_all()
+    shutil.rmtree(work)
+    shutil.rmtree(target)
+    return {
+        "mode": mode,
+        "frames": captured,
+        "framesPerHour": captured / capturing * 3600,
+        "drainSeconds": end - (stats["captured"] or end),
+        "peakRssMB": kilobytes("VmHWM") / 1000,
+        "shmPeakMB": stats["shm"] / 1e6,
+        "timings": messages.summary,
+    }
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a not in ("local", "ftp", "pipelined")]
+    sink = "ftp" if "ftp" in sys.argv[1:] else "local"
+    pipelined = "pipelined" in sys.argv[1:]
+    frames = int(args[0]) if len(args) > 0 else 20
+    modes = args[1].split(",") if len(args) > 1 else ["DNG", "singleJpg", "bracketing"]
+    filmFormat = args[2] if len(args) > 2 else "16mm"
+    size = tuple(int(v) for v in args[3].split("x")) if len(args) > 3 else (4056, 3040)
+    latency = int(args[4]) if len(args) > 4 else 2
+    if os.environ.get("CAPTURE_BENCH_CHILD") == "1":
+        result = runMode(frames, modes[0], sink, pipelined, filmFormat, size, latency)
+        print("RESULT " + json.dumps(result))
+        sys.exit(0)
+    print(
+        f"{frames} frames of {filmFormat} at {size[0]}x{size[1]} to {sink}"
+        f", exposure latency {latency} frames"
+        f"{', pipelined' if pipelined else ''}"
+    )
+    for mode in modes:
+        child = [sys.executable, os.path.realpath(__file__), str(frames), mode]
+        child += [filmFormat, f"{size[0]}x{size[1]}", str(latency), sink]
+        if pipelined:
+            child.append("pipelined")
+        env = dict(os.environ, CAPTURE_BENCH_CHILD="1")
+        run = subprocess.run(child, env=env, capture_output=True, text=True)
+        results = [l for l in run.stdout.splitlines() if l.startswith("RESULT ")]
+        if len(results) == 0:
+            print(f"{mode}: failed\n{run.stdout[-2000:]}\n{run.stderr[-2000:]}")
+            continue
+        result = json.loads(results[0][7:])
+        print(
+            f"{mode:12s} {result['frames']} frames, {result['framesPerHour']:.0f} frames/h,"
+            f" drained in {result['drainSeconds']:.1f}s, peak RSS {result['peakRssMB']:.0f}MB,"
+            f" /dev/shm peak {result['shmPeakMB']:.0f}MB"
+        )
+        for line in result["timings"]:
+            print(f"    {line}")
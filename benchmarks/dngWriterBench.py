@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+# Compares the picamera2/PiDNG DNG path with the streaming DngWriter, as is
+# (16 bits samples) and packing to 12 bits, on a synthetic HQ camera raw
+# frame (4056x3040, unpacked 12 bits, padded rows). "csi2p" is the same frame
+# captured with PackedRaw, CSI-2 packed, repacked to DNG 12 bits by the writer.
+#
+#   python3 benchmarks/dngWriterBench.py [frames] [output directory]
+#
+# Every path runs in its own process so the peak RSS it reports is its own.
+# "allocated" is the tracemalloc peak during the write, which is the bytes
+# copied into new buffers on the way to the file.
+import os
+import sys
+import resource
+import subprocess
+import tracemalloc
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import numpy as np
+import DngWriter
+
+width = 4056
+height = 3040
+stride = 8128
+rawConfig = {"size": (width, height), "stride": stride, "format": "SRGGB12"}
+packedStride = 6112
+packedConfig = {
+    "size": (width, height),
+    "stride": packedStride,
+    "format": "SRGGB12_CSI2P",
+}
+metadata = {
+    "ExposureTime": 30000,
+    "AnalogueGain": 1.0,
+    "DigitalGain": 1.0,
+    "SensorTimestamp": 0,
+    "ColourGains": (2.2, 2.1),
+    "ColourCorrectionMatrix": (1.8, -0.6, -0.2, -0.3, 1.6, -0.3, 0.0, -0.6, 1.6),
+    "SensorBlackLevels": (4096, 4096, 4096, 4096),
+}
+
+
+def fakeCameraBuffer():
+    # stands for the dmabuf the camera hands us, allocated before measuring
+    rng = np.random.default_rng(1)
+    frame = np.zeros((height, stride), dtype=np.uint8)
+    pixels = frame[:, : width * 2].view(np.uint16)
+    pixels[:] = rng.integers(256, 4095, size=pixels.shape, dtype=np.uint16)
+    return frame
+
+
+def fakePackedBuffer():
+    pixels = fakeCameraBuffer()[:, : width * 2].view(np.uint16)
+    frame = np.zeros((height, packedStride), dtype=np.uint8)
+    frame[:, 0 : width * 3 // 2 : 3] = pixels[:, 0::2] >> 4
+    frame[:, 1 : width * 3 // 2 : 3] = pixels[:, 1::2] >> 4
+    frame[:, 2 : width * 3 // 2 : 3] = (pixels[:, 0::2] & 0x0F) | (
+        (pixels[:, 1::2] & 0x0F) << 4
+    )
+    return frame
+
+
+def currentPath(frame, fn):
+    # what helpers.save_dng does after capture_buffers(["raw"])
+    from pidng.core import PICAM2DNG
+    from pidng.camdefs import Picamera2Camera
+
+    buffer = frame.reshape(-1).copy()
+    raw = buffer.reshape((height, stride))
+    camera = Picamera2Camera(dict(rawConfig), metadata)
+    r = PICAM2DNG(camera)
+    r.options(compress=False)
+    r.convert(raw, fn)
+
+
+def streamPath(frame, fn):
+    DngWriter.saveDng(fn, frame, rawConfig, metadata, "imx477")
+
+
+def streamPackedPath(frame, fn):
+    DngWriter.saveDng(fn, frame, rawConfig, metadata, "imx477", pack=True)
+
+
+def csi2pPath(frame, fn):
+    DngWriter.saveDng(fn, frame, packedConfig, metadata, "imx477", pack=True)
+
+
+paths = {
+    "current": currentPath,
+    "stream": streamPath,
+    "packed": streamPackedPath,
+    "csi2p": csi2pPath,
+}
+
+
+def runOne(name, frames, outDir):
+    if name == "csi2p":
+        frame = fakePackedBuffer()
+    else:
+        frame = fakeCameraBuffer()
+    path = paths[name]
+    rssBefore = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    start = time()
+    peak = 0
+    for i in range(frames):
+        fn = os.path.join(outDir, f"bench_{name}_{i:05d}.dng")
+        tracemalloc.reset_peak()
+        path(frame, fn)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        size = os.path.getsize(fn)
+        os.remove(fn)
+    elapsed = (time() - start) / frames
+    tracemalloc.stop()
+    rssAfter = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        f"{name:8s} {elapsed * 1000:8.1f}ms/frame  allocated {peak / 1e6:7.1f}MB/frame"
+        f"  peak RSS +{(rssAfter - rssBefore) / 1024:7.1f}MB  file {size / 1e6:.1f}MB"
+        f"  raw buffer {frame.nbytes / 1e6:.1f}MB"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in paths:
+        runOne(sys.argv[1], int(sys.argv[2]), sys.argv[3])
+        sys.exit(0)
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    outDir = sys.argv[2] if len(sys.argv) > 2 else "/dev/shm"
+    for name in paths:
+        result = subprocess.run(
+            [sys.executable, __file__, name, str(frames), outDir],
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            print(f"{name:8s} failed: {result.stderr.strip().splitlines()[-1]}")
+        else:
+            print(result.stdout.strip())
@@ -0,0 +1,195 @@
+# A synthetic sensor standing in for picamera2 and libcamera, enough of
+# them for GCamera and CameraSettings to be imported and driven by the
+# capture loop off the Pi. install() has to be called before importing
+# either. The sensor free-runs at the configured frame rate, exposure
+# changes take effect "latency" frames after being set like on the real
+# one, and every buffer is a copy of one synthetic image.
+import sys
+import types
+from threading import Lock
+from time import sleep, monotonic_ns
+
+import numpy as np
+from PIL import Image
+
+import DngWriter
+
+MODEL = "imx477"
+sensor = {"size": (4056, 3040), "latency": 2}
+
+
+def syntheticImages(width, height, rawFormat):
+    # a gradient with some noise, so the encoders have real work to do
+    rng = np.random.default_rng(1)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    noise = rng.integers(0, 24, (height, width), dtype=np.uint8)
+    grey = ((x + y) / 2).astype(np.uint8) + noise
+    main = np.stack([grey, grey[::-1], grey[:, ::-1]], axis=2)
+    pattern, bits, packed = DngWriter.rawFormat(rawFormat)
+    if packed:
+        stride = (width * bits // 8 + 31) // 32 * 32
+        raw = rng.integers(0, 256, (height, stride), dtype=np.uint8)
+    else:
+        stride = width * 2
+        raw = (grey.astype(np.uint16) << (bits - 8)).view(np.uint8)
+    return main, raw, stride
+
+
+class Request:
+    def __init__(self, camera, metadata):
+        self.camera = camera
+        self.metadata = metadata
+
+    def get_metadata(self):
+        return self.metadata
+
+    def make_buffer(self, name):
+        return self.camera.images[name].reshape(-1).copy()
+
+    def release(self):
+        pass
+
+
+class MappedArray:
+    def __init__(self, request, name):
+        self.array = request.camera.images[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class Helpers:
+    def make_array(self, buffer, cfg):
+        width, height = cfg["size"]
+        return buffer.reshape(height, width, 3)
+
+    def make_image(self, buffer, cfg):
+        return Image.fromarray(self.make_array(buffer, cfg))
+
+    def save(self, img, metadata, filename):
+        img.save(filename, format="JPEG", quality=90)
+
+    def save_dng(self, buffer, metadata, cfg, filename):
+        DngWriter.saveDng(filename, buffer, cfg, metadata, MODEL)
+
+
+class Picamera2:
+    def __init__(self):
+        self.sensor_resolution = sensor["size"]
+        self.sensor_format = "SRGGB12_CSI2P"
+        self.camera_properties = {"Model": MODEL}
+        self.helpers = Helpers()
+        self.lock = Lock()
+        self.exposure = 30000
+        self.changes = []
+        self.sequence = 0
+        self.framePeriod = 100000000
+        self.nextFrame = monotonic_ns()
+        self.images = {}
+
+    def create_preview_configuration(self, main, controls, raw, transform):
+        width, height = raw["size"]
+        rawFormat = raw.get("format", "SRGGB12")
+        main, rawImage, stride = syntheticImages(width, height, rawFormat)
+        self.images = {"main": main, "raw": rawImage}
+        return {
+            "main": {"size": (width, height), "format": "RGB888"},
+            "raw": {"size": (width, height), "format": rawFormat, "stride": stride},
+            "controls": controls,
+        }
+
+    def configure(self, config):
+        self.config = config
+        self.framePeriod = 1000000000 // config["controls"]["FrameRate"]
+
+    def camera_configuration(self):
+        return self.config
+
+    def start(self):
+        pass
+
+    def set_controls(self, controls):
+        with self.lock:
+            if "ExposureTime" in controls:
+                effective = self.sequence + sensor["latency"]
+                self.changes.append((effective, controls["ExposureTime"]))
+
+    def capture_request(self):
+        # waits for the next frame off the free running sensor
+        with self.lock:
+            now = monotonic_ns()
+            if self.nextFrame < now:
+                # missed frames are gone, like the real camera's
+                missed = (now - self.nextFrame) // self.framePeriod + 1
+                self.sequence += missed
+                self.nextFrame += missed * self.framePeriod
+            wait = self.nextFrame - now
+            self.nextFrame += self.framePeriod
+            self.sequence += 1
+            sequence = self.sequence
+            while len(self.changes) > 0 and self.changes[0][0] <= sequence:
+                self.exposure = self.changes.pop(0)[1]
+            exposure = self.exposure
+        sleep(wait / 1e9)
+        metadata = {
+            "SensorTimestamp": monotonic_ns(),
+            "SensorSequence": sequence,
+            "FrameDuration": self.framePeriod // 1000,
+            "ExposureTime": exposure,
+            "AnalogueGain": 1.0,
+            "DigitalGain": 1.0,
+            "ColourGains": (2.2, 2.1),
+            "ColourTemperature": 5000,
+            "ColourCorrectionMatrix": (
+                1.8,
+                -0.6,
+                -0.2,
+                -0.3,
+                1.6,
+                -0.3,
+                0.0,
+                -0.6,
+                1.6,
+            ),
+            "SensorBlackLevels": (4096, 4096, 4096, 4096),
+            "Lux": 400.0,
+        }
+        return Request(self, metadata)
+
+    def capture_buffers(self, names):
+        request = self.capture_request()
+        buffers = [request.make_buffer(name) for name in names]
+        request.release()
+        return buffers, request.get_metadata()
+
+
+class Transform:
+    def __init__(self, hflip=False, vflip=False):
+        self.hflip = hflip
+        self.vflip = vflip
+
+
+def install(width=4056, height=3040, latency=2):
+    sensor["size"] = (width, height)
+    sensor["latency"] = latency
+    picamera2 = types.ModuleType("picamera2")
+    picamera2.Picamera2 = Picamera2
+    picamera2.MappedArray = MappedArray
+    picamera2.Preview = types.SimpleNamespace(QTGL="QTGL", QT="QT", NULL="NULL")
+    previews = types.ModuleType("picamera2.previews")
+    qt = types.ModuleType("picamera2.previews.qt")
+    qt.QGlPicamera2 = object
+    qt.QPicamera2 = object
+    picamera2.previews = previews
+    previews.qt = qt
+    libcamera = types.ModuleType("libcamera")
+    libcamera.Transform = Transform
+    libcamera.controls = types.SimpleNamespace()
+    sys.modules["picamera2"] = picamera2
+    sys.modules["picamera2.previews"] = previews
+    sys.modules["picamera2.previews.qt"] = qt
+    sys.modules["libcamera"] = libcamera
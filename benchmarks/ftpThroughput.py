@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# Uploads frames through FtpThread to a local pyftpdlib server, once per
+# session count, and reports the throughput. Every STOR is held back by
+# "latency" ms on the server side to stand in for the LAN round trips.
+#
+#   python3 benchmarks/ftpThroughput.py [frames] [frame KB] [latency ms]
+#
+# needs pyftpdlib (pip3 install pyftpdlib)
+import os
+import sys
+import json
+import logging
+import shutil
+import tempfile
+from threading import Thread
+from time import time, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.servers import ThreadedFTPServer
+
+from FrameQueue import FrameQueue
+from FtpThread import FtpThread
+
+frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+frameBytes = int(sys.argv[2]) * 1000 if len(sys.argv) > 2 else 500000
+latency = int(sys.argv[3]) / 1000.0 if len(sys.argv) > 3 else 0.02
+
+
+class SlowHandler(FTPHandler):
+    def ftp_STOR(self, file, mode="w"):
+        sleep(latency)
+        return FTPHandler.ftp_STOR(self, file, mode)
+
+
+class Messages:
+    def __init__(self):
+        self.transfers = []
+
+    def emit(self, msg):
+        if msg.startswith("xfer,"):
+            self.transfers.append(msg[5:])
+        elif "failed" in msg:
+            print(msg)
+
+
+def startServer(root):
+    authorizer = DummyAuthorizer()
+    authorizer.add_user("gugusse", "roller", root, perm="elradfmwMT")
+    SlowHandler.authorizer = authorizer
+    server = ThreadedFTPServer(("127.0.0.1", 0), SlowHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def runOne(work, port, concurrency):
+    with open(os.path.join(work, "ftp.json"), "wt") as h:
+        json.dump(
+            {
+                "server": "127.0.0.1",
+                "port": port,
+                "user": "gugusse",
+                "passwd": "roller",
+                "path": "",
+                "concurrency": concurrency,
+            },
+            h,
+        )
+    queue = FrameQueue(os.path.join(work, "complete"))
+    queue.rescan()
+    messages = Messages()
+    export = FtpThread(f"bench{concurrency}", "jpg", messages, queue)
+    export.start()
+    payload = os.urandom(frameBytes)
+    start = time()
+    for i in range(frames):
+        fn = os.path.join(work, f"{i:05d}.jpg")
+        with open(fn, "wb") as h:
+            h.write(payload)
+        queue.publish(fn, f"{i:05d}.jpg")
+    queue.waitBelow(0)
+    elapsed = time() - start
+    export.stopLoop()
+    export.join()
+    ordered = messages.transfers == [f"{i:05d}.jpg" for i in range(frames)]
+    print(
+        f"{concurrency} sessions: {frames / elapsed:7.1f} frames/s"
+        f"  {frames * frameBytes / elapsed / 1e6:7.1f}MB/s"
+        f"  reported in order: {ordered}"
+    )
+
+
+if __name__ == "__main__":
+    logging.getLogger("pyftpdlib").setLevel(logging.WARNING)
+    root = tempfile.mkdtemp()
+    work = tempfile.mkdtemp()
+    server = startServer(root)
+    port = server.address[1]
+    os.chdir(work)
+    try:
+        for concurrency in (1, 2, 4):
+            runOne(work, port, concurrency)
+    finally:
+        server.close_all()
+        shutil.rmtree(root)
+        shutil.rmtree(work)
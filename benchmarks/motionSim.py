@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+# Runs the motors through a number of frames the way the capture loop does,
+# on the simulated GPIO, and reports how long the moves took against their
+# target time, where the speeds settled and what faults came up. With
+# "break" the film breaks halfway through, with "edge" the sensors are
+# watched with edge detection instead of being polled, with "pi" the speeds
+# are set by the PI controllers (SpeedController.py) instead of the
+# averaging. "settled" is the move after which the speed stayed within 5%
+# of where it ended.
+#
+#   python3 benchmarks/motionSim.py [frames] [film format] [break] [edge] [pi]
+#
+# reads hardwarecfg.json from the current directory like the GUI does, in pi
+# mode learnedSpeeds.json too, and writes it back at the end, a second run
+# starts from the speeds the first one learned
+import os
+import sys
+from threading import Thread
+from time import perf_counter
+
+os.environ["GUGUSSE_GPIO"] = "sim"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from ConfigFiles import ConfigFiles
+from GpioBackend import GPIO
+from SimulatedGpio import FilmTransport
+from TrinamicSilentMotor import TrinamicSilentMotor
+
+frames = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+filmFormat = sys.argv[2] if len(sys.argv) > 2 else "16mm"
+breaking = "break" in sys.argv[3:]
+edges = "edge" in sys.argv[3:]
+controlled = "pi" in sys.argv[3:]
+
+
+class Messages:
+    def __init__(self):
+        self.faults = []
+
+    def emit(self, msg):
+        if "FAULT" in msg:
+            self.faults.append(msg)
+
+
+def timedMove(motor, times, speeds):
+    start = perf_counter()
+    try:
+        motor.move()
+    except Exception:
+        # the fault flag tells
+        pass
+    times.append(perf_counter() - start)
+    speeds.append(motor.speed)
+
+
+def settled(speeds):
+    final = speeds[-1]
+    for i in range(len(speeds) - 1, -1, -1):
+        if abs(speeds[i] - final) > 0.05 * final:
+            return i + 1
+    return 0
+
+
+if __name__ == "__main__":
+    hw = ConfigFiles("hardwarecfg.json")
+    transport = FilmTransport.fromHardware(hw, filmFormat, seed=1)
+    GPIO.attach(transport)
+    messages = Messages()
+    motors = {}
+    times = {}
+    speeds = {}
+    for name in ("feeder", "filmdrive", "pickup"):
+        if edges:
+            hw[name]["flags"] = hw[name].get("flags", []) + ["edgeDetect"]
+        cfg = hw["filmFormats"][filmFormat][name]
+        if controlled:
+            cfg["controller"] = "pi"
+        motors[name] = TrinamicSilentMotor(hw[name], signal=messages)
+        motors[name].setFormat(cfg, filmFormat)
+        motors[name].enable()
+        times[name] = []
+        speeds[name] = [motors[name].speed]
+    for frame in range(frames):
+        if breaking and frame == frames // 2:
+            transport.breakFilm(100)
+        reels = [
+            Thread(target=timedMove, args=(motors[n], times[n], speeds[n]))
+            for n in ("feeder", "pickup")
+        ]
+        for t in reels:
+            t.start()
+        for t in reels:
+            t.join()
+        timedMove(motors["filmdrive"], times["filmdrive"], speeds["filmdrive"])
+        if any(m.fault for m in motors.values()):
+            print(f"stopped at frame {frame}")
+            break
+    for name, motor in motors.items():
+        motor.disable()
+        t = sorted(times[name])
+        print(
+            f"{name:10s} target {motor.targetTime:.3f}s"
+            f"  median {t[len(t) // 2]:.3f}s  max {t[-1]:.3f}s"
+            f"  speed {speeds[name][0]} -> {motor.speed}"
+            f"  settled at move {settled(speeds[name])}"
+        )
+    for msg in messages.faults:
+        print(msg)
@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# Time from a frame landing in the complete directory to the export thread
+# starting on it:
+#   listdir1s  the former exporters, sleep(1) then list the directory
+#   queue      published in process, FrameQueue wakes the exporter
+#   inotify    renamed in by something else, picked up by the watcher
+#   fallback   the same without inotify, the watcher lists every second
+#
+#   python3 benchmarks/publishLatency.py [frames] [directory]
+import os
+import sys
+import shutil
+import random
+from threading import Thread
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from FrameQueue import FrameQueue
+from DirectoryWatcher import DirectoryWatcher
+
+
+class ListdirExporter(Thread):
+    def __init__(self, directory, seen):
+        Thread.__init__(self, daemon=True)
+        self.directory = directory
+        self.seen = seen
+        self.Loop = True
+
+    def run(self):
+        while self.Loop:
+            sleep(1)
+            for item in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, item)
+                if os.path.isfile(path):
+                    self.seen(item)
+                    os.remove(path)
+
+
+class QueueExporter(Thread):
+    def __init__(self, queue, seen):
+        Thread.__init__(self, daemon=True)
+        self.queue = queue
+        self.seen = seen
+        self.Loop = True
+
+    def run(self):
+        while self.Loop:
+            item = self.queue.get(timeout=0.2)
+            if item == None:
+                continue
+            self.seen(item.name)
+            os.remove(item.path)
+            self.queue.done(item)
+
+
+def measure(mode, frames, base):
+    directory = os.path.join(base, "complete")
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    landed = {}
+    latencies = []
+
+    def seen(name):
+        latencies.append(perf_counter() - landed[name])
+
+    queue = FrameQueue(directory)
+    if mode == "listdir1s":
+        exporter = ListdirExporter(directory, seen)
+    else:
+        exporter = QueueExporter(queue, seen)
+        if mode in ("inotify", "fallback"):
+            queue.watcher = DirectoryWatcher(
+                directory, queue.put, useInotify=(mode == "inotify")
+            )
+            if mode == "inotify" and not queue.watcher.usesInotify():
+                return None
+            queue.watcher.start()
+    exporter.start()
+    for i in range(frames):
+        name = f"{i:05d}.jpg"
+        fn = os.path.join(base, name)
+        with open(fn, "wb") as h:
+            h.write(b"\0" * 4096)
+        landed[name] = perf_counter()
+        if mode == "queue":
+            queue.publish(fn, name)
+        else:
+            os.rename(fn, os.path.join(directory, name))
+        sleep(random.uniform(0.1, 0.4))
+    while len(latencies) < frames:
+        sleep(0.05)
+    exporter.Loop = False
+    if queue.watcher != None:
+        queue.watcher.stopLoop()
+    return sorted(latencies)
+
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    base = sys.argv[2] if len(sys.argv) > 2 else "/dev/shm/publishLatency"
+    os.makedirs(base, exist_ok=True)
+    try:
+        for mode in ("listdir1s", "queue", "inotify", "fallback"):
+            latencies = measure(mode, frames, base)
+            if latencies == None:
+                print(f"{mode:10s} not available here")
+                continue
+            print(
+                f"{mode:10s} median {latencies[len(latencies) // 2] * 1000:8.2f}ms"
+                f"  max {latencies[-1] * 1000:8.2f}ms"
+            )
+    finally:
+        shutil.rmtree(base)
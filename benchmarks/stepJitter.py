@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+# Runs the film drive step loop without the hardware, the former way (the
+# next delay worked out after every step, counted from when the step went
+# out) and from the precomputed profile table, then compares the achieved
+# step periods to the profile's.
+#
+#   python3 benchmarks/stepJitter.py [speed] [speed2] [ignoreInitial]
+import os
+import sys
+from time import time, sleep, perf_counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from StepProfile import filmDriveProfile
+
+speed = int(sys.argv[1]) if len(sys.argv) > 1 else 7000
+speed2 = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+ignoreInitial = int(sys.argv[3]) if len(sys.argv) > 3 else 7500
+
+
+class Pin:
+    # stands in for GPIO.output(), only remembers when the steps went out
+    def __init__(self):
+        self.stamps = []
+
+    def output(self, pin, value):
+        self.stamps.append(perf_counter())
+
+
+class FormerMotor:
+    def __init__(self, pin):
+        self.pin = pin
+        self.speed = speed
+        self.speed2 = speed2
+        self.ignoreInitial = ignoreInitial
+        self.eighthPoint = ignoreInitial / 8.0
+        self.sevenEighthPoint = 7.0 * ignoreInitial / 8.0
+        self.toggle = 0
+
+    def nextDelay(self):
+        now = time()
+        if self.ticks > self.ignoreInitial:
+            return now + (1.0 / self.speed2)
+        if self.ticks <= self.eighthPoint:
+            pointSpeed = self.speed2 + (self.speed - self.speed2) * (
+                self.ticks / self.eighthPoint
+            )
+        elif self.ticks <= self.sevenEighthPoint:
+            pointSpeed = self.speed
+        else:
+            pointSpeed = self.speed - (self.speed - self.speed2) * (
+                (self.ticks - self.sevenEighthPoint) / self.eighthPoint
+            )
+        return now + (1.0 / pointSpeed)
+
+    def tick(self):
+        self.ticks += 1
+        self.toggle = not self.toggle
+        self.pin.output(0, self.toggle)
+        return self.nextDelay()
+
+    def move(self):
+        self.ticks = 0
+        waitUntil = self.tick()
+        while self.ticks < ignoreInitial:
+            delay = waitUntil - time()
+            if delay > 0.0:
+                sleep(delay)
+            waitUntil = self.tick()
+
+
+class TableMotor:
+    def __init__(self, pin):
+        self.pin = pin
+        self.profile = filmDriveProfile(speed, speed2, ignoreInitial)
+        self.profileLength = len(self.profile)
+        self.cruise = 1.0 / speed2
+        self.slack = min(self.profile)
+        self.toggle = 0
+
+    def tick(self, scheduled):
+        self.ticks += 1
+        self.toggle = not self.toggle
+        self.pin.output(0, self.toggle)
+        if self.ticks < self.profileLength:
+            return scheduled + self.profile[self.ticks]
+        return scheduled + self.cruise
+
+    def waitStep(self, waitUntil):
+        now = time()
+        delay = waitUntil - now
+        if delay > 0.0:
+            sleep(delay)
+        elif delay < -self.slack:
+            return self.tick(now)
+        return self.tick(waitUntil)
+
+    def move(self):
+        self.ticks = 0
+        waitUntil = self.tick(time())
+        while self.ticks < ignoreInitial:
+            waitUntil = self.waitStep(waitUntil)
+
+
+def report(label, stamps, profile):
+    periods = [b - a for a, b in zip(stamps, stamps[1:])]
+    errors = sorted(abs(p - profile[i + 1]) * 1e6 for i, p in enumerate(periods))
+    ideal = sum(profile[1 : len(stamps)])
+    print(
+        f"{label:8s} move {stamps[-1] - stamps[0]:.4f}s (ideal {ideal:.4f}s)"
+        f"  period error p50 {errors[len(errors) // 2]:6.1f}us"
+        f"  p99 {errors[int(len(errors) * 0.99)]:6.1f}us"
+        f"  max {errors[-1]:7.1f}us"
+    )
+
+
+def overhead(motor, steps=100000):
+    # cost of a step without any waiting
+    motor.ticks = 0
+    start = perf_counter()
+    if isinstance(motor, TableMotor):
+        scheduled = 0.0
+        for i in range(steps):
+            motor.ticks = i % ignoreInitial
+            scheduled = motor.tick(scheduled)
+    else:
+        for i in range(steps):
+            motor.ticks = i % ignoreInitial - 1
+            motor.tick()
+    return (perf_counter() - start) / steps * 1e6
+
+
+if __name__ == "__main__":
+    profile = filmDriveProfile(speed, speed2, ignoreInitial)
+    start = perf_counter()
+    for i in range(10):
+        filmDriveProfile(speed, speed2, ignoreInitial)
+    print(
+        f"profile of {ignoreInitial} steps built in {(perf_counter() - start) * 100:.2f}ms"
+    )
+    for label, kind in (("former", FormerMotor), ("table", TableMotor)):
+        pin = Pin()
+        motor = kind(pin)
+        motor.move()
+        report(label, pin.stamps, profile)
+        print(f"{'':8s} {overhead(kind(Pin())):.2f}us per step without waiting")
@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# the modules live at the top of the repository, GpioBackend takes the
+# simulated pins from the environment
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+os.environ["GUGUSSE_GPIO"] = "sim"
+
+
+@pytest.fixture
+def gpio(tmp_path_factory, monkeypatch):
+    # GpioBackend reads hardwarecfg.json from the working directory the
+    # first time it is imported, every test attaches a transport of its own
+    monkeypatch.chdir(tmp_path_factory.getbasetemp())
+    from GpioBackend import GPIO
+
+    yield GPIO
+    GPIO.cleanup()
+    GPIO.attach(None)
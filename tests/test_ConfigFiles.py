@@ -0,0 +1,30 @@
+import json
+from ConfigFiles import ConfigFiles
+
+
+def test_capture_modes_of_an_older_file_get_the_new_ones(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    old = {
+        "DNG": {"description": "12bits DNGs", "suffix": "dng", "packDng": False},
+        "singleJpg": {"description": "simple jpg", "suffix": "jpg"},
+        "mine": {"description": "my own", "suffix": "jpg"},
+    }
+    with open("captureModes.json", "wt") as h:
+        json.dump(old, h)
+    modes = ConfigFiles("captureModes.json")
+    assert list(modes)[:3] == ["DNG", "singleJpg", "mine"]
+    assert "adaptiveBracketing" in modes
+    assert modes["packedRaw"]["suffix"] == "gsr"
+    assert modes["DNG"]["writer"] == "stream"
+    assert modes["DNG"]["packDng"] == False
+    assert modes["mine"] == old["mine"]
+    # only added in memory, the file stays as it was written
+    with open("captureModes.json", "rt") as h:
+        assert json.load(h) == old
+
+
+def test_capture_modes_written_when_missing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    modes = ConfigFiles("captureModes.json")
+    with open("captureModes.json", "rt") as h:
+        assert json.load(h) == dict(modes)
@@ -0,0 +1,88 @@
+from DiskSpace import DiskSpace
+from LocalThread import LocalThread
+from FrameQueue import FrameQueue
+
+MB = 1000000
+
+
+class FakeVolumes(DiskSpace):
+    # free bytes per directory instead of statvfs()
+    def __init__(self, free, reserve, recheckSeconds=30.0):
+        DiskSpace.__init__(self, sorted(free), reserve, recheckSeconds)
+        self.volumes = dict(free)
+        self.measured = 0
+
+    def measure(self, index):
+        self.measured += 1
+        return self.volumes[self.directories[index]]
+
+
+def test_frames_go_to_the_first_volume_with_room():
+    space = FakeVolumes({"a": 100 * MB, "b": 100 * MB}, 10 * MB)
+    assert space.pick(20 * MB) == "a"
+
+
+def test_the_estimate_comes_down_without_asking_the_volume():
+    space = FakeVolumes({"a": 100 * MB, "b": 100 * MB}, 10 * MB)
+    space.pick(20 * MB)
+    for i in range(3):
+        space.spent(20 * MB)
+        assert space.pick(20 * MB) == "a"
+    assert space.measured == 1
+
+
+def test_moves_on_once_the_reserve_would_be_touched():
+    space = FakeVolumes({"a": 100 * MB, "b": 100 * MB}, 10 * MB)
+    for i in range(4):
+        assert space.pick(20 * MB) == "a"
+        space.spent(20 * MB)
+        space.volumes["a"] -= 20 * MB
+    assert space.pick(20 * MB) == "b"
+
+
+def test_none_once_every_volume_is_full():
+    space = FakeVolumes({"a": 15 * MB, "b": 25 * MB}, 10 * MB)
+    assert space.pick(20 * MB) == None
+
+
+def test_full_gives_up_on_the_volume_and_rewind_comes_back():
+    space = FakeVolumes({"a": 100 * MB, "b": 100 * MB}, 10 * MB)
+    assert space.pick(MB) == "a"
+    space.full()
+    assert space.pick(MB) == "b"
+    space.full()
+    assert space.pick(MB) == None
+    space.rewind()
+    assert space.pick(MB) == "a"
+
+
+def test_an_unreachable_volume_counts_as_full(tmp_path):
+    space = DiskSpace([str(tmp_path / "missing"), str(tmp_path)], 0)
+    assert space.pick(1) == str(tmp_path)
+
+
+class Messages:
+    def __init__(self):
+        self.lines = []
+
+    def emit(self, msg):
+        self.lines.append(msg)
+
+
+def test_unusable_spillover_paths_are_left_out(tmp_path):
+    (tmp_path / "base").mkdir()
+    (tmp_path / "extra").mkdir()
+    messages = Messages()
+    export = LocalThread(
+        "project",
+        "dng",
+        messages,
+        str(tmp_path / "base"),
+        FrameQueue(str(tmp_path / "complete")),
+        spillover=[str(tmp_path / "unmounted"), str(tmp_path / "extra")],
+    )
+    assert export.directories == [
+        str(tmp_path / "base" / "project"),
+        str(tmp_path / "extra" / "project"),
+    ]
+    assert any("unmounted" in line for line in messages.lines)
@@ -0,0 +1,114 @@
+import os
+import FrameQueue as frameQueueModule
+from FrameQueue import FrameQueue
+
+
+def makeFile(directory, name, size=10):
+    path = os.path.join(directory, name)
+    with open(path, "wb") as h:
+        h.write(b"x" * size)
+    return path
+
+
+def test_put_queues_a_name_once(tmp_path):
+    queue = FrameQueue(str(tmp_path))
+    makeFile(str(tmp_path), "00001.dng", 10)
+    queue.put("00001.dng")
+    queue.put("00001.dng")
+    assert queue.pending() == 1
+    assert queue.pendingBytes() == 10
+
+
+def test_done_forgets_the_name(tmp_path):
+    queue = FrameQueue(str(tmp_path))
+    makeFile(str(tmp_path), "00001.dng")
+    queue.put("00001.dng")
+    item = queue.get(0)
+    queue.done(item)
+    assert queue.pending() == 0
+    assert queue.pendingBytes() == 0
+    queue.put("00001.dng")
+    assert queue.pending() == 1
+
+
+def test_put_of_a_file_already_gone_is_ignored(tmp_path):
+    queue = FrameQueue(str(tmp_path))
+    queue.put("00001.dng")
+    assert queue.pending() == 0
+
+
+def test_publish_keeps_the_info_when_the_watcher_comes_first(tmp_path, monkeypatch):
+    directory = tmp_path / "complete"
+    directory.mkdir()
+    queue = FrameQueue(str(directory))
+    source = makeFile(str(tmp_path), "00001.dng")
+    rename = os.rename
+
+    def renameHeardByWatcher(src, dst):
+        rename(src, dst)
+        queue.put(os.path.basename(dst))
+
+    monkeypatch.setattr(frameQueueModule.os, "rename", renameHeardByWatcher)
+    queue.publish(source, "00001.dng", {"ExposureTime": 1000})
+    assert queue.pending() == 1
+    assert queue.get(0).info == {"ExposureTime": 1000}
+    assert queue.expected == {}
+
+
+def test_publish_failure_forgets_the_info(tmp_path):
+    queue = FrameQueue(str(tmp_path))
+    try:
+        queue.publish(str(tmp_path / "missing"), "00001.dng", {"Lux": 1.0})
+    except FileNotFoundError:
+        pass
+    assert queue.expected == {}
+    assert queue.pending() == 0
+
+
+def test_interrupt_makes_get_return_none_when_empty(tmp_path):
+    queue = FrameQueue(str(tmp_path))
+    queue.interrupt()
+    assert queue.get() == None
+
+
+def test_interrupt_still_hands_out_what_is_queued(tmp_path):
+    queue = FrameQueue(str(tmp_path))
+    makeFile(str(tmp_path), "00001.dng")
+    queue.put("00001.dng")
+    queue.interrupt()
+    assert queue.get().name == "00001.dng"
+    assert queue.get() == None
+
+
+def test_rescan_clears_the_stop_and_queues_leftovers_in_order(tmp_path):
+    queue = FrameQueue(str(tmp_path))
+    for name in ("00002.dng", "00000.dng", "00001.dng"):
+        makeFile(str(tmp_path), name)
+    queue.interrupt()
+    queue.rescan()
+    assert queue.stopping == False
+    names = [queue.get(0).name for i in range(3)]
+    assert names == ["00000.dng", "00001.dng", "00002.dng"]
+    assert queue.get(0.01) == None
+
+
+def test_watcher_queues_files_renamed_in(tmp_path):
+    directory = tmp_path / "complete"
+    directory.mkdir()
+    queue = FrameQueue(str(directory))
+    queue.rescan()
+    queue.watch()
+    try:
+        source = makeFile(str(tmp_path), "00003.jpg")
+        os.rename(source, str(directory / "00003.jpg"))
+        item = queue.get(5)
+        assert item != None and item.name == "00003.jpg"
+    finally:
+        queue.watcher.stopLoop()
+
+
+def test_fill_counts_the_pending_bytes_against_the_limit(tmp_path):
+    queue = FrameQueue(str(tmp_path))
+    makeFile(str(tmp_path), "00001.dng", 1000)
+    queue.put("00001.dng")
+    assert queue.fill(0, 4000) == 0.25
@@ -0,0 +1,25 @@
+from FrameTimings import FrameTimings
+
+
+def test_a_missing_stage_counts_as_zero():
+    timings = FrameTimings()
+    for frame in range(100):
+        timings.start(frame)
+        if frame < 3:
+            timings.local.record["skip"] = 300.0
+        timings.note("skip")
+        timings.commit()
+    lines = timings.summary()
+    assert lines[0] == "timings over the last 100 frames, p50/p95/p99 ms"
+    assert "skip: 0.0/0.0/300.0" in lines
+
+
+def test_note_keeps_what_was_lapped():
+    timings = FrameTimings()
+    timings.start(0)
+    timings.lap("skip")
+    lapped = timings.local.record["skip"]
+    timings.note("skip")
+    timings.note("capture")
+    assert timings.local.record["skip"] == lapped
+    assert timings.local.record["capture"] == 0.0
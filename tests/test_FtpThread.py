@@ -0,0 +1,68 @@
+from queue import Queue
+from threading import Thread
+from FrameQueue import FrameQueue
+from FtpThread import FtpThread, FtpSession
+
+
+class Messages:
+    def __init__(self):
+        self.lines = []
+
+    def emit(self, msg):
+        self.lines.append(msg)
+
+
+class FakeFtp:
+    def __init__(self):
+        self.files = {}
+
+    def storbinary(self, cmd, source, blocksize, callback, rest=None):
+        data = source.read()
+        callback(data)
+        self.files[cmd.split(" ", 1)[1]] = data
+
+    def size(self, name):
+        return len(self.files[name])
+
+    def quit(self):
+        pass
+
+
+class BrokenManifest:
+    def record(self, **fields):
+        raise OSError(28, "No space left on device")
+
+
+def test_a_failing_manifest_still_finishes_the_upload(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    queue = FrameQueue(str(tmp_path / "complete"))
+    queue.rescan()
+    messages = Messages()
+    export = FtpThread("project", "dng", messages, queue)
+    export.manifest = BrokenManifest()
+    export.jobs = Queue()
+    export.seq = 0
+    session = FtpSession(export, {})
+    server = FakeFtp()
+    session.ftp = server
+    session.start()
+
+    for name in ("00000.dng", "00000.json"):
+        source = tmp_path / name
+        source.write_bytes(b"frame")
+        queue.publish(str(source), name)
+    # the marker waits for the frame before it to be finished
+    sender = Thread(
+        target=lambda: [export.send(queue.get(0)) for i in range(2)], daemon=True
+    )
+    sender.start()
+    sender.join(5)
+    assert not sender.is_alive()
+    export.jobs.put(None)
+    session.join(5)
+
+    assert sorted(server.files) == ["00000.dng", "00000.json"]
+    assert export.inFlight == 0
+    assert "xfer,00000.json" in messages.lines
+    assert any("left out of the manifest" in line for line in messages.lines)
+    assert queue.pending() == 0
@@ -0,0 +1,149 @@
+import Manifest as manifestModule
+from Manifest import Manifest, frameNumber, reconcile
+from LocalThread import LocalThread
+from FrameQueue import FrameQueue
+
+
+def test_frame_numbers_of_every_file_of_a_frame():
+    assert frameNumber("00123.dng") == 123
+    assert frameNumber("00123_h.jpg") == 123
+    assert frameNumber("00123.json") == 123
+    assert frameNumber("notes.txt") == None
+
+
+def test_high_water_of_a_missing_or_empty_manifest(tmp_path):
+    manifest = Manifest(str(tmp_path / "p-manifest.jsonl"))
+    assert manifest.highWater("local") == None
+    manifest.record(name="notes.txt", size=1, sink="local")
+    assert manifest.highWater("local") == None
+
+
+def test_high_water_per_sink_with_uploads_out_of_order(tmp_path):
+    manifest = Manifest(str(tmp_path / "p-manifest.jsonl"))
+    for frame in (0, 1, 3, 2):
+        manifest.record(name=f"{frame:05d}.dng", size=1, sink="ftp")
+    manifest.record(name="00000.dng", size=1, sink="local")
+    assert manifest.highWater("ftp") == 4
+    assert manifest.highWater("local") == 1
+    assert manifest.lastEntry("ftp")["name"] == "00003.dng"
+
+
+def test_high_water_skips_a_truncated_last_line(tmp_path):
+    manifest = Manifest(str(tmp_path / "p-manifest.jsonl"))
+    manifest.record(name="00007.dng", size=1, sink="local")
+    with open(manifest.filename, "at") as h:
+        h.write('{"name": "00008.dng", "si')
+    assert manifest.highWater("local") == 8
+
+
+def test_record_after_a_truncated_last_line(tmp_path):
+    manifest = Manifest(str(tmp_path / "p-manifest.jsonl"))
+    manifest.record(name="00007.dng", size=1, sink="local")
+    with open(manifest.filename, "at") as h:
+        h.write('{"name": "00008.dng", "si')
+    manifest.record(name="00008.dng", size=1, sink="local")
+    assert manifest.lastEntry("local")["name"] == "00008.dng"
+    assert manifest.highWater("local") == 9
+    with open(manifest.filename, "rt") as h:
+        assert h.read().count("\n") == 3
+
+
+def test_high_water_reads_back_past_other_sinks(tmp_path):
+    # more than one block of records of the other sink after the last one
+    manifest = Manifest(str(tmp_path / "p-manifest.jsonl"))
+    manifest.record(name="00041.dng", size=1, sink="local")
+    for frame in range(3000):
+        manifest.record(name=f"{frame:05d}.dng", size=1, sink="ftp")
+    assert manifest.highWater("local") == 42
+    assert manifest.highWater("ftp") == 3000
+
+
+def test_high_water_reads_only_the_tail(tmp_path, monkeypatch):
+    manifest = Manifest(str(tmp_path / "p-manifest.jsonl"))
+    for frame in range(3000):
+        manifest.record(name=f"{frame:05d}.dng", size=1, sink="local")
+    reads = []
+    realOpen = open
+
+    class CountingFile:
+        def __init__(self, h):
+            self.h = h
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            self.h.close()
+
+        def seek(self, *args):
+            return self.h.seek(*args)
+
+        def read(self, size):
+            reads.append(size)
+            return self.h.read(size)
+
+    monkeypatch.setattr(
+        manifestModule, "open", lambda *a: CountingFile(realOpen(*a)), raising=False
+    )
+    assert manifest.highWater("local") == 3000
+    assert sum(reads) <= manifestModule.TAIL
+
+
+class Messages:
+    def emit(self, msg):
+        pass
+
+
+def localExport(tmp_path):
+    return LocalThread(
+        "project",
+        "dng",
+        Messages(),
+        str(tmp_path / "base"),
+        FrameQueue(str(tmp_path / "complete")),
+    )
+
+
+def test_local_manifest_lives_with_the_frames(tmp_path):
+    (tmp_path / "base").mkdir()
+    export = localExport(tmp_path)
+    assert export.manifest.filename == str(
+        tmp_path / "base" / "project" / "project-manifest.jsonl"
+    )
+
+
+def test_resume_from_the_manifest_while_the_last_frame_is_there(tmp_path):
+    (tmp_path / "base").mkdir()
+    export = localExport(tmp_path)
+    frame = tmp_path / "base" / "project" / "00009.dng"
+    frame.write_bytes(b"x" * 5)
+    export.manifest.record(name="00009.dng", size=5, sink="local", path=str(frame))
+    assert export.getStartPoint() == 10
+
+
+def test_resume_lists_the_directory_when_the_manifest_is_stale(tmp_path):
+    (tmp_path / "base").mkdir()
+    export = localExport(tmp_path)
+    project = tmp_path / "base" / "project"
+    export.manifest.record(
+        name="00009.dng", size=5, sink="local", path=str(project / "00009.dng")
+    )
+    (project / "00004.dng").write_bytes(b"x")
+    assert export.getStartPoint() == 5
+
+
+def test_reconcile_finds_missing_and_changed_files(tmp_path, capsys):
+    manifest = Manifest(str(tmp_path / "p-manifest.jsonl"))
+    good = tmp_path / "00000.dng"
+    good.write_bytes(b"abc")
+    changed = tmp_path / "00001.dng"
+    changed.write_bytes(b"abcd")
+    manifest.record(name="00000.dng", size=3, sink="local", path=str(good))
+    manifest.record(name="00001.dng", size=3, sink="local", path=str(changed))
+    manifest.record(
+        name="00002.dng", size=3, sink="local", path=str(tmp_path / "00002.dng")
+    )
+    assert reconcile(manifest.filename) == 2
+    out = capsys.readouterr().out
+    assert "00002.dng: missing" in out
+    assert "00001.dng: 4 bytes" in out
@@ -0,0 +1,73 @@
+import os
+from time import monotonic
+from FrameQueue import FrameQueue
+from FtpThread import FtpSession
+from MirrorThread import MirrorThread
+from RateLimiter import RateLimiter
+
+
+class Messages:
+    def emit(self, msg):
+        pass
+
+
+class CountingLimiter(RateLimiter):
+    def __init__(self):
+        RateLimiter.__init__(self)
+        self.charged = 0
+
+    def take(self, count):
+        self.charged += count
+        RateLimiter.take(self, count)
+
+
+class FakeFtp:
+    # takes the STOR a block at a time like ftplib does
+    def __init__(self):
+        self.files = {}
+
+    def storbinary(self, cmd, source, blocksize, callback, rest=None):
+        name = cmd.split(" ", 1)[1]
+        data = b""
+        while True:
+            block = source.read(blocksize)
+            if len(block) == 0:
+                break
+            data += block
+            callback(block)
+        self.files[name] = data
+
+    def size(self, name):
+        return len(self.files[name])
+
+
+def test_mirror_charges_every_frame_once_under_an_adaptive_limit(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "base").mkdir()
+    queue = FrameQueue(str(tmp_path / "complete"))
+    queue.rescan()
+    queue.limiter = CountingLimiter()
+    mirror = MirrorThread("project", "dng", Messages(), str(tmp_path / "base"), queue)
+    session = FtpSession(mirror.remote, {})
+    session.ftp = FakeFtp()
+    mirror.remote.send = lambda item: session.store(item, False)
+
+    frameBytes = 1000000
+    # what CaptureLoop.shapeExport asks for with one frame every 100ms
+    queue.limiter.adapt(0.1, frameBytes, 0, headroom=1.0)
+    shm = tmp_path / "shm"
+    shm.mkdir()
+    start = monotonic()
+    for frame in range(4):
+        source = shm / f"{frame:05d}.dng"
+        data = os.urandom(frameBytes)
+        source.write_bytes(data)
+        queue.publish(str(source), source.name)
+        item, destination, fd = mirror.export(queue.get(0))
+        os.close(fd)
+        assert session.ftp.files[item.name] == data
+    elapsed = monotonic() - start
+
+    assert queue.limiter.charged == 4 * frameBytes
+    # 4MB at 10MB/s, twice that if both copies were charged
+    assert elapsed < 0.7
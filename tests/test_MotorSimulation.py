@@ -0,0 +1,130 @@
+import pytest
+from SimulatedGpio import FilmTransport
+
+FILMDRIVE_PINS = {"pinStep": 10, "pinEnable": 11, "pinDirection": 12, "stopPin": 13}
+REEL_PINS = {"pinStep": 20, "pinEnable": 21, "pinDirection": 22, "stopPin": 23}
+
+FILMDRIVE_FORMAT = {
+    "speed": 20000.0,
+    "speed2": 5000.0,
+    "faultTreshold": 2000,
+    "ignoreInitial": 200,
+    "targetTime": 0.02,
+}
+REEL_FORMAT = {
+    "speed": 5000.0,
+    "speed2": 1000.0,
+    "faultTreshold": 400,
+    "ignoreInitial": 5,
+    "targetTime": 0.05,
+}
+
+
+class Messages:
+    def __init__(self):
+        self.lines = []
+
+    def emit(self, msg):
+        self.lines.append(msg)
+
+
+def motorCfg(name, pins, isFilmDrive, flags=()):
+    cfg = {
+        "name": name,
+        "minSpeed": 20,
+        "maxSpeed": 20000,
+        "stopState": 1,
+        "invert": False,
+        "isFilmDrive": isFilmDrive,
+        "flags": list(flags),
+    }
+    cfg.update(pins)
+    return cfg
+
+
+def makeMotor(cfg, filmFormat, messages):
+    from TrinamicSilentMotor import TrinamicSilentMotor
+
+    motor = TrinamicSilentMotor(cfg, signal=messages)
+    motor.setFormat(dict(filmFormat))
+    motor.enable()
+    return motor
+
+
+@pytest.fixture
+def transport(gpio):
+    transport = FilmTransport(seed=1)
+    gpio.attach(transport)
+    return transport
+
+
+@pytest.mark.parametrize("flags", [(), ("edgeDetect",)])
+def test_film_drive_stops_on_the_next_hole(transport, flags):
+    cfg = motorCfg("filmdrive", FILMDRIVE_PINS, True, flags)
+    transport.addFilmDrive(cfg, 250, holeWidth=10)
+    motor = makeMotor(cfg, FILMDRIVE_FORMAT, Messages())
+    for hole in range(3):
+        motor.move()
+        assert motor.ticks == 250
+    assert transport.filmDrive.position == 750
+    assert motor.fault == False
+
+
+def test_edge_detection_is_used_when_flagged(transport):
+    cfg = motorCfg("filmdrive", FILMDRIVE_PINS, True, ["edgeDetect"])
+    transport.addFilmDrive(cfg, 250)
+    motor = makeMotor(cfg, FILMDRIVE_FORMAT, Messages())
+    assert motor.sensorHit == motor.flagSensor
+
+
+def test_reel_takes_up_what_the_film_drive_moved(transport):
+    driveCfg = motorCfg("filmdrive", FILMDRIVE_PINS, True)
+    reelCfg = motorCfg("pickup", REEL_PINS, False)
+    transport.addFilmDrive(driveCfg, 250, holeWidth=10)
+    transport.addReel(reelCfg, 2.0)
+    messages = Messages()
+    drive = makeMotor(driveCfg, FILMDRIVE_FORMAT, messages)
+    reel = makeMotor(reelCfg, REEL_FORMAT, messages)
+    drive.move()
+    reel.move()
+    # 250 steps worth of film, two per reel step
+    assert reel.ticks == 125
+    assert reel.shortsInARow == 0
+
+
+def test_broken_film_ends_in_a_short_fault(transport):
+    cfg = motorCfg("filmdrive", FILMDRIVE_PINS, True)
+    transport.addFilmDrive(cfg, 250, holeWidth=10)
+    messages = Messages()
+    motor = makeMotor(cfg, FILMDRIVE_FORMAT, messages)
+    motor.move()
+    transport.breakFilm(0)
+    for i in range(9):
+        motor.move()
+        assert motor.ticks == FILMDRIVE_FORMAT["ignoreInitial"]
+    with pytest.raises(Exception):
+        motor.move()
+    assert motor.fault
+    assert "filmdrive short FAULT" in messages.lines
+
+
+def test_reel_that_never_triggers_ends_in_a_long_fault(transport):
+    cfg = motorCfg("feeder", REEL_PINS, False)
+    # no film for the reel to take up
+    transport.addReel(cfg, 0.0, tension=1.0)
+    messages = Messages()
+    motor = makeMotor(cfg, REEL_FORMAT, messages)
+    with pytest.raises(Exception):
+        motor.move()
+    assert motor.fault
+    assert motor.ticks == REEL_FORMAT["faultTreshold"] + 1
+    assert "feeder long FAULT" in messages.lines
+
+
+def test_disabled_driver_does_not_move_the_film(transport):
+    cfg = motorCfg("filmdrive", FILMDRIVE_PINS, True)
+    transport.addFilmDrive(cfg, 250)
+    motor = makeMotor(cfg, FILMDRIVE_FORMAT, Messages())
+    motor.disable()
+    motor.blindMove(5)
+    assert transport.filmDrive.position == 0
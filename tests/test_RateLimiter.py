@@ -0,0 +1,58 @@
+import os
+from threading import Thread, get_native_id
+from time import monotonic
+from RateLimiter import RateLimiter, lowerThreadPriority
+
+
+def test_no_rate_lets_everything_through():
+    limiter = RateLimiter()
+    start = monotonic()
+    for i in range(100):
+        limiter.take(100 * 1000000)
+    assert monotonic() - start < 0.1
+    assert limiter.chunk(8 * 1024 * 1024) == 8 * 1024 * 1024
+
+
+def test_take_averages_out_to_the_rate():
+    limiter = RateLimiter()
+    limiter.setRate(10 * 1000000)
+    start = monotonic()
+    for i in range(8):
+        limiter.take(250000)
+    elapsed = monotonic() - start
+    # 2MB at 10MB/s, the bucket starts empty
+    assert 0.15 < elapsed < 0.5
+
+
+def test_chunk_is_a_twentieth_of_a_second_with_a_floor():
+    limiter = RateLimiter()
+    limiter.setRate(10 * 1000000)
+    assert limiter.chunk(8 * 1024 * 1024) == 500000
+    assert limiter.chunk(1000) == 64 * 1024
+    limiter.setRate(1000)
+    assert limiter.chunk(8 * 1024 * 1024) == 64 * 1024
+
+
+def test_adapt_covers_the_frames_and_the_backlog():
+    limiter = RateLimiter()
+    limiter.adapt(0.5, 10 * 1000000, 5 * 1000000, headroom=2.0)
+    assert limiter.rate == 2.0 * 15 * 1000000 / 0.5
+    limiter.adapt(0.5, 1000, 0, headroom=1.0)
+    assert limiter.rate == 1e6
+    limiter.adapt(0, 1000, 0)
+    assert limiter.rate == 1e6
+
+
+def test_lower_thread_priority_leaves_the_other_threads_alone():
+    mine = os.getpriority(os.PRIO_PROCESS, get_native_id())
+    seen = {}
+
+    def lowered():
+        lowerThreadPriority(5)
+        seen["nice"] = os.getpriority(os.PRIO_PROCESS, get_native_id())
+
+    t = Thread(target=lowered)
+    t.start()
+    t.join()
+    assert seen["nice"] == min(19, mine + 5)
+    assert os.getpriority(os.PRIO_PROCESS, get_native_id()) == mine
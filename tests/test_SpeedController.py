@@ -0,0 +1,155 @@
+import json
+from pytest import approx
+from SpeedController import PiController, LearnedSpeeds
+
+GAINS = {"kp": 0.1, "ki": 0.25, "maxChange": 0.1}
+
+
+def controller(speed=1000.0, targetTime=0.4, lowest=100.0, highest=2000.0, **cfg):
+    return PiController(dict(GAINS, **cfg), speed, targetTime, lowest, highest)
+
+
+def test_on_target_keeps_the_speed():
+    pi = controller()
+    for i in range(10):
+        assert pi.update(0.4) == 1000.0
+
+
+def test_deadband_ignores_small_errors():
+    pi = controller(deadband=0.02)
+    assert pi.update(0.405) == 1000.0
+    assert pi.integral == 0.0
+
+
+def test_too_slow_asks_for_more_speed_and_too_fast_for_less():
+    assert controller().update(0.44) > 1000.0
+    assert controller().update(0.36) < 1000.0
+
+
+def test_speed_changes_by_max_change_at_most_per_move():
+    pi = controller()
+    speeds = [1000.0]
+    for i in range(5):
+        speeds.append(pi.update(4.0))
+    for before, after in zip(speeds, speeds[1:]):
+        assert after <= before * 1.1 + 1e-9
+
+
+def test_speed_stays_within_the_limits():
+    pi = controller(maxChange=10.0)
+    for i in range(20):
+        assert pi.update(4.0) <= 2000.0
+    for i in range(20):
+        assert pi.update(0.01) >= 100.0
+
+
+def test_integral_is_clamped():
+    pi = controller(maxChange=100.0, lowest=0.0, highest=1e9, maxIntegral=1.0)
+    for i in range(100):
+        pi.update(4.0)
+    assert pi.integral == approx(1.0)
+
+
+def test_no_windup_while_held_at_the_limit():
+    pi = controller(highest=1100.0)
+    for i in range(50):
+        assert pi.update(0.8) <= 1100.0
+    held = pi.integral
+    assert held < 0.2
+    # the first fast move brings the speed down right away
+    assert pi.update(0.3) < 1100.0
+
+
+def test_converges_on_a_plant_where_time_goes_with_one_over_speed():
+    # 400 steps, the move takes 400 / speed seconds
+    pi = controller(speed=500.0, targetTime=0.2, highest=5000.0)
+    speed = 500.0
+    for i in range(60):
+        speed = pi.update(400.0 / speed)
+    assert speed == approx(2000.0, rel=0.02)
+
+
+def test_restore_scales_the_learned_speed_to_the_target_time():
+    pi = controller(targetTime=0.6)
+    pi.restore({"speed": 900.0, "targetTime": 0.3, "moves": 12, "mean": 0.31})
+    assert pi.speed == 450.0
+    assert pi.base == 450.0
+    assert pi.moves == 12
+    assert pi.update(0.6) == 450.0
+
+
+def test_restore_stays_within_the_limits():
+    pi = controller(targetTime=0.1)
+    pi.restore({"speed": 900.0, "targetTime": 0.4})
+    assert pi.speed == 2000.0
+
+
+def test_state_keeps_the_statistics():
+    pi = controller()
+    for t in (0.4, 0.42, 0.38, 0.4):
+        pi.update(t)
+    state = pi.state()
+    assert state["moves"] == 4
+    assert state["targetTime"] == 0.4
+    assert state["mean"] == approx(0.4, abs=0.01)
+    assert state["stdev"] > 0
+    assert pi.due() == False
+    assert controller(saveEvery=4).due() == False
+
+
+def test_learned_speeds_are_kept_per_format_and_motor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = LearnedSpeeds()
+    assert store.get("16mm", "feeder") == None
+    store.put("16mm", "feeder", {"speed": 450.0, "targetTime": 0.33})
+    store.put("35mm", "feeder", {"speed": 200.0, "targetTime": 0.8})
+    saved = json.load(open(tmp_path / "learnedSpeeds.json"))
+    assert saved["16mm"]["feeder"]["speed"] == 450.0
+    assert LearnedSpeeds().get("35mm", "feeder")["speed"] == 200.0
+
+
+def test_integral_reaches_the_speed_limits_by_default():
+    pi = controller(speed=500.0, highest=5000.0)
+    assert pi.integralLimit() == 9.0
+    pi = controller(speed=1000.0, highest=1500.0)
+    assert pi.integralLimit() == 1.0
+
+
+def test_motor_starts_from_and_saves_its_learned_speed(gpio, tmp_path, monkeypatch):
+    from SimulatedGpio import FilmTransport
+    from TrinamicSilentMotor import TrinamicSilentMotor
+    import SpeedController
+    from test_MotorSimulation import FILMDRIVE_PINS, FILMDRIVE_FORMAT, Messages
+    from test_MotorSimulation import motorCfg
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(SpeedController.learnedSpeeds, "data", None)
+    store = LearnedSpeeds()
+    store.put("8mm", "filmdrive", {"speed": 12000.0, "targetTime": 0.02})
+    transport = FilmTransport(seed=1)
+    gpio.attach(transport)
+    cfg = motorCfg("filmdrive", FILMDRIVE_PINS, True)
+    transport.addFilmDrive(cfg, 250, holeWidth=10)
+    motor = TrinamicSilentMotor(cfg, signal=Messages())
+    motor.setFormat(dict(FILMDRIVE_FORMAT, controller="pi"), "8mm")
+    assert motor.speed == 12000
+    motor.enable()
+    for i in range(4):
+        motor.move()
+    motor.disable()
+    saved = LearnedSpeeds().get("8mm", "filmdrive")
+    assert saved["moves"] == 4 - 2
+    assert saved["speed"] == approx(motor.controller.speed, abs=0.1)
+
+
+def test_motor_without_a_controller_keeps_the_averaging(gpio):
+    from TrinamicSilentMotor import TrinamicSilentMotor
+    from test_MotorSimulation import FILMDRIVE_PINS, FILMDRIVE_FORMAT, Messages
+    from test_MotorSimulation import motorCfg
+
+    motor = TrinamicSilentMotor(
+        motorCfg("filmdrive", FILMDRIVE_PINS, True), signal=Messages()
+    )
+    motor.setFormat(dict(FILMDRIVE_FORMAT), "8mm")
+    assert motor.controller == None
+    assert motor.speed == FILMDRIVE_FORMAT["speed"]
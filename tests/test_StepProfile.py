@@ -0,0 +1,73 @@
+from pytest import approx
+from StepProfile import filmDriveProfile, turnTableProfile
+
+
+def formerFilmDriveDelay(ticks, speed, speed2, ignoreInitial):
+    # nextDelayForFilmDrive() as it was before the tables
+    eighthPoint = ignoreInitial / 8.0
+    sevenEighthPoint = 7.0 * ignoreInitial / 8.0
+    if ticks > ignoreInitial:
+        return 1.0 / speed2
+    if ticks <= eighthPoint:
+        pointSpeed = speed2 + (speed - speed2) * (ticks / eighthPoint)
+    elif ticks <= sevenEighthPoint:
+        pointSpeed = speed
+    else:
+        pointSpeed = speed - (speed - speed2) * (
+            (ticks - sevenEighthPoint) / eighthPoint
+        )
+    return 1.0 / pointSpeed
+
+
+def formerTurnTableDelay(delta, speed, speed2, targetTime):
+    # nextDelayForTurnTables() as it was, delta being the time into the move
+    eighthTime = targetTime / 8.0
+    sevenEighthTime = 7.0 * targetTime / 8.0
+    if delta > targetTime:
+        return 1.0 / speed2
+    if delta < eighthTime:
+        pointSpeed = speed2 + (speed - speed2) * (delta / eighthTime)
+    elif delta < sevenEighthTime:
+        pointSpeed = speed
+    else:
+        pointSpeed = speed - (speed - speed2) * ((delta - sevenEighthTime) / eighthTime)
+    return 1.0 / pointSpeed
+
+
+def test_film_drive_table_matches_the_former_formula():
+    for speed, speed2, ignoreInitial in ((4500, 500, 900), (7000, 1000, 2385)):
+        table = filmDriveProfile(speed, speed2, ignoreInitial)
+        assert len(table) == ignoreInitial + 1
+        assert table[0] == approx(1.0 / speed2)
+        for ticks in range(1, ignoreInitial + 1):
+            assert table[ticks] == approx(
+                formerFilmDriveDelay(ticks, speed, speed2, ignoreInitial)
+            )
+
+
+def test_turntable_table_matches_the_former_formula_on_time():
+    speed, speed2, targetTime = 1000.0, 50.0, 0.33
+    table = turnTableProfile(speed, speed2, targetTime)
+    assert table[0] == approx(1.0 / speed2)
+    delta = 0.0
+    for ticks in range(1, len(table)):
+        assert table[ticks] == approx(
+            formerTurnTableDelay(delta, speed, speed2, targetTime)
+        )
+        delta += table[ticks]
+    # the table ends once the ramp down is over, speed2 takes over from there
+    assert delta - table[-1] <= targetTime < delta
+
+
+def test_turntable_steps_within_the_target_time():
+    # a trapezoid over targetTime: ramping up for an eighth of it, then
+    # three quarters at full speed and an eighth ramping down
+    speed, speed2, targetTime = 1000.0, 50.0, 0.4
+    steps = len(turnTableProfile(speed, speed2, targetTime)) - 1
+    expected = speed * targetTime * 0.75 + (speed + speed2) / 2 * targetTime * 0.25
+    assert steps == approx(expected, rel=0.02)
+
+
+def test_flat_profile_when_both_speeds_are_the_same():
+    table = filmDriveProfile(250.0, 250.0, 10)
+    assert list(table) == approx([1.0 / 250.0] * 11)
@@ -18,8 +18,8 @@ if [ ! -d "$directoryFrom" ] || [ -z "$outputFilename" ]; then
     exit 0
 fi
 
-if [ ! -f "$directoryFrom/00000_h.jpg" ]; then
-    echo "We don't even have a first trio of picture at $directoryFrom"
+if [ ! -f "$directoryFrom/00000_m.jpg" ]; then
+    echo "We don't even have a first bracketed picture at $directoryFrom"
     echo "$USAGE"
     exit 0
 fi
@@ -8,6 +8,7 @@ import threading
 import numpy as np
 import signal
 import json
+from glob import glob
 
 
 print("len args={}({})".format(len(sys.argv), sys.argv))
@@ -29,31 +30,39 @@ endFlag = "{}.flagIn".format(sys.argv[2])
 
 
 def getFilenames(count):
-    a = "{}/{:05d}_l.jpg".format(directoryFrom, count)
-    b = "{}/{:05d}_m.jpg".format(directoryFrom, count)
-    c = "{}/{:05d}_h.jpg".format(directoryFrom, count)
-    nextPix = "{}/{:05d}_h.jpg".format(directoryFrom, count + 1)
-    return nextPix, a, b, c
+    # A frame is complete once its sidecar is there (adaptive bracketing, one
+    # to three exposures) or, for the older full triplets, once the _h is.
+    base = "{}/{:05d}".format(directoryFrom, count)
+    if not os.path.exists(base + ".json") and not os.path.exists(base + "_h.jpg"):
+        return []
+    return sorted(glob(base + "_*.jpg"))
 
 
-nextPix, inA, inB, inC = getFilenames(count)
+inputs = getFilenames(count)
 
 tmpTif = "{}.tif".format(sys.argv[2])
 
-while os.path.exists(inC):
-    print("doing {}, {}, {}".format(inA, inB, inC))
-    os.system(
-        'enfuse --verbose=0 --depth 16 -o "{}" "{}" "{}" "{}"'.format(
-            tmpTif, inA, inB, inC
+while len(inputs) > 0:
+    print("doing {}".format(", ".join(inputs)))
+    if len(inputs) == 1:
+        # nothing to fuse, just bring it to the same 16 bits RGBA enfuse gives
+        os.system(
+            'convert "{}" -alpha opaque -depth 16 "{}"'.format(inputs[0], tmpTif)
+        )
+    else:
+        os.system(
+            'enfuse --verbose=0 --depth 16 -o "{}" {}'.format(
+                tmpTif, " ".join('"{}"'.format(i) for i in inputs)
+            )
         )
-    )
     img = tif.imread(tmpTif)
     outPipe.write(img.data)
     count += 1
-    nextPix, inA, inB, inC = getFilenames(count)
-    if not os.path.exists(nextPix):
+    inputs = getFilenames(count)
+    if len(getFilenames(count + 1)) == 0:
         print("It seems we caught up the scan, let's give it a minute")
         time.sleep(60)
+        inputs = getFilenames(count)
 
 
 # h=Image.open("16BitsTest/00000.tif", mode='r')
@@ -18,8 +18,8 @@ if [ ! -d "$directoryFrom" ] || [ ! -d "$directoryTo" ]; then
     exit 0
 fi
 
-if [ ! -f "$directoryFrom/00000_h.jpg" ]; then
-    echo "We don't even have a first trio of picture at $directoryFrom"
+if [ ! -f "$directoryFrom/00000_m.jpg" ]; then
+    echo "We don't even have a first bracketed picture at $directoryFrom"
     echo "$USAGE"
     exit 0
 fi
@@ -44,35 +44,48 @@ function getAvailableMegabytes () {
     df -BM "$1" | tail -n 1 | awk '{print $4}' | tr -d 'M'    
 }
 
+# A frame is complete once its sidecar is there (adaptive bracketing, one
+# to three exposures) or, for the older full triplets, once the _h is.
+function frameInputs () {
+    inputs=()
+    local base=$(printf "%s/%05d" "$directoryFrom" "$1")
+    if [ -f "${base}.json" ] || [ -f "${base}_h.jpg" ]; then
+	for f in "${base}"_*.jpg; do
+	    [ -f "$f" ] && inputs+=("$f")
+	done
+    fi
+}
+
 inCount=$count
 outCount=$count
-inFnA="`printf \"$directoryFrom/%05d_m.jpg\" $inCount`"
-inFnB="`printf \"$directoryFrom/%05d_l.jpg\" $inCount`"
-inFnC="`printf \"$directoryFrom/%05d_h.jpg\" $inCount`"
+frameInputs $inCount
 
 export spaceLeft=`getAvailableMegabytes ${directoryTo}`
 
-while [ -f "$inFnA" ] && [ "$spaceLeft" -gt $MINM ]; do
+while [ "${#inputs[@]}" -gt 0 ] && [ "$spaceLeft" -gt $MINM ]; do
     outFn=`printf "%s/B%05d.tif" "$directoryTo" $outCount`
     outFinal=`printf "%s/%05d.tif" "$directoryTo" $outCount`
 
-    instances=`ps ax | grep enfuse | grep -v grep | wc -l`
+    instances=`ps ax | grep -E 'enfuse|convert' | grep -v grep | wc -l`
     while [ $instances -gt 3 ]; do
 	sleep 0.2
-	instances=`ps ax | grep enfuse | grep -v grep | wc -l`
-    done	
-    nice -n 19 enfuse --depth 16 -o "$outFn" "$inFnA" "$inFnB" "$inFnC" && mv "$outFn" "$outFinal" &
+	instances=`ps ax | grep -E 'enfuse|convert' | grep -v grep | wc -l`
+    done
+    if [ "${#inputs[@]}" -eq 1 ]; then
+	# nothing to fuse, just bring it to the same 16 bits RGBA enfuse gives
+	nice -n 19 convert "${inputs[0]}" -alpha opaque -depth 16 "$outFn" && mv "$outFn" "$outFinal" &
+    else
+	nice -n 19 enfuse --depth 16 -o "$outFn" "${inputs[@]}" && mv "$outFn" "$outFinal" &
+    fi
     sleep 0.2
     outCount=$((outCount+1))
     inCount=$((inCount+1))
-    inFnA=`printf "%s/%05d_m.jpg" "$directoryFrom" $inCount`
-    inFnB=`printf "%s/%05d_l.jpg" "$directoryFrom" $inCount`
-    inFnC=`printf "%s/%05d_h.jpg" "$directoryFrom" $inCount`
-    nextOne=`printf "%s/%05d_h.jpg" "$directoryFrom" $((inCount+1))`
-    if [ ! -f "$nextOne" ]; then
+    frameInputs $((inCount+1))
+    if [ "${#inputs[@]}" -eq 0 ]; then
 	echo "We might have catched up with the scan, sleeping 60 seconds"
 	sleep 60
     fi
+    frameInputs $inCount
     export spaceLeft=`getAvailableMegabytes ${directoryTo}`
 done
 
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+# Expands the raw segments (.gsr + .gsx index) of a packedRaw capture into
+# one DNG, or one 16 bits TIFF of the raw Bayer mosaic, per frame.
+#
+#   expandRawSegments.py <dirFrom> [<dirTo>] [dng|tiff]
+import os
+import sys
+import mmap
+from glob import glob
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+import DngWriter
+from RawPacking import unpackCsi2p
+from RawSegment import readIndex
+
+USAGE = f"{sys.argv[0]} <dirFrom> [<dirTo>] [dng|tiff]"
+
+args = [a for a in sys.argv[1:] if a not in ("dng", "tiff")]
+kind = "tiff" if "tiff" in sys.argv[1:] else "dng"
+if len(args) == 0 or not os.path.isdir(args[0]):
+    print(USAGE)
+    sys.exit(0)
+dirFrom = args[0]
+dirTo = args[1] if len(args) > 1 else dirFrom
+if not os.path.isdir(dirTo):
+    print(USAGE)
+    sys.exit(0)
+if kind == "tiff":
+    import tifffile as tif
+
+
+def frameArray(data, header, record):
+    width, height = header["size"]
+    rows = np.frombuffer(
+        data, dtype=np.uint8, count=record["length"], offset=record["offset"]
+    ).reshape((height, header["stride"]))
+    pattern, bits, packed = DngWriter.rawFormat(header["format"])
+    if packed:
+        return unpackCsi2p(rows, bits)
+    return rows.view(np.uint16)
+
+
+def expandSegment(indexName):
+    header, records = readIndex(indexName)
+    segmentName = indexName[:-4] + ".gsr"
+    rawConfig = {
+        "size": header["size"],
+        "stride": header["stride"],
+        "format": header["format"],
+    }
+    with open(segmentName, "rb") as h:
+        data = mmap.mmap(h.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for record in records:
+                fout = os.path.join(dirTo, f"{record['frame']:05d}.{kind}")
+                if os.path.exists(fout):
+                    continue
+                print(f"{segmentName} frame {record['frame']} to {fout}")
+                if kind == "tiff":
+                    tif.imwrite(fout, frameArray(data, header, record))
+                    continue
+                metadata = dict(record)
+                metadata["SensorBlackLevels"] = header["blackLevels"]
+                view = memoryview(data)[
+                    record["offset"] : record["offset"] + record["length"]
+                ]
+                try:
+                    DngWriter.saveDng(
+                        fout, view, rawConfig, metadata, header["model"], pack=True
+                    )
+                finally:
+                    view.release()
+        finally:
+            data.close()
+
+
+for indexName in sorted(glob(os.path.join(dirFrom, "*.gsx"))):
+    expandSegment(indexName)